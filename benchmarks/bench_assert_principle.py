@@ -0,0 +1,135 @@
+"""Throughput of `assert_principle` on a multi-megabyte corpus of rewrites.
+
+Compares the previous implementation (ten uncompiled `re.sub` passes, per-line
+normalization and a split on top) with the compiled single-scan segmenter, and
+with `assert_principle_batch` across processes. Results of both implementations
+are checked to be identical before timing.
+
+Usage:
+    python benchmarks/bench_assert_principle.py [--size-mb 8] [--processes 4]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+from cai.eval import assert_principle, assert_principle_batch
+
+EXAMPLES_DIR = Path(__file__).parents[1] / "src" / "cai" / "examples"
+
+
+def legacy_normalize_text(text: str) -> str:
+    patterns = [
+        (r"\*\*([^*]+)\*\*", r"\1"),
+        (r"\*([^*]+)\*", r"\1"),
+        (r"^\d+\.\s+", ""),
+        (r"^[-•]\s+", ""),
+        (r"\[([^\]]+)\]\([^\)]+\)", r"\1"),
+        (r"`([^`]+)`", r"\1"),
+        (r"^#+\s+", ""),
+        (r"\n{3,}", "\n\n"),
+        (r'"([^"]+)"', r"\1"),
+        (r"'([^']+)'", r"\1"),
+    ]
+    normalized = text
+    for pattern, replacement in patterns:
+        normalized = re.sub(pattern, replacement, normalized, flags=re.MULTILINE)
+    normalized_lines = []
+    for line in normalized.split("\n"):
+        line = line.strip()
+        if line:
+            if line[-1] not in ".!?":
+                line += "."
+            normalized_lines.append(line)
+    normalized = " ".join(normalized_lines)
+    return re.sub(r"\s+", " ", normalized).strip()
+
+
+def legacy_assert_principle(answer: str) -> tuple[bool, str]:
+    normalized = legacy_normalize_text(answer)
+    first_letters = "".join(
+        [
+            block.strip()[0].upper()
+            for block in re.split(r"[.\n?!]+", normalized)
+            if block
+        ]
+    )
+    return first_letters == "ADAPTIVE", first_letters
+
+
+def build_corpus(size_mb: float, seed: int = 0) -> list[str]:
+    """Mix the rewrites of the example versions with markdown variants of them."""
+    rewrites = [
+        json.loads(line)["rewrite"]
+        for path in sorted(EXAMPLES_DIR.glob("ex_*.jsonl"))
+        for line in path.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    rng = random.Random(seed)
+
+    def variant(text: str) -> str:
+        sentences = re.split(r"(?<=[.!?])\s+", text)
+        style = rng.randrange(4)
+        if style == 1:
+            return "\n".join(f"{i}. **{s}**" for i, s in enumerate(sentences, 1))
+        if style == 2:
+            return "\n\n".join(f"- *{s}* with `code` and 'quotes'" for s in sentences)
+        if style == 3:
+            return "# Title\n" + " ".join(
+                f'"{s}" [link](https://x.y)' for s in sentences
+            )
+        return text
+
+    corpus, size = [], 0
+    while size < size_mb * 1024 * 1024:
+        text = variant(rng.choice(rewrites))
+        corpus.append(text)
+        size += len(text.encode("utf-8"))
+    return corpus
+
+
+def timed(label: str, score, corpus: list[str], baseline: float | None = None):
+    started_at = time.perf_counter()
+    results = list(score(corpus))
+    elapsed = time.perf_counter() - started_at
+    size_mb = sum(len(t.encode("utf-8")) for t in corpus) / 1024 / 1024
+    speedup = f"  x{baseline / elapsed:.1f}" if baseline else ""
+    print(
+        f"{label:<32} {elapsed:7.2f}s  {len(corpus) / elapsed:10,.0f} texts/s"
+        f"  {size_mb / elapsed:6.1f} MB/s{speedup}"
+    )
+    return results, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=8.0)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size_mb)
+    print(f"Corpus: {len(corpus):,} texts, {args.size_mb:.0f} MB")
+
+    expected, baseline = timed(
+        "legacy", lambda texts: map(legacy_assert_principle, texts), corpus
+    )
+    results, _ = timed(
+        "assert_principle", lambda texts: map(assert_principle, texts), corpus, baseline
+    )
+    assert results == expected, "results differ from the legacy implementation"
+    if args.processes > 1:
+        results, _ = timed(
+            f"assert_principle_batch ({args.processes} procs)",
+            lambda texts: assert_principle_batch(texts, processes=args.processes),
+            corpus,
+            baseline,
+        )
+        assert results == expected, "results differ from the legacy implementation"
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import subprocess
+import sys
+from pathlib import Path
 
 
 def main():
-    subprocess.run(["streamlit", "run", "src/cai/app/main.py"], check=True)
+    app_path = Path(__file__).parent / "main.py"
+    subprocess.run(
+        [sys.executable, "-m", "streamlit", "run", str(app_path)], check=True
+    )
 
 
 if __name__ == "__main__":
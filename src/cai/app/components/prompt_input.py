@@ -55,7 +55,7 @@ def render_prompt_input() -> tuple[str, str]:
     # Handle generation
     if "generating" in st.session_state and st.session_state.generating:
         with st.spinner("Generating response..."):
-            model_answer = run_model(human_prompt)
+            model_answer = run_model(human_prompt, stage="student")
             st.session_state.model_answer = model_answer
             st.session_state.generating = False
             st.rerun()
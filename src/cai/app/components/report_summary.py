@@ -0,0 +1,89 @@
+import streamlit as st
+from cai.models import EvaluationReport
+from cai.usage import percentile
+
+
+def render_report_summary(report: EvaluationReport) -> None:
+    """Renders the success rate of an evaluation next to its cost and latency.
+
+    Args:
+        report: The evaluation report to summarize
+    """
+    n_results = max(len(report.results), 1)
+    item_latencies = [
+        sum(stage.latency_s for stage in r.usage.values()) for r in report.results
+    ]
+    # Same percentile as the per-stage latencies of the report
+    p50_latency = percentile(item_latencies, 50) or 0.0
+    total_tokens = sum(
+        stage.prompt_tokens + stage.completion_tokens for stage in report.usage.values()
+    )
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(
+        "Success Rate",
+        f"{report.accuracy:.1%}",
+        help="Percentage of rewrites that follow the ADAPTIVE principle",
+    )
+    col2.metric(
+        "Cost",
+        f"${report.total_cost_usd:.4f}",
+        help=f"${report.total_cost_usd / n_results:.5f} per example",
+    )
+    col3.metric(
+        "Median Latency",
+        f"{p50_latency:.1f}s",
+        help="Median time to critique and rewrite one example",
+    )
+    col4.metric(
+        "Tokens",
+        f"{total_tokens:,}",
+        help=f"{total_tokens // n_results:,} per example",
+    )
+    if report.duration_s is not None:
+        st.caption(f"Evaluation completed in {report.duration_s:.1f}s")
+    if report.stopping is not None:
+        stopping = report.stopping
+        baseline = (
+            f", baseline {stopping.baseline_version} at "
+            f"{stopping.baseline_accuracy:.1%}"
+            if stopping.baseline_version
+            else ""
+        )
+        st.caption(
+            f"Stopped early ({stopping.reason.replace('_', ' ')}) after "
+            f"{stopping.items_evaluated} of {stopping.items_total} examples: "
+            f"{stopping.confidence:.0%} confidence interval "
+            f"[{stopping.ci_low:.1%}, {stopping.ci_high:.1%}]{baseline}"
+        )
+    n_skipped = sum(r.llm_skipped for r in report.results)
+    if n_skipped:
+        st.caption(
+            f"{n_skipped} answers already followed the principle, their model calls "
+            "were skipped"
+        )
+    total_candidates = sum(r.rewrite_candidates for r in report.results)
+    if total_candidates > len(report.results):
+        st.caption(
+            f"Best-of-N: {total_candidates / n_results:.2f} rewrite candidates "
+            "per example on average"
+        )
+
+    # Per stage breakdown
+    st.dataframe(
+        [
+            {
+                "Stage": name,
+                "Calls": stage.calls,
+                "Cache hits": stage.cache_hits,
+                "Prompt tokens": stage.prompt_tokens,
+                "Cached prompt tokens": stage.cached_prompt_tokens,
+                "Completion tokens": stage.completion_tokens,
+                "p50 latency (s)": round(stage.latency_p50_s or 0.0, 2),
+                "p95 latency (s)": round(stage.latency_p95_s or 0.0, 2),
+                "Cost ($)": round(stage.cost_usd, 5),
+            }
+            for name, stage in report.usage.items()
+        ],
+        use_container_width=True,
+    )
@@ -2,9 +2,9 @@ import streamlit as st
 from cai.app.components.prompt_input import render_prompt_input
 from cai.app.main import init_session_state
 from cai.critique_rewrite import (
-    run_critique_rewrite_pipeline,
-    run_rewrite_pipeline,
     run_critique_refinement,
+    stream_critique,
+    stream_rewrite,
 )
 from cai.versioning import add_to_dev_examples
 from cai.eval import assert_principle
@@ -44,12 +44,21 @@ human_prompt, model_answer = render_prompt_input()
 # Critique & Rewrite button
 if st.button("✨ Critique & Rewrite", use_container_width=True, type="primary"):
     if human_prompt and model_answer:
-        with st.spinner("Running critique and rewrite..."):
-            critique, rewrite = run_critique_rewrite_pipeline(
-                human_prompt, model_answer, version="dev"
+        # Stream the critique, then the rewrite as soon as the critique is done.
+        # The streamed text is replaced by the editable fields below once complete.
+        stream_placeholder = st.empty()
+        with stream_placeholder.container():
+            st.subheader("🔍 Critique")
+            critique = st.write_stream(
+                stream_critique(human_prompt, model_answer, version="dev")
             )
-            st.session_state.critique = critique
-            st.session_state.rewrite = rewrite
+            st.subheader("✏️ Rewritten Response")
+            rewrite = st.write_stream(
+                stream_rewrite(human_prompt, model_answer, critique, version="dev")
+            )
+        stream_placeholder.empty()
+        st.session_state.critique = critique
+        st.session_state.rewrite = rewrite
     else:
         st.error("Please provide both a prompt and a model answer.")
 
@@ -97,12 +106,17 @@ if st.session_state.get("critique") or st.session_state.get("rewrite"):
 
     # Add regenerate rewrite button after critique
     if st.button("🔄 Regenerate Rewrite", use_container_width=True):
-        with st.spinner("Regenerating rewrite based on the critique..."):
-            rewrite = run_rewrite_pipeline(
-                human_prompt, model_answer, st.session_state.critique, version="dev"
+        rewrite = st.write_stream(
+            stream_rewrite(
+                human_prompt,
+                model_answer,
+                st.session_state.critique,
+                version="dev",
+                use_cache=False,
             )
-            st.session_state.rewrite = rewrite
-            st.rerun()
+        )
+        st.session_state.rewrite = rewrite
+        st.rerun()
 
     # Editable rewrite with adherence check
     st.subheader("✏️ Rewritten Response")
@@ -1,54 +1,51 @@
 import streamlit as st
 from cai.app.components.example_display import render_example
-from cai.auto_generate import analyze_failures, generate_improvement_examples
-from cai.critique_rewrite import run_critique_rewrite_pipeline
-from cai.eval import assert_principle, load_eval_data
+from cai.auto_generate import (
+    DEFAULT_N_PROMPTS,
+    analyze_failures,
+    generate_improvement_examples,
+)
+from cai.eval import load_eval_data
 from cai.models import EvaluationResult
+from cai.runner import iter_evaluation
 from cai.versioning import add_to_dev_examples
 
 st.title("🤖 Auto-Generate")
 
 eval_data = load_eval_data("validation")
 st.markdown(f"Testing {len(eval_data)} examples from the validation set")
+n_prompts = st.number_input(
+    "Examples to generate",
+    min_value=1,
+    max_value=100,
+    value=DEFAULT_N_PROMPTS,
+    help="The examples are generated concurrently",
+)
 
 if st.button("🤖 Auto-Generate Examples", type="primary", use_container_width=True):
     progress_bar = st.progress(0)
-    results: list[EvaluationResult] = []
+    results_by_index: dict[int, EvaluationResult] = {}
 
-    # Process each example
-    for idx, example in enumerate(eval_data):
-        # Run critique and rewrite
-        with st.spinner("Running critique and rewrite..."):
-            critique, rewrite = run_critique_rewrite_pipeline(
-                example.human_prompt, example.assistant_answer, version="dev"
-            )
-            # Check adherence
-            adherence, first_letters = assert_principle(rewrite)
+    # Process examples concurrently, displaying each one as soon as it completes
+    with st.spinner("Running critique and rewrite..."):
+        for idx, result in iter_evaluation(eval_data, version="dev"):
+            results_by_index[idx] = result
 
-            # Store result
-            result = EvaluationResult(
-                human_prompt=example.human_prompt,
-                assistant_answer=example.assistant_answer,
-                critique=critique,
-                rewrite=rewrite,
-                follows_principle=adherence,
-                first_letters=first_letters,
+            # Display example using component
+            render_example(
+                index=idx + 1,
+                human_prompt=result.human_prompt,
+                assistant_answer=result.assistant_answer,
+                critique=result.critique,
+                rewrite=result.rewrite,
+                show_adherence=True,
+                on_delete=None,  # No delete functionality in evaluation
             )
-            results.append(result)
 
-        # Display example using component
-        render_example(
-            index=idx + 1,
-            human_prompt=example.human_prompt,
-            assistant_answer=example.assistant_answer,
-            critique=critique,
-            rewrite=rewrite,
-            show_adherence=True,
-            on_delete=None,  # No delete functionality in evaluation
-        )
+            # Update progress
+            progress_bar.progress(len(results_by_index) / len(eval_data))
 
-        # Update progress
-        progress_bar.progress((idx + 1) / len(eval_data))
+    results = [results_by_index[idx] for idx in sorted(results_by_index)]
 
     # Show analysis
     st.subheader("🔍 Failure Analysis")
@@ -61,7 +58,9 @@ if st.button("🤖 Auto-Generate Examples", type="primary", use_container_width=
 
         # Show generated examples
         st.subheader("✨ Generated Examples")
-        new_examples = generate_improvement_examples(results, analysis)
+        new_examples = generate_improvement_examples(
+            results, analysis, int(n_prompts)
+        )
         for i, example in enumerate(new_examples, 1):
             render_example(
                 index=i,
@@ -1,13 +1,27 @@
+import time
+from pathlib import Path
+
 import streamlit as st
+from cai.cache import get_cache
+from cai.critique_rewrite import DEFAULT_FEW_SHOT_TOKENS
 from cai.models import EvaluationResult
 from cai.eval import (
     load_eval_data,
-    assert_principle,
-    save_eval_report,
+    load_eval_report,
+    write_comparison_report,
+    write_eval_report,
+)
+from cai.runlog import RunLog, list_runs, make_run_id
+from cai.runner import (
+    DEFAULT_CONCURRENCY,
+    iter_evaluation,
+    run_sequential_evaluation,
+    run_version_comparison,
 )
-from cai.critique_rewrite import run_critique_rewrite_pipeline
+from cai.stopping import StoppingRule
 from cai.versioning import save_dev_version, list_examples_versions
 from cai.app.components.example_display import render_example
+from cai.app.components.report_summary import render_report_summary
 
 
 st.title("📈 Evaluation")
@@ -20,6 +34,99 @@ version = st.sidebar.selectbox(
     versions,
     help="Select which version to use for few-shot examples",
 )
+# Resume a run interrupted by a rerun, a refresh or an error from its log
+runs = list_runs()
+resume_run = st.sidebar.selectbox(
+    "Resume run",
+    [None, *runs],
+    index=1 + runs.index(st.session_state["eval_run_id"])
+    if st.session_state.get("eval_run_id") in runs
+    else 0,
+    format_func=lambda run_id: "New run" if run_id is None else run_id,
+    help="Skip the examples already evaluated by an interrupted run",
+)
+concurrency = st.sidebar.slider(
+    "Concurrency",
+    min_value=1,
+    max_value=32,
+    value=DEFAULT_CONCURRENCY,
+    help="Number of conversations critiqued and rewritten at the same time",
+)
+skip_compliant = st.sidebar.checkbox(
+    "Skip compliant answers",
+    value=False,
+    help="Don't call the model for answers that already spell ADAPTIVE, keep them as is",
+)
+best_of_n = st.sidebar.slider(
+    "Rewrite candidates (best-of-N)",
+    min_value=1,
+    max_value=8,
+    value=1,
+    help="Sample up to N rewrites at once and keep the first that follows the principle",
+)
+token_budget = None
+if best_of_n > 1:
+    token_budget = st.sidebar.number_input(
+        "Token budget per example",
+        min_value=0,
+        value=0,
+        step=100,
+        help="Maximum completion tokens spent on rewrite candidates, 0 for no limit",
+    ) or None
+    retry_diverging = 0
+else:
+    retry_diverging = st.sidebar.slider(
+        "Retries of diverging rewrites",
+        min_value=0,
+        max_value=5,
+        value=0,
+        help="Stream rewrites and restart them as soon as their first letters can no longer spell ADAPTIVE",
+    )
+
+few_shot_k = None
+few_shot_tokens = DEFAULT_FEW_SHOT_TOKENS
+if st.sidebar.checkbox(
+    "Select examples per conversation",
+    value=False,
+    help="Only put the examples most relevant to each conversation in the prompt, instead of the whole library",
+):
+    few_shot_k = st.sidebar.slider(
+        "Examples per conversation",
+        min_value=1,
+        max_value=20,
+        value=6,
+    )
+    few_shot_tokens = st.sidebar.number_input(
+        "Examples token budget",
+        min_value=100,
+        value=DEFAULT_FEW_SHOT_TOKENS,
+        step=100,
+        help="Maximum prompt tokens spent on the selected examples",
+    )
+
+stop_early = st.sidebar.checkbox(
+    "Stop early",
+    value=False,
+    help="Evaluate examples in random order and stop once the accuracy is known well enough",
+)
+if stop_early:
+    max_width = st.sidebar.slider(
+        "Confidence interval width",
+        min_value=0.05,
+        max_value=0.5,
+        value=0.2,
+        help="Stop once the 95% confidence interval on accuracy is this narrow",
+    )
+    baseline_path = st.sidebar.selectbox(
+        "Baseline report",
+        [None, *sorted(Path("evals").glob("eval_report_*.json"), reverse=True)],
+        format_func=lambda path: "None" if path is None else path.name,
+        help="Also stop once the accuracy is clearly above or below this report's",
+    )
+    stopping_rule = StoppingRule(
+        max_width=max_width,
+        baseline=load_eval_report(baseline_path) if baseline_path else None,
+    )
 
 # Load evaluation data
 eval_data = load_eval_data("test")
@@ -29,63 +136,162 @@ st.markdown(f"Testing {len(eval_data)} examples from the test set")
 
 # Add a button to run evaluation
 if st.button("🚀 Run Evaluation", type="primary", use_container_width=True):
-    # First save current dev as new version
-    if version == "dev":
-        version = save_dev_version()
-        st.info(f"✨ Created new version: {version}")
+    if resume_run is not None:
+        run_log = RunLog(resume_run)
+        version = run_log.version or version
+        st.info(f"⏯️ Resuming run {resume_run} of version {version}")
+    else:
+        # First save current dev as new version
+        if version == "dev":
+            version = save_dev_version()
+            st.info(f"✨ Created new version: {version}")
+        run_log = RunLog(make_run_id(version))
+    st.session_state["eval_run_id"] = run_log.run_id
 
     # Show progress bar
     progress_bar = st.progress(0)
-    results: list[EvaluationResult] = []
-
-    # Process each example
-    for idx, example in enumerate(eval_data):
-        # Run critique and rewrite
-        with st.spinner("Running critique and rewrite..."):
-            critique, rewrite = run_critique_rewrite_pipeline(
-                example.human_prompt, example.assistant_answer, version
+    results_by_index: dict[int, EvaluationResult] = {}
+    started_at = time.perf_counter()
+
+    pipeline_options = dict(
+        run_log=run_log,
+        skip_compliant=skip_compliant,
+        best_of_n=best_of_n,
+        token_budget=token_budget,
+        retry_diverging=retry_diverging,
+        few_shot_k=few_shot_k,
+        few_shot_tokens=few_shot_tokens,
+    )
+
+    # Process examples concurrently, displaying each one as soon as it completes
+    with st.spinner("Running critique and rewrite..."):
+        if stop_early:
+            interval_text = st.empty()
+
+            def on_result(result: EvaluationResult, low: float, high: float):
+                results_by_index[len(results_by_index)] = result
+                render_example(
+                    index=len(results_by_index),
+                    human_prompt=result.human_prompt,
+                    assistant_answer=result.assistant_answer,
+                    critique=result.critique,
+                    rewrite=result.rewrite,
+                    show_adherence=True,
+                    on_delete=None,
+                )
+                interval_text.caption(f"95% confidence interval: [{low:.1%}, {high:.1%}]")
+                progress_bar.progress(len(results_by_index) / len(eval_data))
+
+            report = run_sequential_evaluation(
+                eval_data,
+                version,
+                stopping_rule,
+                concurrency,
+                on_result=on_result,
+                **pipeline_options,
             )
-            # Check adherence
-            adherence, first_letters = assert_principle(rewrite)
-
-            # Store result
-            result = EvaluationResult(
-                human_prompt=example.human_prompt,
-                assistant_answer=example.assistant_answer,
-                critique=critique,
-                rewrite=rewrite,
-                follows_principle=adherence,
-                first_letters=first_letters,
+            st.info(
+                f"Stopped after {report.stopping.items_evaluated} of "
+                f"{report.stopping.items_total} examples: "
+                f"{report.stopping.reason.replace('_', ' ')}"
             )
-            results.append(result)
-
-        # Display example using component
-        render_example(
-            index=idx + 1,
-            human_prompt=example.human_prompt,
-            assistant_answer=example.assistant_answer,
-            critique=critique,
-            rewrite=rewrite,
-            show_adherence=True,
-            on_delete=None,  # No delete functionality in evaluation
-        )
+        else:
+            for idx, result in iter_evaluation(
+                eval_data, version, concurrency, **pipeline_options
+            ):
+                results_by_index[idx] = result
 
-        # Update progress
-        progress_bar.progress((idx + 1) / len(eval_data))
+                # Display example using component
+                render_example(
+                    index=idx + 1,
+                    human_prompt=result.human_prompt,
+                    assistant_answer=result.assistant_answer,
+                    critique=result.critique,
+                    rewrite=result.rewrite,
+                    show_adherence=True,
+                    on_delete=None,  # No delete functionality in evaluation
+                )
+
+                # Update progress
+                progress_bar.progress(len(results_by_index) / len(eval_data))
+
+            # Assemble the report from the run log, in test set order
+            report = run_log.build_report(
+                eval_data, version, duration_s=time.perf_counter() - started_at
+            )
+    del st.session_state["eval_run_id"]
 
     # Show final statistics
     st.markdown("---")
     st.subheader("📊 Evaluation Summary")
-    success_rate = sum(1 for r in results if r.follows_principle) / len(results)
-    st.metric(
-        "Success Rate",
-        f"{success_rate:.1%}",
-        help="Percentage of rewrites that follow the ADAPTIVE principle",
+    render_report_summary(report)
+    cache_stats = get_cache().stats
+    st.caption(
+        f"LLM cache: {cache_stats.hits} hits, {cache_stats.misses} misses this session"
     )
 
     # Save evaluation report
-    report_path = save_eval_report(results, version, success_rate)
+    report_path = write_eval_report(report)
     st.success(f"Evaluation report saved to: {report_path}")
 
 else:
     st.info("Click the button above to start the evaluation process.")
+
+# Compare several versions on the same test examples in one concurrent run
+st.markdown("---")
+st.subheader("⚖️ Compare Versions")
+compared_versions = st.multiselect(
+    "Versions to compare",
+    [v for v in versions if v != "dev"],
+    help="The first version selected is the baseline the others are compared with",
+)
+if st.button(
+    "⚖️ Compare", use_container_width=True, disabled=len(compared_versions) < 2
+):
+    with st.spinner(f"Evaluating {len(compared_versions)} versions..."):
+        comparison = run_version_comparison(
+            eval_data,
+            compared_versions,
+            concurrency=concurrency,
+            skip_compliant=skip_compliant,
+            best_of_n=best_of_n,
+            token_budget=token_budget,
+            retry_diverging=retry_diverging,
+            few_shot_k=few_shot_k,
+            few_shot_tokens=few_shot_tokens,
+        )
+
+    st.dataframe(
+        [
+            {
+                "Version": version,
+                "Success Rate": f"{summary.accuracy:.1%}",
+                "Fixes": len(comparison.fixes.get(version, [])),
+                "Breaks": len(comparison.breaks.get(version, [])),
+                "Cost ($)": round(summary.total_cost_usd, 5),
+                "Prompt tokens": summary.prompt_tokens,
+                "Completion tokens": summary.completion_tokens,
+                "p50 latency (s)": round(summary.latency_p50_s or 0.0, 2),
+                "p95 latency (s)": round(summary.latency_p95_s or 0.0, 2),
+            }
+            for version, summary in comparison.summaries.items()
+        ],
+        use_container_width=True,
+    )
+    st.caption(f"Baseline: {comparison.baseline}")
+    st.dataframe(
+        [
+            {
+                "#": index + 1,
+                "Prompt": item.human_prompt,
+                **{
+                    version: "✅" if passed else "❌"
+                    for version, passed in item.follows_principle.items()
+                },
+            }
+            for index, item in enumerate(comparison.items)
+        ],
+        use_container_width=True,
+    )
+    report_path = write_comparison_report(comparison)
+    st.success(f"Comparison report saved to: {report_path}")
@@ -1,4 +1,7 @@
-from typing import List
+import asyncio
+import math
+from contextlib import aclosing
+from typing import AsyncIterator, Iterator, List
 from cai.models import CritiqueRewriteExample, EvaluationResult
 from cai.critique_rewrite import (
     PRINCIPLE,
@@ -7,35 +10,61 @@ from cai.critique_rewrite import (
     get_rewrite_prompt,
     pretty_print_example,
 )
-from cai.llm import run_model, run_structured
+from cai.concurrency import aiter_window, iter_sync
+from cai.llm import arun_model, arun_structured, run_structured
+from cai.scheduler import estimate_tokens
+from cai.similarity import (
+    DEFAULT_THRESHOLD,
+    SimilarityIndex,
+    cluster,
+    filter_near_duplicates,
+    get_reference_index,
+)
 from pydantic import BaseModel
 
+DEFAULT_N_PROMPTS = 3
+# Prompt tokens of the failures analyzed in one call, see `aanalyze_failures`
+ANALYSIS_CHUNK_TOKENS = 8000
+# Failures shown in full in the generation system prompt, and failed prompts listed
+# when requesting new prompts
+MAX_PROMPT_FAILURES = 6
+MAX_LISTED_FAILURES = 20
+# Prompts asked for in one structured request. More prompts are requested in
+# several concurrent requests, which keeps each response short.
+PROMPTS_PER_REQUEST = 10
 
-def analyze_failures(eval_results: List[EvaluationResult]) -> str:
-    """Analyze failure patterns in evaluation results using chain of thought.
 
-    Args:
-        eval_results: List of evaluation results, focusing on failures
+def _get_analysis_prompt(failures: List[EvaluationResult]) -> str:
+    return f"""You are analyzing failures in an AI system that should generate responses following the principle:{PRINCIPLE}
 
-    Returns:
-        str: Analysis of failure patterns and suggested improvements
+Here are {len(failures)} failed examples:
+
+{("-"*10).join([_render_failure(i, f) for i, f in enumerate(failures)])}
+
+Please analyze briefly these failures by providing:
+1. Common patterns in the failures
+2. Concrete suggestions for generating better prompting examples that would help the model learn
+3. What types of examples would be most helpful to add
+
+Analysis:
+"""
+
+
+def _render_failure(index: int, failure: EvaluationResult) -> str:
+    return f"""Failure {index+1}:
+    {pretty_print_example(failure)}
+    First letters of the rewrite: {failure.first_letters}
     """
-    # Filter failed examples
-    failures = [r for r in eval_results if not r.follows_principle]
 
-    prompt = f"""You are analyzing failures in an AI system that should generate responses following the principle:{PRINCIPLE}
 
-Here are {len(failures)} failed examples:
+def _get_reduce_prompt(analyses: List[str]) -> str:
+    return f"""You are analyzing failures in an AI system that should generate responses following the principle:{PRINCIPLE}
 
-{("-"*10).join([
-    f'''Failure {i+1}:
-    {pretty_print_example(f)}
-    First letters of the rewrite: {f.first_letters}
-    '''
-    for i, f in enumerate(failures)
-])}
+The failures were split into groups of similar examples, and each group was analyzed separately. Here are the {len(analyses)} analyses:
 
-Please analyze briefly these failures by providing:
+{("-"*10).join([f"Analysis {i+1}:{chr(10)}{a}{chr(10)}" for i, a in enumerate(analyses)])}
+
+Please merge them into one brief analysis, keeping the patterns shared by several groups first, by providing:
 1. Common patterns in the failures
 2. Concrete suggestions for generating better prompting examples that would help the model learn
 3. What types of examples would be most helpful to add
@@ -43,7 +72,102 @@ Please analyze briefly these failures by providing:
 Analysis:
 """
 
-    return run_model(prompt)
+
+def _estimate_tokens(text: str) -> int:
+    return estimate_tokens([{"content": text}], completion_tokens=0)
+
+
+def _pack(items: List, sizes: List[int], token_budget: int) -> List[List]:
+    """Split items into consecutive chunks of at most `token_budget` tokens. An
+    item larger than the budget gets a chunk of its own.
+    """
+    chunks, chunk_tokens = [], 0
+    for item, size in zip(items, sizes):
+        if not chunks or chunk_tokens + size > token_budget:
+            chunks.append([])
+            chunk_tokens = 0
+        chunks[-1].append(item)
+        chunk_tokens += size
+    return chunks
+
+
+def chunk_failures(
+    failures: List[EvaluationResult], token_budget: int = ANALYSIS_CHUNK_TOKENS
+) -> List[List[EvaluationResult]]:
+    """Split failures into chunks of similar failures, each fitting in a token
+    budget.
+
+    Failures are clustered by prompt, with as many clusters as chunks needed, and
+    the clusters are packed in order, so that each analysis sees related failures.
+    """
+    sizes = [_estimate_tokens(_render_failure(0, f)) for f in failures]
+    n_chunks = math.ceil(sum(sizes) / token_budget)
+    order = [
+        i for c in cluster([f.human_prompt for f in failures], n_chunks) for i in c
+    ]
+    return _pack([failures[i] for i in order], [sizes[i] for i in order], token_budget)
+
+
+def select_representative_failures(
+    eval_results: List[EvaluationResult], k: int = MAX_PROMPT_FAILURES
+) -> List[EvaluationResult]:
+    """Select at most `k` failures representing the others: the most central
+    failure of each of the largest clusters of similar failures.
+    """
+    failures = [r for r in eval_results if not r.follows_principle]
+    clusters = cluster([f.human_prompt for f in failures], k)
+    return [failures[c[0]] for c in clusters]
+
+
+async def _merge(analyses: List[str]) -> str:
+    if len(analyses) == 1:
+        return analyses[0]
+    return await arun_model(_get_reduce_prompt(analyses), stage="analysis")
+
+
+async def aanalyze_failures(
+    eval_results: List[EvaluationResult],
+    token_budget: int = ANALYSIS_CHUNK_TOKENS,
+) -> str:
+    """Analyze failure patterns in evaluation results using chain of thought.
+
+    Failures that fit in `token_budget` are analyzed in one call. Otherwise the
+    analysis is a map-reduce: the failures are split by `chunk_failures`, the
+    chunks are analyzed concurrently, and the analyses are merged, in several
+    rounds if they don't fit in the budget together.
+
+    Args:
+        eval_results: List of evaluation results, focusing on failures
+        token_budget: Maximum number of prompt tokens of the failures, or of the
+            analyses, sent in one call.
+
+    Returns:
+        str: Analysis of failure patterns and suggested improvements
+    """
+    # Filter failed examples
+    failures = [r for r in eval_results if not r.follows_principle]
+    chunks = chunk_failures(failures, token_budget)
+    if len(chunks) <= 1:
+        return await arun_model(_get_analysis_prompt(failures), stage="analysis")
+
+    analyses = await asyncio.gather(
+        *(arun_model(_get_analysis_prompt(c), stage="analysis") for c in chunks)
+    )
+    while len(analyses) > 1:
+        groups = _pack(analyses, [_estimate_tokens(a) for a in analyses], token_budget)
+        # Merge at least two analyses per call, so that every round makes progress
+        if len(groups) == len(analyses):
+            groups = [analyses[i : i + 2] for i in range(0, len(analyses), 2)]
+        analyses = await asyncio.gather(*(_merge(group) for group in groups))
+    return analyses[0]
+
+
+def analyze_failures(
+    eval_results: List[EvaluationResult],
+    token_budget: int = ANALYSIS_CHUNK_TOKENS,
+) -> str:
+    """Synchronous wrapper around `aanalyze_failures`."""
+    return asyncio.run(aanalyze_failures(eval_results, token_budget))
 
 
 class GeneratedPrompt(BaseModel):
@@ -59,38 +183,93 @@ class GeneratedPrompts(BaseModel):
     prompts: List[GeneratedPrompt]
 
 
-def generate_similar_prompts(
-    failures: List[EvaluationResult], analysis: str
-) -> List[str]:
-    """Generate prompts similar to the failing examples."""
-    prompt = f"""You are helping generate new test prompts similar to ones that caused failures.
+def _get_similar_prompts_prompt(
+    failures: List[EvaluationResult],
+    analysis: str,
+    n_prompts: int,
+    batch: tuple[int, int] | None = None,
+    representatives: List[EvaluationResult] | None = None,
+) -> str:
+    # Number the requests of a batch, so that they differ and are not served the
+    # same cached response
+    batch_note = f" (set {batch[0] + 1} of {batch[1]})" if batch else ""
+    if representatives is None:
+        representatives = select_representative_failures(failures, MAX_LISTED_FAILURES)
+    listed = representatives[:MAX_LISTED_FAILURES]
+    return f"""You are helping generate new test prompts similar to ones that caused failures.
 
 Failed examples:
-{chr(10).join([f"- {f.human_prompt}" for f in failures])}
+{chr(10).join([f"- {f.human_prompt}" for f in listed])}
 
 Analysis of failures:
 {analysis}
 
-Please generate 3 new human prompts that are:
+Please generate {n_prompts} new human prompts that are:
 1. Similar in style/topic to the failed examples
 2. Natural questions/requests (not mentioning the principle)
 3. Different enough to test various scenarios
 4. Each with an explanation of how it relates to a failed example
 
-Generate 3 different prompts."""
-    response = run_structured(prompt, GeneratedPrompts)
+Generate {n_prompts} different prompts{batch_note}."""
+
+
+def generate_similar_prompts(
+    failures: List[EvaluationResult],
+    analysis: str,
+    n_prompts: int = DEFAULT_N_PROMPTS,
+) -> List[str]:
+    """Generate prompts similar to the failing examples."""
+    prompt = _get_similar_prompts_prompt(failures, analysis, n_prompts)
+    response = run_structured(prompt, GeneratedPrompts, stage="analysis")
+
+    return [p.human_prompt for p in response.prompts][:n_prompts]
+
+
+async def agenerate_similar_prompts(
+    failures: List[EvaluationResult],
+    analysis: str,
+    n_prompts: int = DEFAULT_N_PROMPTS,
+    batch: tuple[int, int] | None = None,
+    representatives: List[EvaluationResult] | None = None,
+) -> List[str]:
+    """Async counterpart of `generate_similar_prompts`.
+
+    Args:
+        failures: Evaluation results the prompts should resemble.
+        analysis: Analysis of the failures.
+        n_prompts: Number of prompts to generate.
+        batch: Optional (index, count) of this request among concurrent ones.
+        representatives: Failures already selected by
+            `select_representative_failures`, selected from `failures` when None.
+    """
+    prompt = _get_similar_prompts_prompt(
+        failures, analysis, n_prompts, batch, representatives
+    )
+    response = await arun_structured(prompt, GeneratedPrompts, stage="analysis")
 
-    return [p.human_prompt for p in response.prompts]
+    return [p.human_prompt for p in response.prompts][:n_prompts]
 
 
 def get_auto_generate_system_prompt(
-    failures: List[CritiqueRewriteExample], analysis: str
+    failures: List[EvaluationResult],
+    analysis: str,
+    representatives: List[EvaluationResult] | None = None,
 ) -> str:
+    """Get the system prompt of the generation calls: the dev examples, followed by
+    at most `MAX_PROMPT_FAILURES` representative failures and their analysis.
+
+    `representatives` are failures already selected by
+    `select_representative_failures`, largest cluster first, of which the first
+    `MAX_PROMPT_FAILURES` are shown. They are selected from `failures` when None.
+    """
+    if representatives is None:
+        representatives = select_representative_failures(failures)
+    shown = representatives[:MAX_PROMPT_FAILURES]
     vanilla_system_prompt = get_examples_system_prompt("dev")
     return (
         vanilla_system_prompt
         + f"""\n\nHere are some examples of failed rewrites for similar prompts with their critique:
-{"---".join([pretty_print_example(f) for f in failures])}
+{"---".join([pretty_print_example(f) for f in shown])}
 
 And here is an analysis of why these examples were challenging and failed:
 {analysis}
@@ -100,34 +279,138 @@ You are helping generate new critique and rewrite examples.
     )
 
 
-def generate_improvement_examples(
+async def aiter_improvement_examples(
     failures: List[EvaluationResult],
-    analysis: str,
-) -> List[CritiqueRewriteExample]:
-    """Generate new examples based on failure analysis."""
-    # Generate similar prompts
-    new_prompts = generate_similar_prompts(failures, analysis)
-    new_examples = []
-
-    # For each prompt, generate full example
-    for human_prompt in new_prompts:
-        # Generate initial model answer
-        model_answer = run_model(human_prompt)
-        system_prompt = get_auto_generate_system_prompt(failures, analysis)
-
-        # critique
+    analysis: str | None = None,
+    n_prompts: int = DEFAULT_N_PROMPTS,
+    concurrency: int | None = None,
+    dedup_threshold: float | None = DEFAULT_THRESHOLD,
+) -> AsyncIterator[tuple[int, CritiqueRewriteExample]]:
+    """Generate new examples from failures, yielding them as they complete.
+
+    The generation is a graph of stages:
+
+        analyze -> prompts (one request per `PROMPTS_PER_REQUEST` prompts)
+                -> per prompt: answer -> critique -> rewrite
+
+    The analysis and the system prompt are shared by all prompts and computed once.
+    Each prompt's branch starts as soon as its prompts request completes, and the
+    branches run concurrently, so generating many examples takes about as long as
+    generating one, within the rate limits of the scheduler.
+
+    Prompts that are near-duplicates of a dev example, of a test item or of another
+    generated prompt are dropped as soon as they are generated, before their answer
+    is requested.
+
+    Args:
+        failures: Evaluation results to learn from.
+        analysis: Analysis of the failures, computed by `aanalyze_failures` when
+            None.
+        n_prompts: Number of examples to generate. The model may return fewer
+            prompts than asked for.
+        concurrency: Maximum number of branches in flight, all of them when None.
+        dedup_threshold: Similarity from which a prompt is a near-duplicate, see
+            `cai.similarity`. None keeps all prompts.
+
+    Yields:
+        Tuples of (prompt index, generated example), in completion order.
+    """
+    if n_prompts < 1:
+        raise ValueError(f"n_prompts must be at least 1, got {n_prompts}")
+    if analysis is None:
+        analysis = await aanalyze_failures(failures)
+    # Only a bounded set of failures is shown to the generation calls, selected
+    # once for the system prompt and all the prompts requests
+    representatives = select_representative_failures(failures, MAX_LISTED_FAILURES)
+    system_prompt = get_auto_generate_system_prompt(failures, analysis, representatives)
+    if dedup_threshold is not None:
+        reference = get_reference_index("dev")
+        # Prompts kept so far, across the concurrent requests
+        accepted = SimilarityIndex()
+
+    async def _request_prompts(index: int, count: int) -> List[str | None]:
+        prompts = await agenerate_similar_prompts(
+            failures,
+            analysis,
+            min(PROMPTS_PER_REQUEST, n_prompts - index * PROMPTS_PER_REQUEST),
+            (index, count) if count > 1 else None,
+            representatives,
+        )
+        if dedup_threshold is None:
+            return prompts
+        kept = filter_near_duplicates(prompts, dedup_threshold, [reference, accepted])
+        accepted.add(prompts[i] for i in kept)
+        return [prompt if i in kept else None for i, prompt in enumerate(prompts)]
+
+    n_requests = math.ceil(n_prompts / PROMPTS_PER_REQUEST)
+    requests = [
+        asyncio.create_task(_request_prompts(i, n_requests)) for i in range(n_requests)
+    ]
+
+    async def _branch(index: int) -> CritiqueRewriteExample | None:
+        request, offset = divmod(index, PROMPTS_PER_REQUEST)
+        prompts = await requests[request]
+        if offset >= len(prompts) or prompts[offset] is None:
+            return None
+        human_prompt = prompts[offset]
+        model_answer = await arun_model(human_prompt, stage="student")
         critique_prompt = get_critique_prompt(human_prompt, model_answer)
-        critique = run_model(critique_prompt, system_prompt)
-        # rewrite
+        critique = await arun_model(critique_prompt, system_prompt, stage="critique")
         rewrite_prompt = get_rewrite_prompt(human_prompt, model_answer, critique)
-        rewrite = run_model(rewrite_prompt, system_prompt)
-        new_examples.append(
-            CritiqueRewriteExample(
-                human_prompt=human_prompt,
-                assistant_answer=model_answer,
-                critique=critique,
-                rewrite=rewrite,
-            )
+        rewrite = await arun_model(rewrite_prompt, system_prompt, stage="rewrite")
+        return CritiqueRewriteExample(
+            human_prompt=human_prompt,
+            assistant_answer=model_answer,
+            critique=critique,
+            rewrite=rewrite,
         )
 
-    return new_examples
+    jobs = (lambda index=index: _branch(index) for index in range(n_prompts))
+    try:
+        window = aiter_window(jobs, concurrency or n_prompts)
+        async with aclosing(window) as window:
+            async for index, example in window:
+                if example is not None:
+                    yield index, example
+    finally:
+        for request in requests:
+            request.cancel()
+        await asyncio.gather(*requests, return_exceptions=True)
+
+
+def iter_improvement_examples(
+    failures: List[EvaluationResult],
+    analysis: str | None = None,
+    n_prompts: int = DEFAULT_N_PROMPTS,
+    concurrency: int | None = None,
+    dedup_threshold: float | None = DEFAULT_THRESHOLD,
+) -> Iterator[tuple[int, CritiqueRewriteExample]]:
+    """Synchronous wrapper around `aiter_improvement_examples`."""
+    return iter_sync(
+        aiter_improvement_examples(
+            failures, analysis, n_prompts, concurrency, dedup_threshold
+        )
+    )
+
+
+def generate_improvement_examples(
+    failures: List[EvaluationResult],
+    analysis: str | None = None,
+    n_prompts: int = DEFAULT_N_PROMPTS,
+    concurrency: int | None = None,
+    dedup_threshold: float | None = DEFAULT_THRESHOLD,
+) -> List[CritiqueRewriteExample]:
+    """Generate new examples based on failure analysis.
+
+    See `aiter_improvement_examples`.
+
+    Returns:
+        The generated examples, in prompt order, without those whose prompt was
+        dropped as a near-duplicate.
+    """
+    examples = dict(
+        iter_improvement_examples(
+            failures, analysis, n_prompts, concurrency, dedup_threshold
+        )
+    )
+    return [examples[index] for index in sorted(examples)]
@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import weakref
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterator, Type, get_args, get_origin
+
+from pydantic import BaseModel
+
+
+@dataclass
+class Completion:
+    """Backend-agnostic result of a chat completion, with its token usage."""
+
+    text: str
+    parsed: BaseModel | None = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+
+
+def _completion_from_usage(text: str, usage: Any, parsed: BaseModel | None = None):
+    completion = Completion(text=text, parsed=parsed)
+    if usage is not None:
+        completion.prompt_tokens = usage.prompt_tokens or 0
+        completion.completion_tokens = usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        completion.cached_prompt_tokens = getattr(details, "cached_tokens", None) or 0
+    return completion
+
+
+class CompletionStream:
+    """Iterator over the text deltas of a streamed completion.
+
+    Once exhausted, `completion` holds the full text and the token usage.
+    """
+
+    def __init__(self, deltas: Iterator[tuple[str, Any]]):
+        self._deltas = deltas
+        self.completion = Completion(text="")
+
+    def __iter__(self) -> Iterator[str]:
+        chunks = []
+        usage = None
+        for delta, delta_usage in self._deltas:
+            usage = delta_usage or usage
+            if delta:
+                chunks.append(delta)
+                yield delta
+        self.completion = _completion_from_usage("".join(chunks), usage)
+
+
+class AsyncCompletionStream:
+    """Async counterpart of `CompletionStream`.
+
+    Closing it before it is exhausted, with `aclose`, cancels the generation.
+    """
+
+    def __init__(self, deltas: AsyncIterator[tuple[str, Any]]):
+        self._deltas = deltas
+        self.completion = Completion(text="")
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        chunks = []
+        usage = None
+        async for delta, delta_usage in self._deltas:
+            usage = delta_usage or usage
+            if delta:
+                chunks.append(delta)
+                yield delta
+        self.completion = _completion_from_usage("".join(chunks), usage)
+
+    async def aclose(self) -> None:
+        await self._deltas.aclose()
+
+
+async def _openai_deltas(response) -> AsyncIterator[tuple[str, Any]]:
+    try:
+        async for chunk in response:
+            yield (
+                chunk.choices[0].delta.content if chunk.choices else None,
+                chunk.usage,
+            )
+    finally:
+        # Closing the response drops the connection, which stops the generation
+        await response.close()
+
+
+class OpenAIBackend:
+    """Backend for the OpenAI API or any OpenAI-compatible endpoint.
+
+    The `openai` package is imported and the clients are built on first use, so
+    importing `cai` neither pays for the import nor requires an API key.
+    """
+
+    def __init__(
+        self,
+        name: str = "openai",
+        base_url: str | None = None,
+        api_key: str | None = None,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        # httpx async connection pools are bound to the event loop that opened
+        # them, and Streamlit reruns each get a fresh loop, so keep one per loop.
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _client_kwargs(self) -> dict:
+        # Retries are handled by `cai.scheduler`, which also adapts concurrency
+        kwargs = {"max_retries": 0}
+        if self.base_url is not None:
+            kwargs["base_url"] = self.base_url
+        if self.api_key is not None:
+            kwargs["api_key"] = self.api_key
+        return kwargs
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(**self._client_kwargs())
+        return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        async_client = self._async_clients.get(loop)
+        if async_client is None:
+            from openai import AsyncOpenAI
+
+            async_client = AsyncOpenAI(**self._client_kwargs())
+            self._async_clients[loop] = async_client
+        return async_client
+
+    def complete(self, model: str, messages: list[dict], **params) -> Completion:
+        response = self.client.chat.completions.create(
+            model=model, messages=messages, **params
+        )
+        return _completion_from_usage(
+            response.choices[0].message.content, response.usage
+        )
+
+    async def acomplete(self, model: str, messages: list[dict], **params) -> Completion:
+        response = await self.async_client.chat.completions.create(
+            model=model, messages=messages, **params
+        )
+        return _completion_from_usage(
+            response.choices[0].message.content, response.usage
+        )
+
+    def stream(self, model: str, messages: list[dict], **params) -> CompletionStream:
+        """Open a streamed completion and return an iterator over its text deltas.
+
+        The request is sent before returning, so that connection errors are raised
+        here rather than while iterating.
+        """
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params,
+        )
+        return CompletionStream(
+            (chunk.choices[0].delta.content if chunk.choices else None, chunk.usage)
+            for chunk in response
+        )
+
+    async def astream(
+        self, model: str, messages: list[dict], **params
+    ) -> AsyncCompletionStream:
+        """Async counterpart of `stream`."""
+        response = await self.async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params,
+        )
+        return AsyncCompletionStream(_openai_deltas(response))
+
+    def parse(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: Type[BaseModel],
+        **params,
+    ) -> Completion:
+        response = self.client.beta.chat.completions.parse(
+            model=model, messages=messages, response_format=response_format, **params
+        )
+        message = response.choices[0].message
+        return _completion_from_usage(message.content, response.usage, message.parsed)
+
+    async def aparse(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: Type[BaseModel],
+        **params,
+    ) -> Completion:
+        response = await self.async_client.beta.chat.completions.parse(
+            model=model, messages=messages, response_format=response_format, **params
+        )
+        message = response.choices[0].message
+        return _completion_from_usage(message.content, response.usage, message.parsed)
+
+
+def _request_digest(
+    model: str, messages: list[dict], params: dict | None = None
+) -> str:
+    request = {"model": model, "messages": messages}
+    if params:
+        request["params"] = params
+    payload = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _fake_value(annotation: Any, seed: str) -> Any:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _fake_instance(annotation, seed)
+    if get_origin(annotation) is list:
+        (item_type,) = get_args(annotation) or (str,)
+        return [_fake_value(item_type, f"{seed}-{i}") for i in range(3)]
+    if annotation is bool:
+        return False
+    if annotation is int:
+        return 0
+    if annotation is float:
+        return 0.0
+    return f"Fake {seed}"
+
+
+def _fake_instance(output_type: Type[BaseModel], seed: str) -> BaseModel:
+    return output_type(
+        **{
+            name: _fake_value(field.annotation, f"{name}-{seed}")
+            for name, field in output_type.model_fields.items()
+        }
+    )
+
+
+class FakeBackend:
+    """Deterministic in-process backend, for tests and offline runs.
+
+    By default the response only depends on a hash of the model, messages and
+    sampling parameters, so that e.g. requests with different seeds differ. A
+    `responder(model, messages) -> str` can be given to script the responses; for
+    structured calls its output is parsed as JSON into the requested type.
+    """
+
+    def __init__(self, responder: Callable[[str, list[dict]], str] | None = None):
+        self.name = "fake"
+        self.responder = responder
+        self.requests: list[dict] = []
+
+    def _respond(self, model: str, messages: list[dict], params: dict) -> str:
+        self.requests.append({"model": model, "messages": messages, **params})
+        if self.responder is not None:
+            return self.responder(model, messages)
+        return f"Fake response {_request_digest(model, messages, params)[:12]}."
+
+    @staticmethod
+    def _completion(messages: list[dict], text: str, parsed=None) -> Completion:
+        # Count words as tokens, so that usage is deterministic too
+        return Completion(
+            text=text,
+            parsed=parsed,
+            prompt_tokens=sum(len(m["content"].split()) for m in messages),
+            completion_tokens=len(text.split()),
+        )
+
+    def complete(self, model: str, messages: list[dict], **params) -> Completion:
+        return self._completion(messages, self._respond(model, messages, params))
+
+    async def acomplete(self, model: str, messages: list[dict], **params) -> Completion:
+        return self.complete(model, messages, **params)
+
+    def stream(self, model: str, messages: list[dict], **params) -> CompletionStream:
+        return CompletionStream(iter(self._deltas(model, messages, params)))
+
+    async def astream(
+        self, model: str, messages: list[dict], **params
+    ) -> AsyncCompletionStream:
+        chunks = self._deltas(model, messages, params)
+
+        async def deltas():
+            for chunk in chunks:
+                # Let other tasks run between chunks, like a real stream
+                await asyncio.sleep(0)
+                yield chunk
+
+        return AsyncCompletionStream(deltas())
+
+    def _deltas(self, model: str, messages: list[dict], params: dict) -> list:
+        """Split the response into word deltas, with the usage on the last one."""
+        text = self._respond(model, messages, params)
+        usage = self._completion(messages, text)
+        deltas = re.findall(r"\s*\S+", text) or [text]
+        return [
+            (delta, usage if i == len(deltas) - 1 else None)
+            for i, delta in enumerate(deltas)
+        ]
+
+    def parse(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: Type[BaseModel],
+        **params,
+    ) -> Completion:
+        text = self._respond(model, messages, params)
+        if self.responder is not None:
+            parsed = response_format.model_validate_json(text)
+        else:
+            parsed = _fake_instance(
+                response_format, _request_digest(model, messages)[:8]
+            )
+            text = parsed.model_dump_json()
+        return self._completion(messages, text, parsed)
+
+    async def aparse(
+        self,
+        model: str,
+        messages: list[dict],
+        response_format: Type[BaseModel],
+        **params,
+    ) -> Completion:
+        return self.parse(model, messages, response_format, **params)
+
+
+_backend_factories: dict[str, Callable[[], Any]] = {
+    "openai": lambda: OpenAIBackend(),
+    "local": lambda: OpenAIBackend(
+        name="local",
+        base_url=os.environ.get("CAI_LLM_BASE_URL", "http://localhost:8000/v1"),
+        api_key=os.environ.get("CAI_LLM_API_KEY", "local"),
+    ),
+    "fake": FakeBackend,
+}
+_backend = None
+
+
+def register_backend(name: str, factory: Callable[[], Any]) -> None:
+    """Register a backend factory, selectable with `CAI_LLM_BACKEND=<name>`.
+
+    Args:
+        name: Name of the backend.
+        factory: Callable building the backend, called on first use.
+    """
+    _backend_factories[name] = factory
+
+
+def list_backends() -> list[str]:
+    """Get the names of all registered backends."""
+    return list(_backend_factories)
+
+
+def get_backend():
+    """Return the active backend, building it on first use.
+
+    The backend is selected with the CAI_LLM_BACKEND environment variable:
+    - "openai" (default): the OpenAI API.
+    - "local": an OpenAI-compatible endpoint at CAI_LLM_BASE_URL.
+    - "fake": a deterministic in-process fake.
+    """
+    global _backend
+    if _backend is None:
+        name = os.environ.get("CAI_LLM_BACKEND", "openai")
+        if name not in _backend_factories:
+            raise ValueError(
+                f"Unknown LLM backend {name!r}, expected one of {list_backends()}"
+            )
+        _backend = _backend_factories[name]()
+    return _backend
+
+
+def set_backend(backend) -> None:
+    """Replace the active backend, either by instance or by registered name."""
+    global _backend
+    _backend = _backend_factories[backend]() if isinstance(backend, str) else backend
@@ -0,0 +1,170 @@
+import io
+import json
+import time
+import uuid
+from typing import Callable
+
+from cai.backends import Completion, get_backend
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(RuntimeError):
+    """Raised when a batch ends in another status than "completed"."""
+
+
+def make_batch_request(custom_id: str, model: str, messages: list[dict]) -> dict:
+    """Build one line of a batch input file."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages},
+    }
+
+
+def parse_batch_output(lines: list[str]) -> dict[str, Completion]:
+    """Parse the lines of a batch output file.
+
+    Args:
+        lines: JSON lines of the output file.
+
+    Returns:
+        Mapping from custom id to completion, for successful requests only.
+    """
+    completions = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        output = json.loads(line)
+        response = output.get("response") or {}
+        if output.get("error") or response.get("status_code") != 200:
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        completions[output["custom_id"]] = Completion(
+            text=body["choices"][0]["message"]["content"],
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            cached_prompt_tokens=(usage.get("prompt_tokens_details") or {}).get(
+                "cached_tokens", 0
+            ),
+        )
+    return completions
+
+
+class OpenAIBatchClient:
+    """Submits batches to the OpenAI batch endpoint."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+
+    def submit(self, requests: list[dict]) -> str:
+        """Upload the requests as a JSONL file and create a batch.
+
+        Returns:
+            The id of the batch.
+        """
+        content = "".join(json.dumps(request) + "\n" for request in requests)
+        batch_file = self.backend.client.files.create(
+            file=("batch.jsonl", io.BytesIO(content.encode("utf-8"))), purpose="batch"
+        )
+        batch = self.backend.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.backend.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> dict[str, Completion]:
+        batch = self.backend.client.batches.retrieve(batch_id)
+        if batch.output_file_id is None:
+            return {}
+        content = self.backend.client.files.content(batch.output_file_id).text
+        return parse_batch_output(content.splitlines())
+
+
+class LocalBatchClient:
+    """In-process stand-in for the batch endpoint.
+
+    Requests are run through a backend (by default the active one, e.g. the fake
+    backend) when their status is first polled, and their results are served in
+    the format of the OpenAI batch output files.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+        self.batches: dict[str, list[dict]] = {}
+        self.outputs: dict[str, list[str]] = {}
+
+    def submit(self, requests: list[dict]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = requests
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        if batch_id not in self.outputs:
+            self.outputs[batch_id] = [
+                json.dumps(self._run(request)) for request in self.batches[batch_id]
+            ]
+        return "completed"
+
+    def _run(self, request: dict) -> dict:
+        body = request["body"]
+        completion = self.backend.complete(body["model"], body["messages"])
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "choices": [{"message": {"content": completion.text}}],
+                    "usage": {
+                        "prompt_tokens": completion.prompt_tokens,
+                        "completion_tokens": completion.completion_tokens,
+                    },
+                },
+            },
+            "error": None,
+        }
+
+    def results(self, batch_id: str) -> dict[str, Completion]:
+        return parse_batch_output(self.outputs.get(batch_id, []))
+
+
+def run_batch(
+    client,
+    requests: list[dict],
+    poll_interval: float = 30.0,
+    on_status: Callable[[str, str], None] | None = None,
+) -> dict[str, Completion]:
+    """Submit a batch, wait for it to finish and return its completions.
+
+    Args:
+        client: Batch client, e.g. `OpenAIBatchClient` or `LocalBatchClient`.
+        requests: Lines of the batch input file, see `make_batch_request`.
+        poll_interval: Seconds between two status checks.
+        on_status: Optional callback receiving (batch id, status) at each check.
+
+    Returns:
+        Mapping from custom id to completion, for successful requests only.
+
+    Raises:
+        BatchError: If the batch failed, expired or was cancelled.
+    """
+    if not requests:
+        return {}
+    batch_id = client.submit(requests)
+    while True:
+        status = client.status(batch_id)
+        if on_status is not None:
+            on_status(batch_id, status)
+        if status in TERMINAL_STATUSES:
+            break
+        time.sleep(poll_interval)
+    if status != "completed":
+        raise BatchError(f"Batch {batch_id} ended with status {status!r}")
+    return client.results(batch_id)
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+CACHE_MODES = ("off", "readwrite", "replay")
+DEFAULT_CACHE_PATH = Path(".cai_cache") / "llm_cache.sqlite"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CacheMissError(LookupError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+
+def make_cache_key(model: str, messages: list[dict], **params) -> str:
+    """Build a content-addressed key for a model request.
+
+    Args:
+        model: Name of the model the request is sent to.
+        messages: Chat messages of the request.
+        **params: Sampling parameters and anything else that changes the response.
+
+    Returns:
+        The SHA-256 hex digest of the canonical JSON encoding of the request.
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent SQLite cache of model responses, keyed by `make_cache_key`.
+
+    Modes:
+    - "off": never read nor write.
+    - "readwrite": serve hits from disk and store every new response.
+    - "replay": serve hits from disk and raise `CacheMissError` on a miss, so that
+      no request ever reaches the network.
+
+    Entries older than `max_age_seconds` are treated as misses and deleted. When
+    the cache holds more than `max_entries` entries or `max_bytes` bytes, the
+    least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = DEFAULT_CACHE_PATH,
+        mode: str = "readwrite",
+        max_entries: int | None = None,
+        max_bytes: int | None = DEFAULT_MAX_BYTES,
+        max_age_seconds: float | None = None,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}"
+            )
+        self.path = Path(path)
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response for `key`, or None on a miss.
+
+        Raises:
+            CacheMissError: If the cache is in replay mode and `key` is not cached.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._is_expired(row[1], now):
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                self.stats.evictions += 1
+                row = None
+            if row is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+                conn.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                conn.commit()
+
+        if row is None:
+            if self.mode == "replay":
+                raise CacheMissError(f"No cached response for request {key}")
+            return None
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store a response, then evict entries exceeding the configured limits."""
+        if self.mode != "readwrite":
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self.stats.writes += 1
+            self._evict(conn, now)
+            conn.commit()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return (
+            self.max_age_seconds is not None and now - created_at > self.max_age_seconds
+        )
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.max_age_seconds is not None:
+            cursor = conn.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (now - self.max_age_seconds,),
+            )
+            self.stats.evictions += cursor.rowcount
+
+        count, total_size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if (self.max_entries is None or count <= self.max_entries) and (
+            self.max_bytes is None or total_size <= self.max_bytes
+        ):
+            return
+
+        # Drop least recently used entries until both limits are met
+        for key, size in conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+        ).fetchall():
+            if (self.max_entries is None or count <= self.max_entries) and (
+                self.max_bytes is None or total_size <= self.max_bytes
+            ):
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total_size -= size
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        """Delete every cached response."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return (
+                self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache: ResponseCache | None = None
+
+
+def get_cache() -> ResponseCache:
+    """Return the process-wide response cache.
+
+    It is configured from the environment on first use:
+    - CAI_CACHE_MODE: one of "off", "readwrite" (default) or "replay".
+    - CAI_CACHE_PATH: path of the SQLite file (default ".cai_cache/llm_cache.sqlite").
+    - CAI_CACHE_MAX_MB: maximum size of the cache in megabytes (default 256).
+    - CAI_CACHE_MAX_AGE_DAYS: maximum age of an entry in days (default: no limit).
+    """
+    global _cache
+    if _cache is None:
+        max_age_days = os.environ.get("CAI_CACHE_MAX_AGE_DAYS")
+        _cache = ResponseCache(
+            path=os.environ.get("CAI_CACHE_PATH", DEFAULT_CACHE_PATH),
+            mode=os.environ.get("CAI_CACHE_MODE", "readwrite"),
+            max_bytes=int(float(os.environ.get("CAI_CACHE_MAX_MB", 256)) * 1024 * 1024),
+            max_age_seconds=float(max_age_days) * 86400 if max_age_days else None,
+        )
+    return _cache
+
+
+def set_cache(cache: ResponseCache) -> None:
+    """Replace the process-wide response cache."""
+    global _cache
+    if _cache is not None and _cache is not cache:
+        _cache.close()
+    _cache = cache
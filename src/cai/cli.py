@@ -0,0 +1,263 @@
+"""Headless entry points running the evaluation and auto-generation pipelines.
+
+Usage:
+    cai eval --version v2 --set test --concurrency 16 --threshold 0.8
+    cai generate --set validation --save
+    cai rescore --processes 4
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from cai.auto_generate import (
+    DEFAULT_N_PROMPTS,
+    analyze_failures,
+    generate_improvement_examples,
+)
+from cai.critique_rewrite import DEFAULT_FEW_SHOT_TOKENS
+from cai.eval import load_eval_data, write_eval_report
+from cai.models import EvaluationResult
+from cai.rescore import find_reports, format_rescore_diff, rescore_reports
+from cai.runlog import RunLog, make_run_id
+from cai.runner import DEFAULT_CONCURRENCY, iter_evaluation
+from cai.versioning import add_to_dev_examples, save_dev_version, use_workspace
+
+
+def _add_run_arguments(parser: argparse.ArgumentParser, default_set: str) -> None:
+    parser.add_argument(
+        "--version", default="dev", help="Examples version (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--set",
+        default=default_set,
+        dest="dataset",
+        help="Bundled set (test, validation) or path of a JSONL file "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Conversations processed at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--skip-compliant",
+        action="store_true",
+        help="Don't call the model for answers that already follow the principle",
+    )
+    parser.add_argument("--quiet", action="store_true", help="Don't print progress")
+    parser.add_argument(
+        "--workspace",
+        default=None,
+        help="Use the private dev version of a workspace instead of the shared one",
+    )
+
+
+def _evaluate(args: argparse.Namespace, version: str, **options):
+    """Evaluate the set of `args`, printing progress on stderr.
+
+    Returns:
+        Tuple of (dataset, results in dataset order).
+    """
+    eval_data = load_eval_data(args.dataset)
+    results: dict[int, EvaluationResult] = {}
+    for index, result in iter_evaluation(
+        eval_data,
+        version,
+        args.concurrency,
+        skip_compliant=args.skip_compliant,
+        **options,
+    ):
+        results[index] = result
+        if not args.quiet:
+            passed = sum(r.follows_principle for r in results.values())
+            print(
+                f"[{len(results)}/{len(eval_data)}] "
+                f"{'pass' if result.follows_principle else 'FAIL'} "
+                f"{result.first_letters:<10} accuracy {passed / len(results):.1%}",
+                file=sys.stderr,
+            )
+    return eval_data, [results[index] for index in sorted(results)]
+
+
+def run_eval(args: argparse.Namespace) -> int:
+    if args.run_id:
+        run_log = RunLog(args.run_id)
+        version = run_log.version or args.version
+    else:
+        version = args.version
+        if version == "dev" and args.snapshot:
+            version = save_dev_version()
+            print(f"Created new version: {version}", file=sys.stderr)
+        run_log = RunLog(make_run_id(version))
+    print(f"Run {run_log.run_id}", file=sys.stderr)
+
+    started_at = time.perf_counter()
+    eval_data, _ = _evaluate(
+        args,
+        version,
+        run_log=run_log,
+        best_of_n=args.best_of_n,
+        token_budget=args.token_budget,
+        retry_diverging=args.retry_diverging,
+        few_shot_k=args.few_shot_k,
+        few_shot_tokens=args.few_shot_tokens,
+    )
+    report = run_log.build_report(
+        eval_data, version, duration_s=time.perf_counter() - started_at
+    )
+    report_path = write_eval_report(report)
+
+    print(
+        f"Accuracy {report.accuracy:.1%} on {len(report.results)} examples, "
+        f"${report.total_cost_usd:.4f}, {report.duration_s:.1f}s"
+    )
+    print(f"Report saved to {report_path}")
+    if report.accuracy < args.threshold:
+        print(f"Accuracy below the threshold of {args.threshold:.1%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_generate(args: argparse.Namespace) -> int:
+    _, results = _evaluate(args, args.version)
+    if all(r.follows_principle for r in results):
+        print("No failures found. No improvements to generate.")
+        return 0
+
+    analysis = analyze_failures(results)
+    print(analysis)
+    new_examples = generate_improvement_examples(results, analysis, args.n_examples)
+    for i, example in enumerate(new_examples, 1):
+        print(f"\n--- Example {i} ---")
+        print(f"Human: {example.human_prompt}")
+        print(f"Assistant: {example.assistant_answer}")
+        print(f"Critique: {example.critique}")
+        print(f"Rewrite: {example.rewrite}")
+
+    if args.save:
+        for example in new_examples:
+            add_to_dev_examples(
+                example.human_prompt,
+                example.assistant_answer,
+                example.critique,
+                example.rewrite,
+            )
+        print(f"Added {len(new_examples)} examples to the dev version")
+    return 0
+
+
+def run_rescore(args: argparse.Namespace) -> int:
+    paths = args.reports or find_reports()
+    results = rescore_reports(paths, args.in_place, args.processes)
+    print(format_rescore_diff(results))
+    n_changes = sum(len(result.changes) for result in results)
+    print(f"{n_changes} verdicts changed in {len(results)} reports")
+    if not args.in_place:
+        print("Rescored reports written next to the originals", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cai", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    eval_parser = commands.add_parser(
+        "eval", help="Evaluate an examples version and write its report"
+    )
+    _add_run_arguments(eval_parser, default_set="test")
+    eval_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.0,
+        help="Exit with status 1 when the accuracy is below it (default: "
+        "%(default)s)",
+    )
+    eval_parser.add_argument(
+        "--best-of-n", type=int, default=1, help="Rewrite candidates per example"
+    )
+    eval_parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=None,
+        help="Completion tokens spent on rewrite candidates per example",
+    )
+    eval_parser.add_argument(
+        "--retry-diverging",
+        type=int,
+        default=0,
+        help="Retries of streamed rewrites diverging from the principle",
+    )
+    eval_parser.add_argument(
+        "--few-shot-k",
+        type=int,
+        default=None,
+        help="Use only the k examples most relevant to each conversation "
+        "(default: every example)",
+    )
+    eval_parser.add_argument(
+        "--few-shot-tokens",
+        type=int,
+        default=DEFAULT_FEW_SHOT_TOKENS,
+        help="Prompt tokens of the selected examples (default: %(default)s)",
+    )
+    eval_parser.add_argument(
+        "--run-id", default=None, help="Resume an interrupted run from its log"
+    )
+    eval_parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Save dev as a new version first and evaluate that version",
+    )
+    eval_parser.set_defaults(func=run_eval)
+
+    generate_parser = commands.add_parser(
+        "generate", help="Generate examples from the failures of an evaluation"
+    )
+    _add_run_arguments(generate_parser, default_set="validation")
+    generate_parser.add_argument(
+        "--n-examples",
+        type=int,
+        default=DEFAULT_N_PROMPTS,
+        help="Examples to generate, concurrently (default: %(default)s)",
+    )
+    generate_parser.add_argument(
+        "--save", action="store_true", help="Add the examples to the dev version"
+    )
+    generate_parser.set_defaults(func=run_generate)
+
+    rescore_parser = commands.add_parser(
+        "rescore",
+        help="Recompute the verdicts of evaluation reports with the current verifier",
+    )
+    rescore_parser.add_argument(
+        "reports",
+        nargs="*",
+        type=Path,
+        help="Reports to rescore (default: evals/eval_report_*.json)",
+    )
+    rescore_parser.add_argument(
+        "--in-place",
+        action="store_true",
+        help="Overwrite the reports instead of writing .rescored.json sidecars",
+    )
+    rescore_parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Worker processes (default: number of CPUs)",
+    )
+    rescore_parser.set_defaults(func=run_rescore)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    with use_workspace(getattr(args, "workspace", None)):
+        return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+
+
+async def aiter_window(
+    jobs: Iterable[Callable[[], Awaitable]], concurrency: int
+) -> AsyncIterator[tuple[int, object]]:
+    """Run jobs with at most `concurrency` of them in flight, in a sliding window.
+
+    Jobs are consumed lazily, so memory stays bounded whatever their number.
+    Closing the iterator, e.g. with `contextlib.aclosing`, cancels the jobs in
+    flight and waits for them, so callers that may stop early must close it.
+
+    Yields:
+        Tuples of (job index, job result), in completion order.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+
+    items = iter(enumerate(jobs))
+    pending: set[asyncio.Task] = set()
+
+    async def _run(index: int, job: Callable[[], Awaitable]):
+        return index, await job()
+
+    def _fill() -> None:
+        while len(pending) < concurrency:
+            item = next(items, None)
+            if item is None:
+                return
+            pending.add(asyncio.create_task(_run(*item)))
+
+    try:
+        _fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.difference_update(done)
+            # Refill before yielding so the pipeline stays busy while the caller
+            # handles the results.
+            _fill()
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def iter_sync(results: AsyncIterator) -> Iterator:
+    """Drive an async iterator from synchronous code on a private event loop.
+
+    Closing the returned iterator closes `results` on that loop before closing it,
+    so that the work `results` cancels on close finishes there.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(results))
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
@@ -1,86 +1,512 @@
-from cai.versioning import load_examples
-from cai.models import CritiqueRewriteExample
-from cai.llm import run_model
+import asyncio
+import os
+from contextlib import aclosing
+from typing import Iterable, Iterator
 
-PRINCIPLE = "putting together the first letter of each sentence from the answer should spell 'ADAPTIVE'."
-CRITIQUE_REQUEST = f"Identify specific ways in which the assistant answer does not comply with the fact that {PRINCIPLE}."
-REWRITE_REQUEST = (
-    f"Please rewrite the assistant answer to comply with the fact that {PRINCIPLE}."
-)
+from cai.versioning import get_examples_signature, load_examples, resolve_version
+from cai.models import ConversationInput, CritiqueRewriteExample
+from cai.llm import arun_model, astream_model, run_model, stream_model
+from cai.eval import AcrosticMonitor
+from cai.principles import ADAPTIVE_PRINCIPLE, get_principle
+from cai.scheduler import estimate_tokens
+from cai.similarity import SimilarityIndex
+from cai.usage import track_usage
 
+# Requests of the default principle
+PRINCIPLE = ADAPTIVE_PRINCIPLE.description
+CRITIQUE_REQUEST = ADAPTIVE_PRINCIPLE.critique_request
+REWRITE_REQUEST = ADAPTIVE_PRINCIPLE.rewrite_request
+ALREADY_COMPLIANT_CRITIQUE = ADAPTIVE_PRINCIPLE.compliant_critique
 
-def get_critique_prompt(human_prompt: str, assistant_answer: str) -> str:
+# Prompt tokens spent on examples selected per conversation, about 6 examples
+DEFAULT_FEW_SHOT_TOKENS = 3000
+
+
+def get_critique_prompt(
+    human_prompt: str, assistant_answer: str, principle: str | None = None
+) -> str:
+    critique_request = get_principle(principle).critique_request
     return f"""Here is a conversation between a human and an assistant:
 
 Human: {human_prompt}
 Assistant: {assistant_answer}
 
-CritiqueRequest: {CRITIQUE_REQUEST}.
+CritiqueRequest: {critique_request}.
 Critique:
 """
 
 
 def get_rewrite_prompt(
-    human_prompt: str, assistant_answer: str, critique_response: str
+    human_prompt: str,
+    assistant_answer: str,
+    critique_response: str,
+    principle: str | None = None,
 ) -> str:
+    principle = get_principle(principle)
     return f"""Here is a conversation between a human and an assistant:
 
 Human: {human_prompt}
 Assistant: {assistant_answer}
 
-CritiqueRequest: {CRITIQUE_REQUEST}
+CritiqueRequest: {principle.critique_request}
 Critique: {critique_response}
 
-RewriteRequest: {REWRITE_REQUEST}
+RewriteRequest: {principle.rewrite_request}
 Rewrite:
 """
 
 
-def pretty_print_example(example: CritiqueRewriteExample) -> str:
+def pretty_print_example(
+    example: CritiqueRewriteExample, principle: str | None = None
+) -> str:
+    principle = get_principle(principle)
     return f"""Human: {example.human_prompt}
 Assistant: {example.assistant_answer}
-CritiqueRequest: {CRITIQUE_REQUEST}
+CritiqueRequest: {principle.critique_request}
 Critique: {example.critique}
-RewriteRequest: {REWRITE_REQUEST}.
+RewriteRequest: {principle.rewrite_request}.
 Rewrite: {example.rewrite}
 """
 
 
-def get_examples_system_prompt(version: str) -> str:
-    examples = load_examples(version)
+# Rendered system prompts, keyed by principle and resolved version (each workspace
+# has its own dev version) and stored with the signature of the version file they
+# were rendered from.
+_system_prompts: dict[tuple[str, str], tuple[tuple[int, ...] | None, str]] = {}
+
+
+def get_examples_system_prompt(version: str, principle: str | None = None) -> str:
+    key = (get_principle(principle).name, resolve_version(version))
+    signature = get_examples_signature(version, principle)
+    cached = _system_prompts.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    system_prompt = render_examples_system_prompt(
+        load_examples(version, principle), principle
+    )
+    _system_prompts[key] = (signature, system_prompt)
+    return system_prompt
+
+
+def render_examples_system_prompt(
+    examples: list[CritiqueRewriteExample], principle: str | None = None
+) -> str:
     return f"""You are a helpful assistant that can critique and rewrite other assistant answers to comply with a given principle.
 Critique and rewrite are done in different steps, make sure to only critique or rewrite based on what is asked.
 
 Here are some examples of critique and rewrite:
-{"----".join([pretty_print_example(example) for example in examples])}
+{"----".join([pretty_print_example(example, principle) for example in examples])}
 """
 
 
+# Similarity indexes of the examples of a version, keyed and invalidated like
+# `_system_prompts`.
+_example_indexes: dict[
+    tuple[str, str],
+    tuple[tuple[int, ...] | None, list[CritiqueRewriteExample], SimilarityIndex],
+] = {}
+
+
+def select_examples(
+    human_prompt: str,
+    assistant_answer: str,
+    version: str,
+    k: int,
+    token_budget: int = DEFAULT_FEW_SHOT_TOKENS,
+    principle: str | None = None,
+) -> list[CritiqueRewriteExample]:
+    """Select the examples of a version most relevant to a conversation.
+
+    Examples are ranked by the similarity of their conversation to this one, and
+    taken in that order while they fit in the token budget, so that the prompt size
+    doesn't grow with the library.
+
+    Args:
+        human_prompt: The human prompt of the conversation.
+        assistant_answer: The assistant answer of the conversation.
+        version: Examples version to select from.
+        k: Maximum number of examples.
+        token_budget: Maximum number of prompt tokens of the selected examples,
+            estimated like the scheduler does.
+        principle: Principle whose examples library to use, None for the default.
+
+    Returns:
+        The selected examples, most relevant first.
+    """
+    key = (get_principle(principle).name, resolve_version(version))
+    signature = get_examples_signature(version, principle)
+    cached = _example_indexes.get(key)
+    if cached is None or cached[0] != signature:
+        examples = load_examples(version, principle)
+        index = SimilarityIndex(
+            f"{e.human_prompt}\n{e.assistant_answer}" for e in examples
+        )
+        cached = (signature, examples, index)
+        _example_indexes[key] = cached
+    _, examples, index = cached
+
+    selected = []
+    tokens = 0
+    for i, _ in index.nearest(f"{human_prompt}\n{assistant_answer}", len(index)):
+        if len(selected) == k:
+            break
+        example_tokens = estimate_tokens(
+            [{"content": pretty_print_example(examples[i], principle)}],
+            completion_tokens=0,
+        )
+        if tokens + example_tokens <= token_budget:
+            selected.append(examples[i])
+            tokens += example_tokens
+    return selected
+
+
+def get_pipeline_system_prompt(
+    human_prompt: str,
+    assistant_answer: str,
+    version: str,
+    few_shot_k: int | None = None,
+    few_shot_tokens: int = DEFAULT_FEW_SHOT_TOKENS,
+    principle: str | None = None,
+) -> str:
+    """Get the system prompt of the pipelines for one conversation: every example
+    of the version, or with `few_shot_k`, the examples selected for the
+    conversation by `select_examples`.
+    """
+    if few_shot_k is None:
+        return get_examples_system_prompt(version, principle)
+    examples = select_examples(
+        human_prompt, assistant_answer, version, few_shot_k, few_shot_tokens, principle
+    )
+    return render_examples_system_prompt(examples, principle)
+
+
+def is_already_compliant(assistant_answer: str, principle: str | None = None) -> bool:
+    """Check whether an assistant answer already follows the principle.
+
+    Such answers don't need to be critiqued nor rewritten, so the pipelines return
+    the principle's `compliant_critique` and the answer unchanged without calling
+    the model.
+    """
+    return get_principle(principle).verifier(assistant_answer)[0]
+
+
+def filter_needs_rewrite(
+    conversations: Iterable[ConversationInput], principle: str | None = None
+) -> Iterator[ConversationInput]:
+    """Lazily drop the conversations whose assistant answer already follows the
+    principle, so that only the others are sent to the model.
+    """
+    return (
+        c
+        for c in conversations
+        if not is_already_compliant(c.assistant_answer, principle)
+    )
+
+
 def run_critique_rewrite_pipeline(
     human_prompt: str,
     assistant_answer: str,
     version: str,
+    skip_compliant: bool = False,
+    principle: str | None = None,
+    few_shot_k: int | None = None,
+    few_shot_tokens: int = DEFAULT_FEW_SHOT_TOKENS,
 ) -> tuple[str, str]:
-    system_prompt = get_examples_system_prompt(version)
+    if skip_compliant and is_already_compliant(assistant_answer, principle):
+        return get_principle(principle).compliant_critique, assistant_answer
+    system_prompt = get_pipeline_system_prompt(
+        human_prompt, assistant_answer, version, few_shot_k, few_shot_tokens, principle
+    )
     # critique
-    critique_prompt = get_critique_prompt(human_prompt, assistant_answer)
-    critique = run_model(critique_prompt, system_prompt)
+    critique_prompt = get_critique_prompt(human_prompt, assistant_answer, principle)
+    critique = run_model(critique_prompt, system_prompt, stage="critique")
     # rewrite
-    rewrite_prompt = get_rewrite_prompt(human_prompt, assistant_answer, critique)
-    rewrite = run_model(rewrite_prompt, system_prompt)
+    rewrite_prompt = get_rewrite_prompt(
+        human_prompt, assistant_answer, critique, principle
+    )
+    rewrite = run_model(rewrite_prompt, system_prompt, stage="rewrite")
 
     return critique, rewrite
 
 
+async def arun_critique_rewrite_pipeline(
+    human_prompt: str,
+    assistant_answer: str,
+    version: str,
+    best_of_n: int = 1,
+    token_budget: int | None = None,
+    skip_compliant: bool = False,
+    retry_diverging: int = 0,
+    principle: str | None = None,
+    few_shot_k: int | None = None,
+    few_shot_tokens: int = DEFAULT_FEW_SHOT_TOKENS,
+) -> tuple[str, str]:
+    """Async counterpart of `run_critique_rewrite_pipeline`.
+
+    Args:
+        human_prompt: The human prompt of the conversation.
+        assistant_answer: The assistant answer to critique and rewrite.
+        version: Examples version used as few-shot examples.
+        best_of_n: Number of rewrite candidates to sample, see
+            `arun_best_of_n_rewrite`. 1 requests a single rewrite.
+        token_budget: Maximum number of completion tokens spent on rewrite
+            candidates when `best_of_n` is above 1.
+        skip_compliant: Whether to skip the model calls when the assistant answer
+            already follows the principle, see `is_already_compliant`. Off by
+            default, the runners check compliance themselves.
+        retry_diverging: When above 0 (and `best_of_n` is 1), the rewrite is
+            streamed and restarted up to this many times as soon as it diverges
+            from the principle, see `arun_monitored_rewrite`. Only acrostic
+            principles, i.e. with a seed, can be monitored.
+        principle: Name of the principle to follow, the default one when None.
+        few_shot_k: When set, only the `few_shot_k` examples most relevant to the
+            conversation are used, see `select_examples`, instead of every example
+            of the version.
+        few_shot_tokens: Maximum number of prompt tokens of the selected examples.
+
+    Returns:
+        Tuple of (critique, rewrite).
+    """
+    if skip_compliant and is_already_compliant(assistant_answer, principle):
+        return get_principle(principle).compliant_critique, assistant_answer
+    few_shot = dict(few_shot_k=few_shot_k, few_shot_tokens=few_shot_tokens)
+    system_prompt = get_pipeline_system_prompt(
+        human_prompt, assistant_answer, version, principle=principle, **few_shot
+    )
+    # critique
+    critique_prompt = get_critique_prompt(human_prompt, assistant_answer, principle)
+    critique = await arun_model(critique_prompt, system_prompt, stage="critique")
+    # rewrite
+    if best_of_n > 1:
+        rewrite = await arun_best_of_n_rewrite(
+            human_prompt,
+            assistant_answer,
+            critique,
+            version,
+            n=best_of_n,
+            token_budget=token_budget,
+            principle=principle,
+            **few_shot,
+        )
+    elif retry_diverging > 0 and get_principle(principle).seed:
+        rewrite = await arun_monitored_rewrite(
+            human_prompt,
+            assistant_answer,
+            critique,
+            version,
+            max_attempts=retry_diverging + 1,
+            principle=principle,
+            **few_shot,
+        )
+    else:
+        rewrite_prompt = get_rewrite_prompt(
+            human_prompt, assistant_answer, critique, principle
+        )
+        rewrite = await arun_model(rewrite_prompt, system_prompt, stage="rewrite")
+
+    return critique, rewrite
+
+
+def _principle_prefix_length(rewrite: str, principle: str | None = None) -> int:
+    principle = get_principle(principle)
+    if not principle.seed:
+        return 0
+    _, first_letters = principle.verifier(rewrite)
+    return len(os.path.commonprefix([first_letters, principle.seed]))
+
+
+async def arun_best_of_n_rewrite(
+    human_prompt: str,
+    assistant_answer: str,
+    critique: str,
+    version: str,
+    n: int = 4,
+    token_budget: int | None = None,
+    principle: str | None = None,
+    few_shot_k: int | None = None,
+    few_shot_tokens: int = DEFAULT_FEW_SHOT_TOKENS,
+) -> str:
+    """Sample rewrite candidates concurrently and return the first that complies.
+
+    The n candidates are streamed at once, candidate i with `seed=i` so that each
+    one is a distinct request and cache entry (the first candidate is the plain
+    rewrite request). Each candidate is checked with the principle verifier as soon as
+    it completes, and the outstanding streams are cancelled once one passes or, after
+    a candidate completed, once all the candidates have streamed `token_budget`
+    completion tokens. Every candidate is recorded under the "rewrite" stage,
+    including the partial usage of the cancelled streams, see `astream_model`, so the
+    extra cost shows up in the usage of the evaluation.
+
+    Args:
+        human_prompt: The human prompt of the conversation.
+        assistant_answer: The assistant answer to rewrite.
+        critique: The critique of the assistant answer.
+        version: Examples version used as few-shot examples.
+        n: Maximum number of candidates.
+        token_budget: Optional maximum number of completion tokens to spend, counting
+            the tokens streamed by the candidates still in flight.
+        principle: Name of the principle to follow, the default one when None.
+        few_shot_k: Number of examples selected for the conversation, all of them
+            when None.
+        few_shot_tokens: Maximum number of prompt tokens of the selected examples.
+
+    Returns:
+        The first candidate following the principle or, if none does, the candidate
+        whose first letters match the longest prefix of the principle seed (the
+        first candidate received for principles without a seed).
+    """
+    if n < 1:
+        raise ValueError(f"n must be at least 1, got {n}")
+    verifier = get_principle(principle).verifier
+    system_prompt = get_pipeline_system_prompt(
+        human_prompt, assistant_answer, version, few_shot_k, few_shot_tokens, principle
+    )
+    rewrite_prompt = get_rewrite_prompt(
+        human_prompt, assistant_answer, critique, principle
+    )
+
+    # Completion tokens of each candidate: estimated from the text streamed so far,
+    # like the usage of a cancelled stream, then reported once it completes
+    spent_tokens = [0] * n
+    over_budget = asyncio.Event()
+
+    async def _sample(seed: int) -> str:
+        params = {"seed": seed} if seed else {}
+        text = ""
+        with track_usage() as tracker:
+            async with aclosing(
+                astream_model(rewrite_prompt, system_prompt, stage="rewrite", **params)
+            ) as stream:
+                async for delta in stream:
+                    text += delta
+                    spent_tokens[seed] = len(text) // 4
+                    if token_budget is not None and sum(spent_tokens) >= token_budget:
+                        over_budget.set()
+        spent_tokens[seed] = sum(r.completion_tokens for r in tracker.records)
+        return text
+
+    tasks = [asyncio.create_task(_sample(seed)) for seed in range(n)]
+    budget_spent = asyncio.create_task(over_budget.wait())
+    pending = set(tasks)
+    candidates = []
+    try:
+        while pending:
+            # The budget only stops the search once there is a candidate to return
+            waiting = pending | {budget_spent} if candidates else pending
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done:
+                    pending.discard(task)
+                    rewrite = task.result()
+                    if verifier(rewrite)[0]:
+                        return rewrite
+                    candidates.append(rewrite)
+            if token_budget is not None and sum(spent_tokens) >= token_budget:
+                break
+    finally:
+        for task in (*tasks, budget_spent):
+            task.cancel()
+        await asyncio.gather(*tasks, budget_spent, return_exceptions=True)
+    return max(candidates, key=lambda c: _principle_prefix_length(c, principle))
+
+
+async def arun_monitored_rewrite(
+    human_prompt: str,
+    assistant_answer: str,
+    critique: str,
+    version: str,
+    max_attempts: int = 3,
+    principle: str | None = None,
+    few_shot_k: int | None = None,
+    few_shot_tokens: int = DEFAULT_FEW_SHOT_TOKENS,
+) -> str:
+    """Stream the rewrite and restart it as soon as it diverges from the principle.
+
+    Each delta is fed to an `AcrosticMonitor`. Once the first letters of the
+    rewrite can no longer spell the principle seed, the stream is closed, which cancels
+    the generation, and a new rewrite is requested with another seed. The last
+    attempt is always generated completely.
+
+    Args:
+        human_prompt: The human prompt of the conversation.
+        assistant_answer: The assistant answer to rewrite.
+        critique: The critique of the assistant answer.
+        version: Examples version used as few-shot examples.
+        max_attempts: Maximum number of rewrites requested.
+        principle: Name of the acrostic principle to follow, the default one when
+            None.
+        few_shot_k: Number of examples selected for the conversation, all of them
+            when None.
+        few_shot_tokens: Maximum number of prompt tokens of the selected examples.
+
+    Returns:
+        The first rewrite that wasn't cancelled.
+    """
+    if max_attempts < 1:
+        raise ValueError(f"max_attempts must be at least 1, got {max_attempts}")
+    seed = get_principle(principle).seed
+    if not seed:
+        raise ValueError(f"Principle {principle!r} has no seed to monitor")
+    system_prompt = get_pipeline_system_prompt(
+        human_prompt, assistant_answer, version, few_shot_k, few_shot_tokens, principle
+    )
+    rewrite_prompt = get_rewrite_prompt(
+        human_prompt, assistant_answer, critique, principle
+    )
+
+    for attempt in range(max_attempts):
+        params = {"seed": attempt} if attempt else {}
+        monitor = AcrosticMonitor(seed)
+        last_attempt = attempt == max_attempts - 1
+        async with aclosing(
+            astream_model(rewrite_prompt, system_prompt, stage="rewrite", **params)
+        ) as stream:
+            async for delta in stream:
+                if not monitor.feed(delta) and not last_attempt:
+                    break
+        if not monitor.diverged or last_attempt:
+            return monitor.text
+
+
+def stream_critique(
+    human_prompt: str,
+    assistant_answer: str,
+    version: str,
+) -> Iterator[str]:
+    """Stream the critique of an assistant answer as it is generated."""
+    system_prompt = get_examples_system_prompt(version)
+    critique_prompt = get_critique_prompt(human_prompt, assistant_answer)
+    return stream_model(critique_prompt, system_prompt, stage="critique")
+
+
+def stream_rewrite(
+    human_prompt: str,
+    assistant_answer: str,
+    critique: str,
+    version: str,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """Stream the rewrite of an assistant answer as it is generated."""
+    system_prompt = get_examples_system_prompt(version)
+    rewrite_prompt = get_rewrite_prompt(human_prompt, assistant_answer, critique)
+    return stream_model(
+        rewrite_prompt, system_prompt, use_cache=use_cache, stage="rewrite"
+    )
+
+
 def run_rewrite_pipeline(
     human_prompt: str,
     assistant_answer: str,
     critique: str,
     version: str,
+    use_cache: bool = True,
 ) -> str:
     system_prompt = get_examples_system_prompt(version)
     rewrite_prompt = get_rewrite_prompt(human_prompt, assistant_answer, critique)
-    rewrite = run_model(rewrite_prompt, system_prompt)
+    rewrite = run_model(
+        rewrite_prompt, system_prompt, use_cache=use_cache, stage="rewrite"
+    )
     return rewrite
 
 
@@ -111,4 +537,4 @@ Refinement instructions: {refinement_instructions}
 Please provide a refined version of the critique that incorporates these refinement instructions.
 Critique:
 """
-    return run_model(prompt)
+    return run_model(prompt, stage="critique")
@@ -0,0 +1,129 @@
+import json
+import random
+import threading
+from array import array
+from pathlib import Path
+from typing import Iterator, Sequence, overload
+
+from cai.models import ConversationInput
+
+DATA_PATH = Path(__file__).parent / "data"
+BUNDLED_SETS = ("test", "validation")
+
+# Byte-offset indexes of the dataset files, keyed by path and stored with the
+# signature (mtime, size) of the file they were built from.
+_indexes: dict[Path, tuple[tuple[int, int], array]] = {}
+_indexes_lock = threading.Lock()
+
+
+def parse_row(line: bytes | str) -> ConversationInput:
+    """Parse one JSONL row, either in the bundled format ({"user", "bot"}) or with
+    the `ConversationInput` field names.
+    """
+    data = json.loads(line)
+    if "user" in data:
+        return ConversationInput(
+            human_prompt=data["user"], assistant_answer=data["bot"]
+        )
+    return ConversationInput(**data)
+
+
+def _build_index(path: Path) -> array:
+    """Scan a JSONL file for the byte offset of each non-blank row, without parsing."""
+    offsets = array("q")
+    position = 0
+    with path.open("rb") as f:
+        for line in f:
+            if not line.isspace():
+                offsets.append(position)
+            position += len(line)
+    return offsets
+
+
+def get_index(path: Path) -> array:
+    """Get the byte offsets of the rows of a JSONL file, rebuilt when it changes."""
+    stat = path.stat()
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _indexes_lock:
+        cached = _indexes.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    offsets = _build_index(path)
+    with _indexes_lock:
+        _indexes[path] = (signature, offsets)
+    return offsets
+
+
+class Dataset(Sequence[ConversationInput]):
+    """Lazy view over the conversations of a JSONL file.
+
+    Only the byte offset of each row is kept in memory: rows are read and parsed
+    when accessed, so a dataset of any size can be indexed, sliced, sharded,
+    sampled and iterated in bounded memory. Slicing, sharding and sampling return
+    new views over the same file without reading it.
+    """
+
+    def __init__(self, path: Path, offsets: array):
+        self.path = path
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @overload
+    def __getitem__(self, index: int) -> ConversationInput: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "Dataset": ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Dataset(self.path, self._offsets[index])
+        return parse_row(self._read(index))
+
+    def _read(self, index: int) -> bytes:
+        with self.path.open("rb") as f:
+            f.seek(self._offsets[index])
+            return f.readline()
+
+    def __iter__(self) -> Iterator[ConversationInput]:
+        with self.path.open("rb") as f:
+            position = None
+            for offset in self._offsets:
+                # Rows of a contiguous view are read sequentially, without seeking
+                if offset != position:
+                    f.seek(offset)
+                line = f.readline()
+                position = offset + len(line)
+                yield parse_row(line)
+
+    def shard(self, index: int, count: int) -> "Dataset":
+        """Get the `index`-th of `count` interleaved shards of the dataset."""
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index must be in [0, {count}), got {index}")
+        return self[index::count]
+
+    def sample(self, k: int, seed: int | None = None) -> "Dataset":
+        """Get `k` rows drawn at random without replacement, in random order."""
+        positions = random.Random(seed).sample(range(len(self)), k)
+        return Dataset(self.path, array("q", (self._offsets[i] for i in positions)))
+
+
+def open_dataset(path: str | Path) -> Dataset:
+    """Open a JSONL dataset of conversations.
+
+    Args:
+        path: Name of a bundled set ("test" or "validation"), or path of a JSONL
+            file.
+
+    Returns:
+        A lazy view over the conversations of the file. The first row is parsed
+        to fail early on malformed files.
+    """
+    if path in BUNDLED_SETS:
+        path = DATA_PATH / f"{path}.jsonl"
+    path = Path(path).resolve()
+    dataset = Dataset(path, get_index(path))
+    if dataset:
+        parse_row(dataset._read(0))
+    return dataset
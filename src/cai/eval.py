@@ -1,11 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 import re
 import json
 import os
-from typing import Literal
+from typing import Iterable, Iterator, Literal
 
-from cai.models import ConversationInput, EvaluationReport, EvaluationResult
+from cai.datasets import Dataset, open_dataset
+from cai.models import (
+    ComparisonReport,
+    EvaluationReport,
+    EvaluationResult,
+    ItemComparison,
+    MatrixReport,
+    VersionSummary,
+)
+from cai.usage import percentile, summarize_usage
+
+# Markdown formatting stripped by `normalize_text`, in order. Each pattern comes
+# with the characters it needs to match, so that it is skipped when the text
+# contains none of them.
+_NUMBERED_LIST = re.compile(r"^\d+\.\s+", re.MULTILINE)
+_BULLET_POINT = re.compile(r"^[-•]\s+", re.MULTILINE)
+_HEADER = re.compile(r"^#+\s+", re.MULTILINE)
+_MARKDOWN_PATTERNS = [
+    (re.compile(r"\*\*([^*]+)\*\*"), r"\1", "*"),  # Bold text
+    (re.compile(r"\*([^*]+)\*"), r"\1", "*"),  # Italic text
+    (_NUMBERED_LIST, "", "."),  # Numbered lists
+    (_BULLET_POINT, "", "-•"),  # Bullet points
+    (re.compile(r"\[([^\]]+)\]\([^\)]+\)"), r"\1", "]"),  # Links [text](url)
+    (re.compile(r"`([^`]+)`"), r"\1", "`"),  # Inline code
+    (_HEADER, "", "#"),  # Headers
+    (re.compile(r'"([^"]+)"'), r"\1", '"'),  # Remove double quotes
+    (re.compile(r"'([^']+)'"), r"\1", "'"),  # Remove single quotes
+]
+# End of a line that doesn't end with punctuation
+_UNPUNCTUATED_LINE_END = re.compile(r"(?<=[^.!?\s])(?=[^\S\n]*(?:\n|\Z))")
+_WHITESPACE = re.compile(r"\s+")
+# First character of a text block, for a text starting with a separator. Blocks
+# are separated by sentence punctuation and by line ends, which `normalize_text`
+# turns into periods. Blocks made of whitespace only are skipped.
+_BLOCK_START = re.compile(r"[.?!\n][.?!\s]*([^.?!\s])")
+# Same, skipping the markup characters at the start of the block
+_MARKED_BLOCK_START = re.compile(r"[.?!\n][.?!\s]*[*`\"'\s]*([^.?!\s*`\"'])")
+_BLOCK_BOUNDARY = re.compile(r"[.?!\s]")
+
+
+def _strip_markdown(text: str) -> str:
+    for pattern, replacement, triggers in _MARKDOWN_PATTERNS:
+        if any(trigger in text for trigger in triggers):
+            text = pattern.sub(replacement, text)
+    return text
 
 
 def assert_principle(answer: str) -> tuple[bool, str]:
@@ -24,21 +70,111 @@ def assert_principle(answer: str) -> tuple[bool, str]:
     Returns:
         bool: True if the text follows the ADAPTIVE principle, False otherwise.
     """
-    seed = "ADAPTIVE"
-    # Normalize the text first to remove formatting
-    normalized = normalize_text(answer)
+    return check_acrostic(answer, "ADAPTIVE")
+
+
+def check_acrostic(answer: str, seed: str) -> tuple[bool, str]:
+    """Check if the first letters of the text blocks spell `seed`, see
+    `assert_principle`.
+
+    Blocks are read from the text stripped of its markdown in a single scan,
+    without building the normalized text, see `normalize_text`.
+
+    Args:
+        answer: The text to evaluate.
+        seed: The word to spell, in upper case.
+
+    Returns:
+        Tuple of (whether the first letters spell the seed, the first letters).
+    """
     # Extract first letter from each meaningful block
-    first_letters = "".join(
-        [
-            block.strip()[0].upper()
-            for block in re.split(r"[.\n?!]+", normalized)
-            if block
-        ]
-    )
+    first_letters = "".join(_BLOCK_START.findall("." + _strip_markdown(answer))).upper()
 
     return first_letters == seed, first_letters
 
 
+def assert_principle_batch(
+    answers: Iterable[str], processes: int | None = 1, chunksize: int = 1024
+) -> Iterator[tuple[bool, str]]:
+    """Check many texts against the ADAPTIVE principle, e.g. to re-score reports.
+
+    The texts are consumed lazily, so that a stream of any size can be scored in
+    bounded memory.
+
+    Args:
+        answers: The texts to evaluate.
+        processes: Number of worker processes, None for one per CPU. With 1, the
+            texts are scored in the current process.
+        chunksize: Number of texts sent at once to a worker process.
+
+    Yields:
+        The result of `assert_principle` for each text, in the input order.
+    """
+    if processes == 1:
+        yield from map(assert_principle, answers)
+        return
+
+    processes = processes or os.cpu_count() or 1
+    answers = iter(answers)
+    with ProcessPoolExecutor(processes) as pool:
+        # Submit the texts in waves, so that the pool never holds the whole stream
+        wave_size = chunksize * processes
+        while wave := list(islice(answers, wave_size)):
+            yield from pool.map(assert_principle, wave, chunksize=chunksize)
+
+
+class AcrosticMonitor:
+    """Incremental `assert_principle` over a text being generated.
+
+    Feed it the deltas of a streamed answer: it tracks the first letters of the
+    blocks that are known so far and reports as soon as they diverge from the
+    seed, so that a failing generation can be cancelled early. A divergence is
+    only reported when no continuation of the text can follow the principle.
+
+    Pairs of markup characters (e.g. quotes or asterisks) can still change as text
+    is appended, so blocks are read from the text with only its line markers
+    stripped, skipping the markup at their start: a text spelling the seed must
+    have that markup paired, hence removed. A block starting with any other
+    character than a letter, e.g. a digit that may be a list marker, leaves it and
+    the following blocks undecided. Text after a '[' is not read either, since a
+    link may end up hiding part of it.
+    """
+
+    def __init__(self, seed: str = "ADAPTIVE"):
+        self.seed = seed
+        self.text = ""
+        self.letters = ""
+        self.diverged = False
+
+    def feed(self, delta: str) -> bool:
+        """Consume the next delta of the text.
+
+        Returns:
+            False once the settled first letters diverged from the seed.
+        """
+        self.text += delta
+        # A block can only start after punctuation, a line end or a space
+        if not self.diverged and _BLOCK_BOUNDARY.search(delta):
+            self._settle()
+        return not self.diverged
+
+    def _settle(self) -> None:
+        text = self.text.split("[", 1)[0]
+        for pattern in (_NUMBERED_LIST, _BULLET_POINT, _HEADER):
+            text = pattern.sub("", text)
+        letters = ""
+        for letter in _MARKED_BLOCK_START.findall("." + text):
+            if not letter.isalpha():
+                break
+            letters += letter.upper()
+        self.letters = letters
+        self.diverged = not self.seed.startswith(letters)
+
+    def result(self) -> tuple[bool, str]:
+        """Check the whole text, once it is complete, see `check_acrostic`."""
+        return check_acrostic(self.text, self.seed)
+
+
 def normalize_text(text: str) -> str:
     """Normalize text by removing markdown formatting and list markers while preserving
     sentence structure.
@@ -49,82 +185,250 @@ def normalize_text(text: str) -> str:
     Returns:
         The normalized text with formatting removed but sentence structure preserved.
     """
-    # Define patterns to remove
-    patterns = [
-        (r"\*\*([^*]+)\*\*", r"\1"),  # Bold text
-        (r"\*([^*]+)\*", r"\1"),  # Italic text
-        (r"^\d+\.\s+", ""),  # Numbered lists
-        (r"^[-•]\s+", ""),  # Bullet points
-        (r"\[([^\]]+)\]\([^\)]+\)", r"\1"),  # Links [text](url)
-        (r"`([^`]+)`", r"\1"),  # Inline code
-        (r"^#+\s+", ""),  # Headers
-        (r"\n{3,}", "\n\n"),  # Multiple newlines
-        (r'"([^"]+)"', r"\1"),  # Remove double quotes
-        (r"'([^']+)'", r"\1"),  # Remove single quotes
-    ]
-
-    # Apply each pattern
-    normalized = text
-    for pattern, replacement in patterns:
-        normalized = re.sub(pattern, replacement, normalized, flags=re.MULTILINE)
-
+    normalized = _strip_markdown(text)
     # Add periods to lines that don't end with punctuation
-    lines = normalized.split("\n")
-    normalized_lines = []
-    for line in lines:
-        line = line.strip()
-        if line:
-            if line[-1] not in ".!?":
-                line += "."
-            normalized_lines.append(line)
-
+    normalized = _UNPUNCTUATED_LINE_END.sub(".", normalized)
     # Join lines and clean up extra whitespace
-    normalized = " ".join(normalized_lines)
-    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return _WHITESPACE.sub(" ", normalized).strip()
 
-    return normalized
 
+def load_eval_data(set_: Literal["test", "validation"] | str | Path) -> Dataset:
+    """Open an evaluation set lazily, see `cai.datasets.open_dataset`.
 
-def load_eval_data(set_: Literal["test", "validation"]) -> list[ConversationInput]:
-    with open(
-        f"{os.path.dirname(os.path.abspath(__file__))}/data/{set_}.jsonl",
-        "r",
-        encoding="utf-8",
-    ) as f:
-        return [
-            ConversationInput(human_prompt=d["user"], assistant_answer=d["bot"])
-            for d in map(json.loads, f)
-        ]
+    Args:
+        set_: Name of a bundled set, or path of a JSONL file of conversations.
 
+    Returns:
+        A lazy, indexed view over the conversations of the set.
+    """
+    return open_dataset(set_)
 
-def save_eval_report(
-    results: list[EvaluationResult], version: str, success_rate: float
-):
-    """Saves evaluation results to a JSON file.
+
+def build_eval_report(
+    results: list[EvaluationResult],
+    version: str,
+    success_rate: float | None = None,
+    duration_s: float | None = None,
+    principle: str | None = None,
+) -> EvaluationReport:
+    """Builds an evaluation report timestamped now.
 
     Args:
         results: List of evaluation results
         version: Examples version used for evaluation
-        success_rate: Overall success rate of the evaluation
+        success_rate: Overall success rate, computed from the results if None
+        duration_s: Optional wall-clock duration of the evaluation
+        principle: Principle evaluated, the default one if None
     """
-    # Create evals directory if it doesn't exist
-    eval_dir = Path("evals")
-    eval_dir.mkdir(exist_ok=True)
-
-    # Create filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = eval_dir / f"eval_report_{version}_{timestamp}.json"
-
-    # Prepare report data
+    if success_rate is None:
+        success_rate = (
+            sum(1 for r in results if r.follows_principle) / len(results)
+            if results
+            else 0.0
+        )
+    usage = summarize_usage(results)
     report = EvaluationReport(
         version=version,
-        timestamp=timestamp,
+        timestamp=datetime.now().strftime("%Y%m%d_%H%M%S"),
         accuracy=success_rate,
         results=results,
+        usage=usage,
+        total_cost_usd=sum(stage.cost_usd for stage in usage.values()),
+        duration_s=duration_s,
+    )
+    if principle is not None:
+        report.principle = principle
+    return report
+
+
+def build_matrix_report(
+    results: dict[str, list[EvaluationResult]],
+    versions: dict[str, str],
+    duration_s: float | None = None,
+) -> MatrixReport:
+    """Builds the report of a principles × conversations evaluation, timestamped now.
+
+    Args:
+        results: Evaluation results of each principle, in the same conversation
+            order for all principles
+        versions: Examples version used for each principle
+        duration_s: Optional wall-clock duration of the whole evaluation
+    """
+    reports = {
+        principle: build_eval_report(
+            principle_results, versions[principle], principle=principle
+        )
+        for principle, principle_results in results.items()
+    }
+    rows = list(zip(*results.values()))
+    usage = summarize_usage([r for rs in results.values() for r in rs])
+    return MatrixReport(
+        timestamp=datetime.now().strftime("%Y%m%d_%H%M%S"),
+        principles=list(results),
+        versions=versions,
+        accuracy=(
+            sum(1 for row in rows if all(r.follows_principle for r in row)) / len(rows)
+            if rows
+            else 0.0
+        ),
+        reports=reports,
+        usage=usage,
+        total_cost_usd=sum(stage.cost_usd for stage in usage.values()),
+        duration_s=duration_s,
+    )
+
+
+def build_comparison_report(
+    results: dict[str, list[EvaluationResult]],
+    principle: str | None = None,
+    duration_s: float | None = None,
+) -> ComparisonReport:
+    """Builds the side by side report of several versions, timestamped now.
+
+    The first version is the baseline: for each other version, the report lists
+    the items it fixes (failing with the baseline, passing with it) and breaks.
+
+    Args:
+        results: Evaluation results of each version, in the same item order for
+            all versions
+        principle: Principle evaluated, the default one if None
+        duration_s: Optional wall-clock duration of the whole evaluation
+    """
+    reports = {
+        version: build_eval_report(version_results, version, principle=principle)
+        for version, version_results in results.items()
+    }
+    versions = list(results)
+    baseline = versions[0]
+    rows = list(zip(*results.values()))
+    items = [
+        ItemComparison(
+            human_prompt=row[0].human_prompt,
+            assistant_answer=row[0].assistant_answer,
+            follows_principle={
+                version: r.follows_principle for version, r in zip(versions, row)
+            },
+        )
+        for row in rows
+    ]
+
+    def _changed(version: str, fixed: bool) -> list[int]:
+        return [
+            i
+            for i, item in enumerate(items)
+            if item.follows_principle[version] == fixed
+            and item.follows_principle[baseline] != fixed
+        ]
+
+    def _summary(report: EvaluationReport) -> VersionSummary:
+        latencies = [
+            sum(stage.latency_s for stage in r.usage.values()) for r in report.results
+        ]
+        return VersionSummary(
+            accuracy=report.accuracy,
+            total_cost_usd=report.total_cost_usd,
+            prompt_tokens=sum(s.prompt_tokens for s in report.usage.values()),
+            completion_tokens=sum(s.completion_tokens for s in report.usage.values()),
+            latency_p50_s=percentile(latencies, 50),
+            latency_p95_s=percentile(latencies, 95),
+        )
+
+    report = ComparisonReport(
+        timestamp=datetime.now().strftime("%Y%m%d_%H%M%S"),
+        versions=versions,
+        baseline=baseline,
+        summaries={version: _summary(r) for version, r in reports.items()},
+        items=items,
+        fixes={v: _changed(v, fixed=True) for v in versions[1:]},
+        breaks={v: _changed(v, fixed=False) for v in versions[1:]},
+        reports=reports,
+        duration_s=duration_s,
     )
+    if principle is not None:
+        report.principle = principle
+    return report
+
+
+def write_eval_report(report: EvaluationReport) -> Path:
+    """Writes an evaluation report to a JSON file in the evals directory.
+
+    Args:
+        report: The evaluation report to write
+
+    Returns:
+        Path of the written file
+    """
+    # Create evals directory if it doesn't exist
+    eval_dir = Path("evals")
+    eval_dir.mkdir(exist_ok=True)
+
+    filename = eval_dir / f"eval_report_{report.version}_{report.timestamp}.json"
 
     # Save to JSON file
     with filename.open("w", encoding="utf-8") as f:
         json.dump(report.model_dump(), f, indent=2)
 
     return filename
+
+
+def load_eval_report(path: str | Path) -> EvaluationReport:
+    """Loads an evaluation report written by `write_eval_report`."""
+    with Path(path).open("r", encoding="utf-8") as f:
+        return EvaluationReport(**json.load(f))
+
+
+def write_matrix_report(report: MatrixReport) -> Path:
+    """Writes a matrix report to a JSON file in the evals directory.
+
+    Args:
+        report: The matrix report to write
+
+    Returns:
+        Path of the written file
+    """
+    eval_dir = Path("evals")
+    eval_dir.mkdir(exist_ok=True)
+
+    filename = eval_dir / f"matrix_report_{report.timestamp}.json"
+    with filename.open("w", encoding="utf-8") as f:
+        json.dump(report.model_dump(), f, indent=2)
+
+    return filename
+
+
+def write_comparison_report(report: ComparisonReport) -> Path:
+    """Writes a comparison report to a JSON file in the evals directory.
+
+    Args:
+        report: The comparison report to write
+
+    Returns:
+        Path of the written file
+    """
+    eval_dir = Path("evals")
+    eval_dir.mkdir(exist_ok=True)
+
+    filename = eval_dir / f"comparison_report_{report.timestamp}.json"
+    with filename.open("w", encoding="utf-8") as f:
+        json.dump(report.model_dump(), f, indent=2)
+
+    return filename
+
+
+def save_eval_report(
+    results: list[EvaluationResult],
+    version: str,
+    success_rate: float,
+    duration_s: float | None = None,
+):
+    """Saves evaluation results to a JSON file.
+
+    Args:
+        results: List of evaluation results
+        version: Examples version used for evaluation
+        success_rate: Overall success rate of the evaluation
+        duration_s: Optional wall-clock duration of the evaluation
+    """
+    return write_eval_report(
+        build_eval_report(results, version, success_rate, duration_s)
+    )
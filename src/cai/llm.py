@@ -1,35 +1,294 @@
-from openai import OpenAI
+import os
+import time
+
 from pydantic import BaseModel
-from typing import TypeVar, Type
+from typing import AsyncIterator, Iterator, TypeVar, Type
+
+from cai.backends import Completion, get_backend
+from cai.cache import get_cache, make_cache_key
+from cai.scheduler import estimate_tokens, get_scheduler
+from cai.usage import CallRecord, record_call
 
 TEACHER_MODEL = "gpt-4o"
-client = OpenAI()
+STAGES = ("critique", "rewrite", "student", "analysis")
 
+_stage_models: dict[str, str] = {}
 
-def run_model(prompt: str, system_prompt: str | None = None) -> str:
-    """Run the model and return the response.
+
+def get_model(stage: str | None = None) -> str:
+    """Get the model used for a pipeline stage.
+
+    The model is resolved from, in order: `set_stage_model`, the
+    CAI_MODEL_<STAGE> environment variable (e.g. CAI_MODEL_CRITIQUE), the CAI_MODEL
+    environment variable and finally `TEACHER_MODEL`.
 
     Args:
-        prompt: The prompt to send to the model.
-        system_prompt: Optional system prompt to prepend.
+        stage: One of `STAGES`, or None for the default model.
 
     Returns:
-        The response from the model.
+        The name of the model.
     """
+    if stage is not None:
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}")
+        model = _stage_models.get(stage) or os.environ.get(f"CAI_MODEL_{stage.upper()}")
+        if model:
+            return model
+    return os.environ.get("CAI_MODEL", TEACHER_MODEL)
+
+
+def set_stage_model(stage: str, model: str | None) -> None:
+    """Point a pipeline stage at a model, or back to the default when None."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}")
+    if model is None:
+        _stage_models.pop(stage, None)
+    else:
+        _stage_models[stage] = model
+
+
+def build_messages(prompt: str, system_prompt: str | None = None) -> list[dict]:
     messages = [
         {"role": "user", "content": prompt},
     ]
     if system_prompt is not None:
         messages.insert(0, {"role": "system", "content": system_prompt})
-    response = client.chat.completions.create(model=TEACHER_MODEL, messages=messages)
-    return response.choices[0].message.content
+    return messages
+
+
+def get_request_cache_key(model: str, messages: list[dict], **params) -> str:
+    """Get the cache key of a plain completion request to the active backend."""
+    return make_cache_key(model, messages, backend=get_backend().name, **params)
+
+
+def _record(
+    stage: str | None, model: str, started_at: float, completion: Completion | None
+) -> None:
+    """Record the usage and latency of a call, or of a cache hit if no completion."""
+    record_call(
+        CallRecord(
+            stage=stage or "default",
+            model=model,
+            latency_s=time.perf_counter() - started_at,
+            prompt_tokens=completion.prompt_tokens if completion else 0,
+            completion_tokens=completion.completion_tokens if completion else 0,
+            cached_prompt_tokens=completion.cached_prompt_tokens if completion else 0,
+            cache_hit=completion is None,
+        )
+    )
+
+
+def _read_cache(key: str, use_cache: bool) -> str | None:
+    cache = get_cache()
+    # Replay mode must never reach the network, so it always reads
+    if not use_cache and cache.mode != "replay":
+        return None
+    return cache.get(key)
+
+
+def run_model(
+    prompt: str,
+    system_prompt: str | None = None,
+    use_cache: bool = True,
+    stage: str | None = None,
+    **params,
+) -> str:
+    """Run the model and return the response.
+
+    Args:
+        prompt: The prompt to send to the model.
+        system_prompt: Optional system prompt to prepend.
+        use_cache: Whether a cached response can be returned. When False, the model
+            is called and its response replaces the cached one.
+        stage: Optional pipeline stage, selecting the model to use.
+        **params: Sampling parameters forwarded to the backend, e.g. `seed` or
+            `temperature`. They are part of the cache key.
+
+    Returns:
+        The response from the model.
+    """
+    started_at = time.perf_counter()
+    backend = get_backend()
+    model = get_model(stage)
+    messages = build_messages(prompt, system_prompt)
+    key = get_request_cache_key(model, messages, **params)
+    cached = _read_cache(key, use_cache)
+    if cached is not None:
+        _record(stage, model, started_at, None)
+        return cached
+
+    completion = get_scheduler().run(
+        lambda: backend.complete(model, messages, **params),
+        estimate_tokens(messages),
+    )
+    _record(stage, model, started_at, completion)
+    get_cache().put(key, completion.text)
+    return completion.text
+
+
+async def arun_model(
+    prompt: str,
+    system_prompt: str | None = None,
+    use_cache: bool = True,
+    stage: str | None = None,
+    **params,
+) -> str:
+    """Async counterpart of `run_model`.
+
+    Args:
+        prompt: The prompt to send to the model.
+        system_prompt: Optional system prompt to prepend.
+        use_cache: Whether a cached response can be returned.
+        stage: Optional pipeline stage, selecting the model to use.
+        **params: Sampling parameters forwarded to the backend, e.g. `seed` or
+            `temperature`. They are part of the cache key.
+
+    Returns:
+        The response from the model.
+    """
+    started_at = time.perf_counter()
+    backend = get_backend()
+    model = get_model(stage)
+    messages = build_messages(prompt, system_prompt)
+    key = get_request_cache_key(model, messages, **params)
+    cached = _read_cache(key, use_cache)
+    if cached is not None:
+        _record(stage, model, started_at, None)
+        return cached
+
+    completion = await get_scheduler().arun(
+        lambda: backend.acomplete(model, messages, **params),
+        estimate_tokens(messages),
+    )
+    _record(stage, model, started_at, completion)
+    get_cache().put(key, completion.text)
+    return completion.text
+
+
+def stream_model(
+    prompt: str,
+    system_prompt: str | None = None,
+    use_cache: bool = True,
+    stage: str | None = None,
+    **params,
+) -> Iterator[str]:
+    """Run the model and yield the response as it is generated.
+
+    A cached response is yielded at once. A new response is cached only once it
+    has been streamed completely.
+
+    Args:
+        prompt: The prompt to send to the model.
+        system_prompt: Optional system prompt to prepend.
+        use_cache: Whether a cached response can be returned.
+        stage: Optional pipeline stage, selecting the model to use.
+        **params: Sampling parameters forwarded to the backend.
+
+    Yields:
+        Successive chunks of the response.
+    """
+    started_at = time.perf_counter()
+    backend = get_backend()
+    model = get_model(stage)
+    messages = build_messages(prompt, system_prompt)
+    key = get_request_cache_key(model, messages, **params)
+    cached = _read_cache(key, use_cache)
+    if cached is not None:
+        _record(stage, model, started_at, None)
+        yield cached
+        return
+
+    # Only opening the stream is retried: chunks already yielded can't be taken back
+    stream = get_scheduler().run(
+        lambda: backend.stream(model, messages, **params),
+        estimate_tokens(messages),
+    )
+    yield from stream
+    _record(stage, model, started_at, stream.completion)
+    get_cache().put(key, stream.completion.text)
+
+
+async def astream_model(
+    prompt: str,
+    system_prompt: str | None = None,
+    use_cache: bool = True,
+    stage: str | None = None,
+    **params,
+) -> AsyncIterator[str]:
+    """Async counterpart of `stream_model`.
+
+    Closing the generator before the end, e.g. with `contextlib.aclosing`, cancels
+    the generation. The partial response is then not cached, and its usage is
+    recorded with tokens estimated from its length, since the API only reports
+    usage at the end of a stream.
+
+    Args:
+        prompt: The prompt to send to the model.
+        system_prompt: Optional system prompt to prepend.
+        use_cache: Whether a cached response can be returned.
+        stage: Optional pipeline stage, selecting the model to use.
+        **params: Sampling parameters forwarded to the backend.
+
+    Yields:
+        Successive chunks of the response.
+    """
+    started_at = time.perf_counter()
+    backend = get_backend()
+    model = get_model(stage)
+    messages = build_messages(prompt, system_prompt)
+    key = get_request_cache_key(model, messages, **params)
+    cached = _read_cache(key, use_cache)
+    if cached is not None:
+        _record(stage, model, started_at, None)
+        yield cached
+        return
+
+    stream = await get_scheduler().arun(
+        lambda: backend.astream(model, messages, **params),
+        estimate_tokens(messages),
+    )
+    chunks = []
+    completed = False
+    try:
+        async for delta in stream:
+            chunks.append(delta)
+            yield delta
+        completed = True
+    finally:
+        await stream.aclose()
+        if completed:
+            _record(stage, model, started_at, stream.completion)
+        else:
+            text = "".join(chunks)
+            partial = Completion(
+                text=text,
+                prompt_tokens=estimate_tokens(messages, completion_tokens=0),
+                completion_tokens=len(text) // 4,
+            )
+            _record(stage, model, started_at, partial)
+    get_cache().put(key, stream.completion.text)
 
 
 T = TypeVar("T", bound=BaseModel)
 
 
+def _structured_cache_key(
+    backend, model: str, messages: list[dict], output_type: Type[BaseModel]
+) -> str:
+    return make_cache_key(
+        model,
+        messages,
+        backend=backend.name,
+        response_format=output_type.model_json_schema(),
+    )
+
+
 def run_structured(
-    prompt: str, output_type: Type[T], system_prompt: str | None = None
+    prompt: str,
+    output_type: Type[T],
+    system_prompt: str | None = None,
+    use_cache: bool = True,
+    stage: str | None = None,
 ) -> T:
     """Run the model and parse the output into a Pydantic class.
 
@@ -37,17 +296,64 @@ def run_structured(
         prompt: The prompt to send to the model.
         output_type: The Pydantic class type to parse the output into.
         system_prompt: Optional system prompt to prepend.
+        use_cache: Whether a cached response can be returned.
+        stage: Optional pipeline stage, selecting the model to use.
 
     Returns:
         An instance of the provided Pydantic class type.
     """
-    messages = [
-        {"role": "user", "content": prompt},
-    ]
-    if system_prompt is not None:
-        messages.insert(0, {"role": "system", "content": system_prompt})
+    started_at = time.perf_counter()
+    backend = get_backend()
+    model = get_model(stage)
+    messages = build_messages(prompt, system_prompt)
+    key = _structured_cache_key(backend, model, messages, output_type)
+    cached = _read_cache(key, use_cache)
+    if cached is not None:
+        _record(stage, model, started_at, None)
+        return output_type.model_validate_json(cached)
+
+    completion = get_scheduler().run(
+        lambda: backend.parse(model, messages, output_type), estimate_tokens(messages)
+    )
+    _record(stage, model, started_at, completion)
+    parsed = completion.parsed
+    get_cache().put(key, parsed.model_dump_json())
+    return parsed
+
+
+async def arun_structured(
+    prompt: str,
+    output_type: Type[T],
+    system_prompt: str | None = None,
+    use_cache: bool = True,
+    stage: str | None = None,
+) -> T:
+    """Async counterpart of `run_structured`.
+
+    Args:
+        prompt: The prompt to send to the model.
+        output_type: The Pydantic class type to parse the output into.
+        system_prompt: Optional system prompt to prepend.
+        use_cache: Whether a cached response can be returned.
+        stage: Optional pipeline stage, selecting the model to use.
+
+    Returns:
+        An instance of the provided Pydantic class type.
+    """
+    started_at = time.perf_counter()
+    backend = get_backend()
+    model = get_model(stage)
+    messages = build_messages(prompt, system_prompt)
+    key = _structured_cache_key(backend, model, messages, output_type)
+    cached = _read_cache(key, use_cache)
+    if cached is not None:
+        _record(stage, model, started_at, None)
+        return output_type.model_validate_json(cached)
 
-    response = client.beta.chat.completions.parse(
-        model=TEACHER_MODEL, messages=messages, response_format=output_type
+    completion = await get_scheduler().arun(
+        lambda: backend.aparse(model, messages, output_type), estimate_tokens(messages)
     )
-    return response.choices[0].message.parsed
+    _record(stage, model, started_at, completion)
+    parsed = completion.parsed
+    get_cache().put(key, parsed.model_dump_json())
+    return parsed
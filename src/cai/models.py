@@ -13,6 +13,18 @@ class CritiqueRewriteExample(BaseModel):
     rewrite: str
 
 
+class StageUsage(BaseModel):
+    calls: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    latency_s: float = 0.0
+    latency_p50_s: float | None = None
+    latency_p95_s: float | None = None
+    cost_usd: float = 0.0
+
+
 class EvaluationResult(BaseModel):
     human_prompt: str
     assistant_answer: str
@@ -20,10 +32,74 @@ class EvaluationResult(BaseModel):
     rewrite: str
     follows_principle: bool
     first_letters: str
+    usage: dict[str, StageUsage] = {}
+    rewrite_candidates: int = 1
+    llm_skipped: bool = False
+
+
+class StoppingInfo(BaseModel):
+    reason: str
+    confidence: float
+    ci_low: float
+    ci_high: float
+    items_evaluated: int
+    items_total: int
+    baseline_version: str | None = None
+    baseline_accuracy: float | None = None
 
 
 class EvaluationReport(BaseModel):
     version: str
     timestamp: str
+    principle: str = "adaptive"
     accuracy: float
     results: list[EvaluationResult]
+    usage: dict[str, StageUsage] = {}
+    total_cost_usd: float = 0.0
+    duration_s: float | None = None
+    # Set by sequential evaluations, which may stop before the end of the set
+    stopping: StoppingInfo | None = None
+
+
+class MatrixReport(BaseModel):
+    timestamp: str
+    principles: list[str]
+    versions: dict[str, str]
+    # Fraction of conversations whose rewrites follow every principle
+    accuracy: float
+    reports: dict[str, EvaluationReport]
+    usage: dict[str, StageUsage] = {}
+    total_cost_usd: float = 0.0
+    duration_s: float | None = None
+
+
+class ItemComparison(BaseModel):
+    human_prompt: str
+    assistant_answer: str
+    # Whether the rewrite of each version follows the principle
+    follows_principle: dict[str, bool]
+
+
+class VersionSummary(BaseModel):
+    accuracy: float
+    total_cost_usd: float
+    prompt_tokens: int
+    completion_tokens: int
+    # Percentiles of the time to critique and rewrite one item
+    latency_p50_s: float | None = None
+    latency_p95_s: float | None = None
+
+
+class ComparisonReport(BaseModel):
+    timestamp: str
+    principle: str = "adaptive"
+    versions: list[str]
+    # Version the others are compared with, the first one
+    baseline: str
+    summaries: dict[str, VersionSummary]
+    items: list[ItemComparison]
+    # Indices of the items each version fixes or breaks compared to the baseline
+    fixes: dict[str, list[int]] = {}
+    breaks: dict[str, list[int]] = {}
+    reports: dict[str, EvaluationReport]
+    duration_s: float | None = None
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable
+
+from cai.eval import assert_principle, check_acrostic
+
+DEFAULT_PRINCIPLE = "adaptive"
+
+
+@dataclass(frozen=True)
+class Principle:
+    """A principle of the constitution, with everything needed to evaluate it.
+
+    Attributes:
+        name: Name of the principle, also naming its examples library.
+        description: Statement of the principle, completing "the fact that ...".
+        verifier: Programmatic check of a text, returning (follows the principle,
+            details), e.g. `assert_principle` and the first letters it read.
+        seed: Word spelled by the first letters of the sentences, for acrostic
+            principles. Enables the early abort of diverging streamed rewrites.
+        critique_request: Critique instruction, derived from the description by
+            default.
+        rewrite_request: Rewrite instruction, derived from the description by
+            default.
+        compliant_critique: Critique given to answers that already follow the
+            principle, derived from the description by default.
+    """
+
+    name: str
+    description: str
+    verifier: Callable[[str], tuple[bool, str]]
+    seed: str | None = None
+    critique_request: str | None = None
+    rewrite_request: str | None = None
+    compliant_critique: str | None = None
+
+    def __post_init__(self):
+        defaults = {
+            "critique_request": f"Identify specific ways in which the assistant answer does not comply with the fact that {self.description}.",
+            "rewrite_request": f"Please rewrite the assistant answer to comply with the fact that {self.description}.",
+            "compliant_critique": f"The assistant answer already complies with the fact that {self.description} No rewrite is needed.",
+        }
+        for field_name, default in defaults.items():
+            if getattr(self, field_name) is None:
+                object.__setattr__(self, field_name, default)
+
+
+def acrostic_principle(name: str, seed: str) -> Principle:
+    """Build a principle requiring the first letters of the sentences to spell a word.
+
+    Args:
+        name: Name of the principle.
+        seed: Word to spell, in upper case.
+
+    Returns:
+        The principle, verified with `check_acrostic`.
+    """
+    return Principle(
+        name=name,
+        description=f"putting together the first letter of each sentence from the answer should spell '{seed}'.",
+        verifier=partial(check_acrostic, seed=seed),
+        seed=seed,
+    )
+
+
+ADAPTIVE_PRINCIPLE = Principle(
+    name=DEFAULT_PRINCIPLE,
+    description="putting together the first letter of each sentence from the answer should spell 'ADAPTIVE'.",
+    verifier=assert_principle,
+    seed="ADAPTIVE",
+)
+
+_principles: dict[str, Principle] = {DEFAULT_PRINCIPLE: ADAPTIVE_PRINCIPLE}
+
+
+def register_principle(principle: Principle) -> None:
+    """Add a principle to the constitution, replacing any with the same name."""
+    _principles[principle.name] = principle
+
+
+def list_principles() -> list[str]:
+    """Get the names of all registered principles."""
+    return list(_principles)
+
+
+def get_principle(name: str | None = None) -> Principle:
+    """Get a registered principle by name, or the default one when None."""
+    name = name or DEFAULT_PRINCIPLE
+    if name not in _principles:
+        raise ValueError(
+            f"Unknown principle {name!r}, expected one of {list_principles()}"
+        )
+    return _principles[name]
@@ -0,0 +1,140 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+from pathlib import Path
+
+from cai.eval import load_eval_report
+from cai.models import EvaluationReport
+from cai.principles import get_principle
+
+RESCORED_SUFFIX = ".rescored.json"
+
+
+@dataclass
+class VerdictChange:
+    index: int
+    human_prompt: str
+    old_first_letters: str
+    new_first_letters: str
+    follows_principle: bool
+
+
+@dataclass
+class RescoreResult:
+    path: Path
+    output_path: Path
+    old_accuracy: float
+    new_accuracy: float
+    changes: list[VerdictChange] = field(default_factory=list)
+    # Items whose first letters changed without changing their verdict
+    letters_changed: int = 0
+
+
+def rescore_report(
+    report: EvaluationReport,
+) -> tuple[EvaluationReport, list[VerdictChange], int]:
+    """Recompute the adherence of the stored rewrites with the current verifier.
+
+    No model is called: only the `follows_principle` and `first_letters` of the
+    results and the accuracy of the report are updated.
+
+    Returns:
+        Tuple of (rescored copy of the report, items whose verdict changed,
+        number of items whose first letters changed but not their verdict).
+    """
+    verifier = get_principle(report.principle).verifier
+    rescored = report.model_copy(deep=True)
+    changes = []
+    letters_changed = 0
+    for index, result in enumerate(rescored.results):
+        follows_principle, first_letters = verifier(result.rewrite)
+        if follows_principle != result.follows_principle:
+            changes.append(
+                VerdictChange(
+                    index=index,
+                    human_prompt=result.human_prompt,
+                    old_first_letters=result.first_letters,
+                    new_first_letters=first_letters,
+                    follows_principle=follows_principle,
+                )
+            )
+        elif first_letters != result.first_letters:
+            letters_changed += 1
+        result.follows_principle = follows_principle
+        result.first_letters = first_letters
+    if rescored.results:
+        rescored.accuracy = sum(r.follows_principle for r in rescored.results) / len(
+            rescored.results
+        )
+    return rescored, changes, letters_changed
+
+
+def rescore_file(path: Path, in_place: bool = False) -> RescoreResult:
+    """Rescore one report file, writing the result in place or to a sidecar file
+    next to it (`<name>.rescored.json`).
+    """
+    report = load_eval_report(path)
+    rescored, changes, letters_changed = rescore_report(report)
+    output_path = path if in_place else path.with_name(path.stem + RESCORED_SUFFIX)
+    with output_path.open("w", encoding="utf-8") as f:
+        json.dump(rescored.model_dump(), f, indent=2)
+    return RescoreResult(
+        path=path,
+        output_path=output_path,
+        old_accuracy=report.accuracy,
+        new_accuracy=rescored.accuracy,
+        changes=changes,
+        letters_changed=letters_changed,
+    )
+
+
+def find_reports(eval_dir: Path = Path("evals")) -> list[Path]:
+    """Get the evaluation reports of a directory, without the rescored sidecars."""
+    return sorted(
+        path
+        for path in eval_dir.glob("eval_report_*.json")
+        if not path.name.endswith(RESCORED_SUFFIX)
+    )
+
+
+def rescore_reports(
+    paths: list[Path], in_place: bool = False, processes: int | None = None
+) -> list[RescoreResult]:
+    """Rescore report files in parallel, one file per task.
+
+    Args:
+        paths: Report files to rescore.
+        in_place: Whether to overwrite the reports instead of writing sidecars.
+        processes: Number of worker processes, the number of CPUs when None and
+            in-process when 1.
+
+    Returns:
+        The rescoring result of each file, in `paths` order.
+    """
+    if processes == 1 or len(paths) <= 1:
+        return [rescore_file(path, in_place) for path in paths]
+    with ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(rescore_file, paths, repeat(in_place)))
+
+
+def format_rescore_diff(results: list[RescoreResult]) -> str:
+    """Describe the verdict changes of rescored reports, one line per changed item."""
+    lines = []
+    for result in results:
+        lines.append(
+            f"{result.path.name}: accuracy {result.old_accuracy:.1%} -> "
+            f"{result.new_accuracy:.1%}, {len(result.changes)} verdicts changed"
+        )
+        for change in result.changes:
+            verdict = "FAIL -> pass" if change.follows_principle else "pass -> FAIL"
+            lines.append(
+                f"  #{change.index + 1} {verdict} "
+                f"({change.old_first_letters} -> {change.new_first_letters}) "
+                f"{change.human_prompt[:60]!r}"
+            )
+        if result.letters_changed:
+            lines.append(
+                f"  {result.letters_changed} other items changed first letters only"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable
+
+from cai.eval import build_eval_report
+from cai.models import ConversationInput, EvaluationReport, EvaluationResult
+
+RUNS_PATH = Path("evals") / "runs"
+
+
+def get_item_id(example: ConversationInput) -> str:
+    """Identify a conversation by its content, so that it keeps its id whatever its
+    position in the dataset.
+    """
+    payload = json.dumps(
+        [example.human_prompt, example.assistant_answer], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def make_run_id(version: str) -> str:
+    return f"{version}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+
+class RunLog:
+    """Append-only log of the results of an evaluation run.
+
+    Each completed item is appended as one JSON line keyed by (run id, version,
+    item id) and flushed to disk right away, so that an interrupted run loses at
+    most the items in flight. A line left truncated by a crash is ignored when the
+    log is read back.
+    """
+
+    def __init__(self, run_id: str, runs_path: Path | None = None):
+        self.run_id = run_id
+        self.path = (runs_path or RUNS_PATH) / f"{run_id}.jsonl"
+        self._lock = threading.Lock()
+
+    def append(self, version: str, item_id: str, result: EvaluationResult) -> None:
+        record = {
+            "run_id": self.run_id,
+            "version": version,
+            "item_id": item_id,
+            "result": result.model_dump(),
+        }
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a+b") as f:
+                # Terminate a line left truncated by a crash
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _records(self) -> Iterable[dict]:
+        if not self.path.exists():
+            return
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    @property
+    def version(self) -> str | None:
+        """Version evaluated by the run, None if nothing was logged yet."""
+        return next((r["version"] for r in self._records()), None)
+
+    def completed(self, version: str) -> dict[str, EvaluationResult]:
+        """Get the results logged for a version, keyed by item id."""
+        return {
+            r["item_id"]: EvaluationResult(**r["result"])
+            for r in self._records()
+            if r["run_id"] == self.run_id and r["version"] == version
+        }
+
+    def build_report(
+        self,
+        eval_data: Iterable[ConversationInput],
+        version: str,
+        duration_s: float | None = None,
+    ) -> EvaluationReport:
+        """Assemble the report of the run from the log, in `eval_data` order.
+
+        Raises:
+            KeyError: If an item of `eval_data` has no logged result.
+        """
+        completed = self.completed(version)
+        results = [completed[get_item_id(example)] for example in eval_data]
+        return build_eval_report(results, version, duration_s=duration_s)
+
+
+def list_runs(runs_path: Path | None = None) -> list[str]:
+    """Get the ids of the logged runs, most recent first."""
+    runs_path = runs_path or RUNS_PATH
+    runs = sorted(runs_path.glob("*.jsonl"), key=lambda p: p.stat().st_mtime)
+    return [p.stem for p in reversed(runs)]
@@ -0,0 +1,613 @@
+import asyncio
+import random
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Iterable, Iterator, Sequence
+
+from cai.backends import get_backend
+from cai.batch import LocalBatchClient, OpenAIBatchClient, make_batch_request, run_batch
+from cai.cache import get_cache
+from cai.concurrency import aiter_window, iter_sync
+from cai.critique_rewrite import (
+    arun_critique_rewrite_pipeline,
+    get_critique_prompt,
+    get_examples_system_prompt,
+    get_rewrite_prompt,
+    is_already_compliant,
+)
+from cai.eval import (
+    build_comparison_report,
+    build_eval_report,
+    build_matrix_report,
+)
+from cai.llm import build_messages, get_model, get_request_cache_key, run_model
+from cai.models import (
+    ComparisonReport,
+    ConversationInput,
+    EvaluationReport,
+    EvaluationResult,
+    MatrixReport,
+    StageUsage,
+    StoppingInfo,
+)
+from cai.principles import get_principle, list_principles
+from cai.runlog import RunLog, get_item_id
+from cai.stopping import STOP_EXHAUSTED, StoppingRule
+from cai.usage import CallRecord, record_call, track_usage
+
+DEFAULT_CONCURRENCY = 8
+
+
+def score_example(
+    example: ConversationInput,
+    critique: str,
+    rewrite: str,
+    principle: str | None = None,
+) -> EvaluationResult:
+    """Check whether the rewrite of a conversation follows the principle.
+
+    Args:
+        example: The conversation that was critiqued and rewritten.
+        critique: The critique of the assistant answer.
+        rewrite: The rewritten assistant answer.
+        principle: Name of the principle to check, the default one when None.
+
+    Returns:
+        The evaluation result for this conversation.
+    """
+    adherence, first_letters = get_principle(principle).verifier(rewrite)
+    return EvaluationResult(
+        human_prompt=example.human_prompt,
+        assistant_answer=example.assistant_answer,
+        critique=critique,
+        rewrite=rewrite,
+        follows_principle=adherence,
+        first_letters=first_letters,
+    )
+
+
+def score_compliant_example(
+    example: ConversationInput, principle: str | None = None
+) -> EvaluationResult:
+    """Build the result of a conversation whose answer already follows the
+    principle, for which the model calls were skipped.
+    """
+    result = score_example(
+        example,
+        get_principle(principle).compliant_critique,
+        example.assistant_answer,
+        principle,
+    )
+    result.llm_skipped = True
+    return result
+
+
+async def evaluate_example(
+    example: ConversationInput,
+    version: str,
+    skip_compliant: bool = False,
+    principle: str | None = None,
+    **pipeline_options,
+) -> EvaluationResult:
+    """Run the critique+rewrite pipeline on one conversation and score the rewrite.
+
+    Args:
+        example: The conversation to critique and rewrite.
+        version: Examples version used as few-shot examples.
+        skip_compliant: Whether to skip the model calls when the assistant answer
+            already follows the principle. The result is then flagged `llm_skipped`.
+        principle: Name of the principle to follow, the default one when None.
+        **pipeline_options: Options of `arun_critique_rewrite_pipeline`, e.g.
+            `best_of_n` and `token_budget`.
+
+    Returns:
+        The evaluation result for this conversation.
+    """
+    if skip_compliant and is_already_compliant(example.assistant_answer, principle):
+        return score_compliant_example(example, principle)
+    with track_usage() as tracker:
+        critique, rewrite = await arun_critique_rewrite_pipeline(
+            example.human_prompt,
+            example.assistant_answer,
+            version,
+            # Compliance was already checked above when requested
+            skip_compliant=False,
+            principle=principle,
+            **pipeline_options,
+        )
+    result = score_example(example, critique, rewrite, principle)
+    result.usage = tracker.by_stage()
+    if "rewrite" in result.usage:
+        result.rewrite_candidates = result.usage["rewrite"].calls
+    return result
+
+
+async def aiter_evaluation(
+    eval_data: Iterable[ConversationInput],
+    version: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    run_log: RunLog | None = None,
+    **pipeline_options,
+) -> AsyncIterator[tuple[int, EvaluationResult]]:
+    """Evaluate conversations concurrently, yielding results as they complete.
+
+    At most `concurrency` conversations are in flight at any time and the input is
+    consumed lazily, so memory stays bounded whatever the dataset size. Results are
+    yielded in completion order together with their input index.
+
+    With a run log, each result is appended to it as soon as it completes, and the
+    items already logged for this version are yielded from the log instead of
+    being evaluated again, so that an interrupted run resumes where it stopped.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        version: Examples version used as few-shot examples.
+        concurrency: Maximum number of conversations processed at once.
+        run_log: Optional log to resume from and to append results to.
+        **pipeline_options: Options of `evaluate_example`, e.g. `skip_compliant`,
+            `best_of_n` and `token_budget`.
+
+    Yields:
+        Tuples of (input index, evaluation result).
+    """
+    completed = run_log.completed(version) if run_log is not None else {}
+
+    async def _evaluate(example: ConversationInput) -> EvaluationResult:
+        if run_log is None:
+            return await evaluate_example(example, version, **pipeline_options)
+        item_id = get_item_id(example)
+        if item_id in completed:
+            return completed[item_id]
+        result = await evaluate_example(example, version, **pipeline_options)
+        run_log.append(version, item_id, result)
+        return result
+
+    jobs = (lambda example=example: _evaluate(example) for example in eval_data)
+    # Close the window with this generator, so that the conversations in flight
+    # are cancelled on this loop when the caller stops early
+    async with aclosing(aiter_window(jobs, concurrency)) as window:
+        async for item in window:
+            yield item
+
+
+def iter_evaluation(
+    eval_data: Iterable[ConversationInput],
+    version: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    run_log: RunLog | None = None,
+    **pipeline_options,
+) -> Iterator[tuple[int, EvaluationResult]]:
+    """Synchronous wrapper around `aiter_evaluation`, e.g. for Streamlit pages.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        version: Examples version used as few-shot examples.
+        concurrency: Maximum number of conversations processed at once.
+        run_log: Optional log to resume from and to append results to.
+        **pipeline_options: Options of `evaluate_example`, e.g. `skip_compliant`,
+            `best_of_n` and `token_budget`.
+
+    Yields:
+        Tuples of (input index, evaluation result) in completion order.
+    """
+    return iter_sync(
+        aiter_evaluation(eval_data, version, concurrency, run_log, **pipeline_options)
+    )
+
+
+def run_evaluation(
+    eval_data: Iterable[ConversationInput],
+    version: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    run_log: RunLog | None = None,
+    **pipeline_options,
+) -> list[EvaluationResult]:
+    """Evaluate conversations concurrently and return results in input order.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        version: Examples version used as few-shot examples.
+        concurrency: Maximum number of conversations processed at once.
+        run_log: Optional log to resume from and to append results to.
+        **pipeline_options: Options of `evaluate_example`, e.g. `skip_compliant`,
+            `best_of_n` and `token_budget`.
+
+    Returns:
+        List of evaluation results, in the same order as `eval_data`.
+    """
+    results = dict(
+        iter_evaluation(eval_data, version, concurrency, run_log, **pipeline_options)
+    )
+    return [results[index] for index in sorted(results)]
+
+
+async def arun_sequential_evaluation(
+    eval_data: Sequence[ConversationInput],
+    version: str,
+    rule: StoppingRule | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    seed: int | None = None,
+    on_result: Callable[[EvaluationResult, float, float], None] | None = None,
+    **pipeline_options,
+) -> EvaluationReport:
+    """Evaluate conversations in random order until the accuracy is known well enough.
+
+    After each result, a confidence interval on accuracy is updated and checked
+    against `rule`. Once it is tight enough, or clearly above or below the
+    baseline of the rule, the conversations in flight are cancelled and the
+    remaining ones are never evaluated.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        version: Examples version used as few-shot examples.
+        rule: When to stop, `StoppingRule()` by default.
+        concurrency: Maximum number of conversations processed at once.
+        seed: Seed of the random evaluation order.
+        on_result: Optional callback receiving each result and the bounds of the
+            confidence interval after it.
+        **pipeline_options: Options of `aiter_evaluation`, e.g. `run_log`,
+            `skip_compliant` and `best_of_n`.
+
+    Returns:
+        The report of the evaluated conversations, in evaluation order, with the
+        stopping reason and the final confidence interval.
+    """
+    started_at = time.perf_counter()
+    rule = rule or StoppingRule()
+    order = random.Random(seed).sample(range(len(eval_data)), len(eval_data))
+    results: list[EvaluationResult] = []
+    reason, low, high = None, 0.0, 1.0
+    evaluation = aiter_evaluation(
+        (eval_data[i] for i in order), version, concurrency, **pipeline_options
+    )
+    # Closing the evaluation closes its job window, which cancels the
+    # conversations in flight once the rule stops it
+    async with aclosing(evaluation) as evaluation:
+        async for _, result in evaluation:
+            results.append(result)
+            successes = sum(r.follows_principle for r in results)
+            reason, low, high = rule.check(successes, len(results))
+            if on_result is not None:
+                on_result(result, low, high)
+            if reason is not None:
+                break
+
+    report = build_eval_report(
+        results, version, duration_s=time.perf_counter() - started_at
+    )
+    report.stopping = StoppingInfo(
+        reason=reason or STOP_EXHAUSTED,
+        confidence=rule.confidence,
+        ci_low=low,
+        ci_high=high,
+        items_evaluated=len(results),
+        items_total=len(eval_data),
+        baseline_version=rule.baseline.version if rule.baseline else None,
+        baseline_accuracy=rule.baseline.accuracy if rule.baseline else None,
+    )
+    return report
+
+
+def run_sequential_evaluation(
+    eval_data: Sequence[ConversationInput],
+    version: str,
+    rule: StoppingRule | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    seed: int | None = None,
+    on_result: Callable[[EvaluationResult, float, float], None] | None = None,
+    **pipeline_options,
+) -> EvaluationReport:
+    """Synchronous wrapper around `arun_sequential_evaluation`."""
+    return asyncio.run(
+        arun_sequential_evaluation(
+            eval_data, version, rule, concurrency, seed, on_result, **pipeline_options
+        )
+    )
+
+
+async def _aevaluate_grid(
+    eval_data: Iterable[ConversationInput],
+    columns: dict[str, tuple[str, str | None]],
+    concurrency: int,
+    **pipeline_options,
+) -> dict[str, list[EvaluationResult]]:
+    """Evaluate every conversation under every (version, principle) column.
+
+    All (conversation, column) pairs are scheduled as one job list in a single
+    sliding window, conversation by conversation, so the columns progress side by
+    side and share the scheduler fairly. Identical conversations are evaluated
+    once per column, and the system prompt of each column is rendered once before
+    the run.
+
+    Returns:
+        The results of each column, in `eval_data` order.
+    """
+    for version, principle in columns.values():
+        get_examples_system_prompt(version, principle)
+
+    conversations = list(eval_data)
+    unique: dict[tuple[str, str], ConversationInput] = {}
+    for example in conversations:
+        unique.setdefault((example.human_prompt, example.assistant_answer), example)
+    pairs = [(example, column) for example in unique.values() for column in columns]
+
+    def _job(example: ConversationInput, column: str):
+        version, principle = columns[column]
+        return evaluate_example(
+            example, version, principle=principle, **pipeline_options
+        )
+
+    jobs = (
+        lambda example=example, column=column: _job(example, column)
+        for example, column in pairs
+    )
+    results: dict[tuple[str, str, str], EvaluationResult] = {}
+    async with aclosing(aiter_window(jobs, concurrency)) as window:
+        async for index, result in window:
+            example, column = pairs[index]
+            results[(example.human_prompt, example.assistant_answer, column)] = result
+
+    def _column_results(column: str) -> list[EvaluationResult]:
+        column_results = []
+        seen = set()
+        for e in conversations:
+            key = (e.human_prompt, e.assistant_answer, column)
+            result = results[key]
+            # Duplicates share the result, without counting its usage twice
+            if key in seen:
+                result = result.model_copy(update={"usage": {}})
+            seen.add(key)
+            column_results.append(result)
+        return column_results
+
+    return {column: _column_results(column) for column in columns}
+
+
+async def arun_matrix_evaluation(
+    eval_data: Iterable[ConversationInput],
+    versions: str | dict[str, str],
+    principles: list[str] | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **pipeline_options,
+) -> MatrixReport:
+    """Evaluate every principle of the constitution on every conversation.
+
+    All (conversation, principle) pairs are scheduled as one job list in a single
+    sliding window, conversation by conversation, so the principles of a
+    conversation run side by side. The work that only depends on the conversation
+    is shared across principles: identical conversations are evaluated once, and
+    the system prompt of each principle is rendered once before the run, see
+    `_aevaluate_grid`.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        versions: Examples version of each principle, or one version for all.
+        principles: Names of the principles to evaluate, all registered ones when
+            None.
+        concurrency: Maximum number of (conversation, principle) pairs processed
+            at once.
+        **pipeline_options: Options of `evaluate_example`, e.g. `skip_compliant`,
+            `best_of_n` and `token_budget`.
+
+    Returns:
+        The matrix report, with one evaluation report per principle.
+    """
+    started_at = time.perf_counter()
+    principles = principles or list_principles()
+    if isinstance(versions, str):
+        versions = dict.fromkeys(principles, versions)
+    versions = {principle: versions[principle] for principle in principles}
+    results = await _aevaluate_grid(
+        eval_data,
+        {principle: (versions[principle], principle) for principle in principles},
+        concurrency,
+        **pipeline_options,
+    )
+    return build_matrix_report(
+        results, versions, duration_s=time.perf_counter() - started_at
+    )
+
+
+def run_matrix_evaluation(
+    eval_data: Iterable[ConversationInput],
+    versions: str | dict[str, str],
+    principles: list[str] | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **pipeline_options,
+) -> MatrixReport:
+    """Synchronous wrapper around `arun_matrix_evaluation`."""
+    return asyncio.run(
+        arun_matrix_evaluation(
+            eval_data, versions, principles, concurrency, **pipeline_options
+        )
+    )
+
+
+async def arun_version_comparison(
+    eval_data: Iterable[ConversationInput],
+    versions: list[str],
+    principle: str | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **pipeline_options,
+) -> ComparisonReport:
+    """Evaluate several examples versions on the same conversations in one job.
+
+    All (conversation, version) pairs share one sliding window and the scheduler,
+    conversation by conversation, so no version starves the others, see
+    `_aevaluate_grid`.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        versions: Examples versions to compare, the first one being the baseline.
+        principle: Name of the principle to follow, the default one when None.
+        concurrency: Maximum number of (conversation, version) pairs processed at
+            once.
+        **pipeline_options: Options of `evaluate_example`, e.g. `skip_compliant`,
+            `best_of_n` and `token_budget`.
+
+    Returns:
+        The comparison report, with the items each version fixes and breaks
+        compared to the baseline.
+    """
+    if not versions:
+        raise ValueError("At least one version is required")
+    started_at = time.perf_counter()
+    results = await _aevaluate_grid(
+        eval_data,
+        {version: (version, principle) for version in versions},
+        concurrency,
+        **pipeline_options,
+    )
+    return build_comparison_report(
+        results, principle, duration_s=time.perf_counter() - started_at
+    )
+
+
+def run_version_comparison(
+    eval_data: Iterable[ConversationInput],
+    versions: list[str],
+    principle: str | None = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    **pipeline_options,
+) -> ComparisonReport:
+    """Synchronous wrapper around `arun_version_comparison`."""
+    return asyncio.run(
+        arun_version_comparison(
+            eval_data, versions, principle, concurrency, **pipeline_options
+        )
+    )
+
+
+def _run_batch_stage(
+    stage: str,
+    prompts: list[str],
+    system_prompt: str,
+    batch_client,
+    poll_interval: float,
+    on_status: Callable[[str, str], None] | None,
+) -> list[tuple[str, StageUsage]]:
+    """Run one pipeline stage over all prompts as a single batch.
+
+    Cached responses are reused and new ones are cached, exactly like `run_model`.
+    Requests failing inside the batch are retried interactively. The latency of a
+    batched request is the duration of the whole batch.
+
+    Returns:
+        List of (response, usage) tuples, in the same order as `prompts`.
+    """
+    model = get_model(stage)
+    cache = get_cache()
+    responses: list[tuple[str, StageUsage] | None] = []
+    requests = []
+    for index, prompt in enumerate(prompts):
+        messages = build_messages(prompt, system_prompt)
+        response = cache.get(get_request_cache_key(model, messages))
+        if response is None:
+            responses.append(None)
+            requests.append(make_batch_request(f"{stage}-{index}", model, messages))
+        else:
+            record = CallRecord(stage=stage, model=model, latency_s=0.0, cache_hit=True)
+            record_call(record)
+            responses.append((response, record.to_usage()))
+
+    started_at = time.perf_counter()
+    completions = run_batch(batch_client, requests, poll_interval, on_status)
+    batch_latency = time.perf_counter() - started_at
+    for request in requests:
+        index = int(request["custom_id"].rsplit("-", 1)[1])
+        completion = completions.get(request["custom_id"])
+        if completion is None:
+            with track_usage() as tracker:
+                response = run_model(prompts[index], system_prompt, stage=stage)
+            responses[index] = (response, tracker.by_stage()[stage])
+            continue
+        record = CallRecord(
+            stage=stage,
+            model=model,
+            latency_s=batch_latency,
+            prompt_tokens=completion.prompt_tokens,
+            completion_tokens=completion.completion_tokens,
+            cached_prompt_tokens=completion.cached_prompt_tokens,
+            batch=True,
+        )
+        record_call(record)
+        cache.put(
+            get_request_cache_key(model, request["body"]["messages"]), completion.text
+        )
+        responses[index] = (completion.text, record.to_usage())
+    return responses
+
+
+def run_batch_evaluation(
+    eval_data: Iterable[ConversationInput],
+    version: str,
+    batch_client=None,
+    poll_interval: float = 30.0,
+    on_status: Callable[[str, str], None] | None = None,
+    skip_compliant: bool = False,
+) -> EvaluationReport:
+    """Evaluate conversations through the batch endpoint, for large offline runs.
+
+    All critiques are submitted as one batch; once it completes, the dependent
+    rewrites are submitted as a second batch.
+
+    Args:
+        eval_data: Conversations to evaluate.
+        version: Examples version used as few-shot examples.
+        batch_client: Batch client to use. Defaults to `OpenAIBatchClient`, or to
+            `LocalBatchClient` when the active backend is not the OpenAI API.
+        poll_interval: Seconds between two batch status checks.
+        on_status: Optional callback receiving (batch id, status) at each check.
+        skip_compliant: Whether to leave out of the batches the conversations whose
+            answer already follows the principle.
+
+    Returns:
+        The evaluation report, in the same order as `eval_data`.
+    """
+    started_at = time.perf_counter()
+    all_data = list(eval_data)
+    skipped = [
+        skip_compliant and is_already_compliant(e.assistant_answer) for e in all_data
+    ]
+    eval_data = [e for e, skip in zip(all_data, skipped) if not skip]
+    if batch_client is None:
+        batch_client = (
+            OpenAIBatchClient()
+            if get_backend().name == "openai"
+            else LocalBatchClient()
+        )
+    system_prompt = get_examples_system_prompt(version)
+
+    critiques = _run_batch_stage(
+        "critique",
+        [get_critique_prompt(e.human_prompt, e.assistant_answer) for e in eval_data],
+        system_prompt,
+        batch_client,
+        poll_interval,
+        on_status,
+    )
+    rewrites = _run_batch_stage(
+        "rewrite",
+        [
+            get_rewrite_prompt(e.human_prompt, e.assistant_answer, critique)
+            for e, (critique, _) in zip(eval_data, critiques)
+        ],
+        system_prompt,
+        batch_client,
+        poll_interval,
+        on_status,
+    )
+
+    batched_results = iter(zip(critiques, rewrites))
+    results = []
+    for example, skip in zip(all_data, skipped):
+        if skip:
+            results.append(score_compliant_example(example))
+            continue
+        (critique, critique_usage), (rewrite, rewrite_usage) = next(batched_results)
+        result = score_example(example, critique, rewrite)
+        result.usage = {"critique": critique_usage, "rewrite": rewrite_usage}
+        results.append(result)
+    return build_eval_report(
+        results, version, duration_s=time.perf_counter() - started_at
+    )
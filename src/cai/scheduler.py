@@ -0,0 +1,338 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+
+R = TypeVar("R")
+
+# Initial limit of the adaptive concurrency, and latency in seconds up to which
+# it keeps ramping up
+DEFAULT_INITIAL_CONCURRENCY = 16
+DEFAULT_TARGET_LATENCY = 30.0
+
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+def _status_code(exc: BaseException) -> int | None:
+    return getattr(exc, "status_code", None)
+
+
+def is_throttle(exc: BaseException) -> bool:
+    """Whether the error means the account is being rate limited."""
+    return _status_code(exc) == 429
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether the request that raised `exc` may succeed if retried.
+
+    Rate limits (429), timeouts (408), conflicts (409), server errors (5xx) and
+    connection errors are retryable; other client errors are not.
+    """
+    status = _status_code(exc)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Get the delay in seconds requested by the server through retry-after headers."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (ValueError, TypeError):
+        # Malformed date: fall back to the regular backoff
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+@dataclass
+class RetryPolicy:
+    """Jittered exponential backoff, honouring retry-after headers."""
+
+    max_attempts: int = 6
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int, exc: BaseException) -> float:
+        """Delay before retrying after the `attempt`-th failed attempt (from 0)."""
+        requested = retry_after(exc)
+        if requested is not None:
+            # Add a little jitter so that throttled requests don't retry in lockstep
+            return min(self.max_delay, requested) + random.uniform(
+                0, self.base_delay / 4
+            )
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    Reservations are always granted and may drive the balance negative: the caller
+    is told how long to wait for its reservation to be covered. This keeps requests
+    in FIFO order without a background refill thread.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        capacity: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """Take `amount` tokens and return the seconds to wait before using them."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            # A single request larger than the bucket only has to wait for a full one
+            self._tokens -= min(amount, self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the number of requests in flight, shared across event loops.
+
+    The limit grows additively (by `increase` per window of successful requests)
+    while latency stays under `target_latency`, and is multiplied by `decrease`
+    when the API throttles, at most once per `cooldown` seconds.
+    """
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_INITIAL_CONCURRENCY,
+        minimum: int = 1,
+        maximum: int = 64,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        target_latency: float | None = None,
+        cooldown: float = 5.0,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = float("-inf")
+        self._waiters: deque[asyncio.Future] = deque()
+        self._granted: set[asyncio.Future] = set()
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._granted:
+                    # The slot was handed over right before the cancellation
+                    self._granted.discard(waiter)
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+        with self._lock:
+            self._granted.discard(waiter)
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            self._granted.add(waiter)
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+    def on_success(self, latency: float) -> None:
+        with self._lock:
+            if self.target_latency is None or latency <= self.target_latency:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+                self._wake()
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = now
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Scheduler:
+    """Paces, limits and retries model requests.
+
+    Every request first reserves one request and its estimated tokens from the
+    requests-per-minute and tokens-per-minute buckets. Async requests also take a
+    slot from the adaptive concurrency limit. Retryable errors are retried with
+    jittered exponential backoff; throttling also shrinks the concurrency limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        concurrency: AdaptiveConcurrency | None = None,
+        retry: RetryPolicy | None = None,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.retry = retry or RetryPolicy()
+
+    def _pacing_delay(self, estimated_tokens: int) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(estimated_tokens))
+        return delay
+
+    def run(self, request: Callable[[], R], estimated_tokens: int = 0) -> R:
+        """Run a blocking request, pacing and retrying it.
+
+        Args:
+            request: Function sending the request.
+            estimated_tokens: Estimated prompt and completion tokens of the request.
+
+        Returns:
+            The result of `request`.
+        """
+        for attempt in range(self.retry.max_attempts):
+            time.sleep(self._pacing_delay(estimated_tokens))
+            try:
+                return request()
+            except Exception as exc:
+                if not is_retryable(exc) or attempt == self.retry.max_attempts - 1:
+                    raise
+                if is_throttle(exc):
+                    self.concurrency.on_throttle()
+                time.sleep(self.retry.delay(attempt, exc))
+
+    async def arun(
+        self, request: Callable[[], Awaitable[R]], estimated_tokens: int = 0
+    ) -> R:
+        """Run an async request, pacing, limiting and retrying it.
+
+        Args:
+            request: Function returning a new awaitable sending the request.
+            estimated_tokens: Estimated prompt and completion tokens of the request.
+
+        Returns:
+            The result of `request`.
+        """
+        for attempt in range(self.retry.max_attempts):
+            await asyncio.sleep(self._pacing_delay(estimated_tokens))
+            await self.concurrency.acquire()
+            started_at = time.monotonic()
+            try:
+                result = await request()
+            except Exception as exc:
+                if not is_retryable(exc) or attempt == self.retry.max_attempts - 1:
+                    raise
+                if is_throttle(exc):
+                    self.concurrency.on_throttle()
+                delay = self.retry.delay(attempt, exc)
+            else:
+                self.concurrency.on_success(time.monotonic() - started_at)
+                return result
+            finally:
+                self.concurrency.release()
+            await asyncio.sleep(delay)
+
+
+def estimate_tokens(messages: list[dict], completion_tokens: int = 512) -> int:
+    """Roughly estimate the tokens of a request, at about 4 characters per token."""
+    return sum(len(m["content"]) for m in messages) // 4 + completion_tokens
+
+
+_scheduler: Scheduler | None = None
+
+
+def get_scheduler() -> Scheduler:
+    """Return the process-wide scheduler.
+
+    It is configured from the environment on first use:
+    - CAI_RPM / CAI_TPM: requests and tokens per minute allowed (default: no limit).
+    - CAI_MAX_CONCURRENCY: upper bound of the adaptive concurrency (default 64).
+    - CAI_TARGET_LATENCY: request latency in seconds above which the adaptive
+      concurrency stops ramping up (default 30).
+    - CAI_MAX_RETRIES: number of retries of a failing request (default 5).
+    """
+    global _scheduler
+    if _scheduler is None:
+        rpm = os.environ.get("CAI_RPM")
+        tpm = os.environ.get("CAI_TPM")
+        maximum = int(os.environ.get("CAI_MAX_CONCURRENCY", 64))
+        _scheduler = Scheduler(
+            requests_per_minute=float(rpm) if rpm else None,
+            tokens_per_minute=float(tpm) if tpm else None,
+            concurrency=AdaptiveConcurrency(
+                initial=min(DEFAULT_INITIAL_CONCURRENCY, maximum),
+                maximum=maximum,
+                target_latency=float(
+                    os.environ.get("CAI_TARGET_LATENCY", DEFAULT_TARGET_LATENCY)
+                ),
+            ),
+            retry=RetryPolicy(
+                max_attempts=int(os.environ.get("CAI_MAX_RETRIES", 5)) + 1
+            ),
+        )
+    return _scheduler
+
+
+def set_scheduler(scheduler: Scheduler) -> None:
+    """Replace the process-wide scheduler."""
+    global _scheduler
+    _scheduler = scheduler
@@ -0,0 +1,254 @@
+import re
+import threading
+from typing import Iterable, Sequence
+
+import numpy as np
+
+from cai.datasets import open_dataset
+from cai.principles import get_principle
+from cai.versioning import get_examples_signature, load_examples, resolve_version
+
+DEFAULT_DIMENSIONS = 512
+DEFAULT_NGRAM = 3
+# Cosine similarity above which two prompts are near-duplicates
+DEFAULT_THRESHOLD = 0.9
+# Sets whose prompts must not leak into the examples
+DEFAULT_REFERENCE_SETS = ("test",)
+# Texts vectorized at once, which bounds the memory used by the n-gram arrays
+_BATCH_SIZE = 4096
+# Multiplier of the n-gram hash (64-bit golden ratio)
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(text: str) -> bytes:
+    # Compare words only, so that casing and punctuation don't matter
+    words = _WORD.findall(text.lower())
+    return f" {' '.join(words)} ".encode("utf-8")
+
+
+def vectorize(
+    texts: Sequence[str],
+    dimensions: int = DEFAULT_DIMENSIONS,
+    ngram: int = DEFAULT_NGRAM,
+) -> np.ndarray:
+    """Embed texts as unit vectors of hashed character n-gram counts.
+
+    Each n-gram of the lowercased words of a text is hashed to one of `dimensions`
+    buckets, with a hashed sign so that collisions cancel out on average. The whole
+    batch is hashed with array operations, without a Python loop over the n-grams.
+
+    Returns:
+        Array of shape (len(texts), dimensions), whose dot products are the
+        cosine similarities of the texts.
+    """
+    data = [_normalize(text) for text in texts]
+    lengths = np.array([len(d) for d in data], dtype=np.int64)
+    counts = np.maximum(lengths - ngram + 1, 0)
+    n_grams = int(counts.sum())
+    buffer = np.frombuffer(b"".join(data), dtype=np.uint8).astype(np.uint64)
+
+    # Start of every n-gram in the joined buffer, skipping those across two texts
+    starts = np.cumsum(lengths) - lengths
+    first_ngram = np.cumsum(counts) - counts
+    positions = np.arange(n_grams) + np.repeat(starts - first_ngram, counts)
+    codes = np.zeros(n_grams, dtype=np.uint64)
+    for offset in range(ngram):
+        codes = codes * np.uint64(257) + buffer[positions + offset]
+    hashes = codes * _HASH_MULTIPLIER
+    buckets = (hashes >> np.uint64(40)) % np.uint64(dimensions)
+    signs = ((hashes >> np.uint64(32)) & np.uint64(1)).astype(np.float64) * 2 - 1
+
+    rows = np.repeat(np.arange(len(data)), counts)
+    vectors = np.bincount(
+        rows * dimensions + buckets.astype(np.int64),
+        weights=signs,
+        minlength=len(data) * dimensions,
+    ).reshape(len(data), dimensions)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+class SimilarityIndex:
+    """In-memory index of texts, searched by cosine similarity.
+
+    Vectors are stored in one preallocated array grown by doubling, so that adding
+    rows is amortized and a lookup is a single matrix product, which stays in the
+    milliseconds for tens of thousands of rows.
+    """
+
+    def __init__(
+        self,
+        texts: Iterable[str] = (),
+        dimensions: int = DEFAULT_DIMENSIONS,
+        ngram: int = DEFAULT_NGRAM,
+    ):
+        self.dimensions = dimensions
+        self.ngram = ngram
+        self.texts: list[str] = []
+        self._vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.add(texts)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def vectorize(self, texts: Sequence[str]) -> np.ndarray:
+        return vectorize(texts, self.dimensions, self.ngram)
+
+    def add(self, texts: Iterable[str]) -> None:
+        texts = list(texts)
+        for start in range(0, len(texts), _BATCH_SIZE):
+            batch = texts[start : start + _BATCH_SIZE]
+            size = len(self.texts)
+            if size + len(batch) > len(self._vectors):
+                capacity = max(size + len(batch), 2 * len(self._vectors))
+                vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+                vectors[:size] = self._vectors[:size]
+                self._vectors = vectors
+            self._vectors[size : size + len(batch)] = self.vectorize(batch)
+            self.texts.extend(batch)
+
+    def similarities(self, vectors: np.ndarray) -> np.ndarray:
+        """Cosine similarities of query vectors to every row, shape (queries, rows)."""
+        return vectors @ self._vectors[: len(self.texts)].T
+
+    def max_similarity(self, texts: Sequence[str]) -> np.ndarray:
+        """Similarity of each text to its nearest row, 0 for an empty index."""
+        if not self.texts:
+            return np.zeros(len(texts), dtype=np.float32)
+        return self.similarities(self.vectorize(texts)).max(axis=1)
+
+    def nearest(self, text: str, k: int = 5) -> list[tuple[int, float]]:
+        """Get the `k` rows most similar to a text.
+
+        Returns:
+            Tuples of (row index, cosine similarity), most similar first.
+        """
+        scores = self.similarities(self.vectorize([text]))[0]
+        k = min(k, len(scores))
+        nearest = np.argpartition(-scores, k - 1)[:k] if k else []
+        return sorted(
+            ((int(i), float(scores[i])) for i in nearest), key=lambda r: -r[1]
+        )
+
+    def search(self, text: str, k: int = 5) -> list[tuple[str, float]]:
+        """Get the `k` rows most similar to a text.
+
+        Returns:
+            Tuples of (row text, cosine similarity), most similar first.
+        """
+        return [(self.texts[i], score) for i, score in self.nearest(text, k)]
+
+
+def filter_near_duplicates(
+    candidates: Sequence[str],
+    threshold: float = DEFAULT_THRESHOLD,
+    indexes: Iterable[SimilarityIndex] = (),
+) -> list[int]:
+    """Select the candidates that are not near-duplicates, before spending any
+    model call on them.
+
+    A candidate is dropped when its similarity to a row of `indexes`, or to a
+    candidate kept before it, is at least `threshold`.
+
+    Returns:
+        Indices of the kept candidates, in order.
+    """
+    if not candidates:
+        return []
+    indexes = list(indexes)
+    dimensions = indexes[0].dimensions if indexes else DEFAULT_DIMENSIONS
+    ngram = indexes[0].ngram if indexes else DEFAULT_NGRAM
+    vectors = vectorize(candidates, dimensions, ngram)
+    known = np.zeros(len(candidates), dtype=np.float32)
+    for index in indexes:
+        if len(index):
+            known = np.maximum(known, index.similarities(vectors).max(axis=1))
+    between = vectors @ vectors.T
+    kept = []
+    for i in range(len(candidates)):
+        if known[i] < threshold and all(between[i, j] < threshold for j in kept):
+            kept.append(i)
+    return kept
+
+
+def cluster(texts: Sequence[str], k: int, iterations: int = 10) -> list[list[int]]:
+    """Group texts by similarity, with spherical k-means over their vectors.
+
+    Centroids start from the farthest-point traversal of the texts, so that the
+    clustering is deterministic and covers outliers.
+
+    Returns:
+        Up to `k` clusters of text indices, largest first, each one ordered from
+        its most central text, which is the most representative of the cluster.
+    """
+    if not texts or k < 1:
+        return []
+    vectors = vectorize(texts)
+    seeds = [0]
+    closest = vectors @ vectors[0]
+    for _ in range(min(k, len(texts)) - 1):
+        seeds.append(int(np.argmin(closest)))
+        closest = np.maximum(closest, vectors @ vectors[seeds[-1]])
+    centroids = vectors[seeds]
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmax(vectors @ centroids.T, axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for c in range(len(centroids)):
+            members = vectors[labels == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                norm = np.linalg.norm(centroid)
+                centroids[c] = centroid / norm if norm else centroid
+
+    scores = (vectors * centroids[labels]).sum(axis=1)
+    clusters = [
+        sorted(np.flatnonzero(labels == c).tolist(), key=lambda i: -scores[i])
+        for c in range(len(centroids))
+    ]
+    return sorted((c for c in clusters if c), key=len, reverse=True)
+
+
+# Reference indexes, keyed by principle, version and sets and stored with the
+# signature of the examples and dataset files they were built from.
+_reference_indexes: dict[tuple, tuple[tuple, SimilarityIndex]] = {}
+_reference_lock = threading.Lock()
+
+
+def get_reference_index(
+    version: str = "dev",
+    principle: str | None = None,
+    sets: Sequence[str] = DEFAULT_REFERENCE_SETS,
+) -> SimilarityIndex:
+    """Get an index of the prompts that new examples must not duplicate: those of
+    an examples version and of evaluation sets, e.g. the test set.
+
+    The index is rebuilt only when the version or one of the sets changes, and is
+    shared by the callers, which must not add rows to it.
+
+    Args:
+        version: Examples version whose prompts to index.
+        principle: Principle whose examples library to use, None for the default.
+        sets: Bundled sets or paths of JSONL datasets whose prompts to index.
+    """
+    datasets = [open_dataset(set_) for set_ in sets]
+    key = (get_principle(principle).name, resolve_version(version), tuple(sets))
+    signature = (
+        get_examples_signature(version, principle),
+        *((d.path.stat().st_mtime_ns, d.path.stat().st_size) for d in datasets),
+    )
+    with _reference_lock:
+        cached = _reference_indexes.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    index = SimilarityIndex(e.human_prompt for e in load_examples(version, principle))
+    for dataset in datasets:
+        index.add(conversation.human_prompt for conversation in dataset)
+    with _reference_lock:
+        _reference_indexes[key] = (signature, index)
+    return index
@@ -0,0 +1,78 @@
+import math
+from dataclasses import dataclass
+from statistics import NormalDist
+
+from cai.models import EvaluationReport
+
+STOP_INTERVAL_WIDTH = "interval_width"
+STOP_BETTER_THAN_BASELINE = "better_than_baseline"
+STOP_WORSE_THAN_BASELINE = "worse_than_baseline"
+STOP_EXHAUSTED = "exhausted"
+
+
+def wilson_interval(
+    successes: int, trials: int, confidence: float = 0.95
+) -> tuple[float, float]:
+    """Wilson score interval of a success rate, well behaved near 0 and 1 and for
+    few trials.
+
+    Returns:
+        Tuple of (lower bound, upper bound), (0, 1) without trials.
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / trials
+    denominator = 1 + z**2 / trials
+    center = (p + z**2 / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z**2 / (4 * trials**2)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+@dataclass
+class StoppingRule:
+    """When a sequential evaluation has seen enough items.
+
+    The evaluation stops once the confidence interval on accuracy is narrower than
+    `max_width`, or, with a baseline, once it no longer overlaps the interval of
+    the baseline accuracy, i.e. the new version is clearly better or worse.
+
+    Attributes:
+        max_width: Width of the confidence interval deemed tight enough.
+        confidence: Confidence level of the intervals.
+        min_items: Number of items evaluated before any stop, which guards against
+            stopping on a lucky streak since the interval is checked after every
+            item.
+        baseline: Optional report of the version to compare with.
+    """
+
+    max_width: float = 0.1
+    confidence: float = 0.95
+    min_items: int = 20
+    baseline: EvaluationReport | None = None
+
+    def baseline_interval(self) -> tuple[float, float] | None:
+        if self.baseline is None:
+            return None
+        successes = sum(r.follows_principle for r in self.baseline.results)
+        return wilson_interval(successes, len(self.baseline.results), self.confidence)
+
+    def check(self, successes: int, trials: int) -> tuple[str | None, float, float]:
+        """Check whether to stop after `trials` items, `successes` of them passing.
+
+        Returns:
+            Tuple of (stopping reason or None to continue, interval lower bound,
+            interval upper bound).
+        """
+        low, high = wilson_interval(successes, trials, self.confidence)
+        if trials < self.min_items:
+            return None, low, high
+        baseline = self.baseline_interval()
+        if baseline is not None:
+            if low > baseline[1]:
+                return STOP_BETTER_THAN_BASELINE, low, high
+            if high < baseline[0]:
+                return STOP_WORSE_THAN_BASELINE, low, high
+        if high - low <= self.max_width:
+            return STOP_INTERVAL_WIDTH, low, high
+        return None, low, high
@@ -0,0 +1,156 @@
+import statistics
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+from cai.models import EvaluationResult, StageUsage
+
+# Prices in USD per million tokens: (prompt, cached prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+BATCH_DISCOUNT = 0.5
+
+
+def estimate_cost(
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_prompt_tokens: int = 0,
+    batch: bool = False,
+) -> float:
+    """Estimate the cost of a call in USD, or 0 for models without a known price.
+
+    Dated snapshots (e.g. "gpt-4o-2024-08-06") are priced like their base model.
+    """
+    prefixes = [p for p in MODEL_PRICES if model.startswith(p)]
+    if not prefixes:
+        return 0.0
+    prompt_price, cached_price, completion_price = MODEL_PRICES[max(prefixes, key=len)]
+    cost = (
+        (prompt_tokens - cached_prompt_tokens) * prompt_price
+        + cached_prompt_tokens * cached_price
+        + completion_tokens * completion_price
+    ) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+@dataclass
+class CallRecord:
+    """Usage and timing of one model call."""
+
+    stage: str
+    model: str
+    latency_s: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    cache_hit: bool = False
+    batch: bool = False
+
+    @property
+    def cost_usd(self) -> float:
+        return estimate_cost(
+            self.model,
+            self.prompt_tokens,
+            self.completion_tokens,
+            self.cached_prompt_tokens,
+            self.batch,
+        )
+
+    def to_usage(self) -> StageUsage:
+        return StageUsage(
+            calls=1,
+            cache_hits=int(self.cache_hit),
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            cached_prompt_tokens=self.cached_prompt_tokens,
+            latency_s=self.latency_s,
+            cost_usd=self.cost_usd,
+        )
+
+
+@dataclass
+class UsageTracker:
+    """Collects the records of the model calls made while it is active."""
+
+    records: list[CallRecord] = field(default_factory=list)
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def by_stage(self) -> dict[str, StageUsage]:
+        """Aggregate the records per pipeline stage."""
+        return _aggregate((record.stage, record.to_usage()) for record in self.records)
+
+    @property
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self.started_at
+
+
+_active_trackers: ContextVar[tuple[UsageTracker, ...]] = ContextVar(
+    "active_usage_trackers", default=()
+)
+
+
+@contextmanager
+def track_usage() -> Iterator[UsageTracker]:
+    """Record the model calls made in this context, including in tasks it spawns.
+
+    Trackers nest: a call is recorded by every active tracker, e.g. both by the
+    tracker of one evaluated item and by the tracker of the whole run.
+    """
+    tracker = UsageTracker()
+    token = _active_trackers.set(_active_trackers.get() + (tracker,))
+    try:
+        yield tracker
+    finally:
+        _active_trackers.reset(token)
+
+
+def record_call(record: CallRecord) -> None:
+    """Add a call record to every active tracker."""
+    for tracker in _active_trackers.get():
+        tracker.records.append(record)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Get the q-th percentile of values, interpolating between closest ranks."""
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def _aggregate(items: Iterable[tuple[str, StageUsage]]) -> dict[str, StageUsage]:
+    usage: dict[str, StageUsage] = {}
+    latencies: dict[str, list[float]] = {}
+    for name, item in items:
+        stage = usage.setdefault(name, StageUsage())
+        stage.calls += item.calls
+        stage.cache_hits += item.cache_hits
+        stage.prompt_tokens += item.prompt_tokens
+        stage.completion_tokens += item.completion_tokens
+        stage.cached_prompt_tokens += item.cached_prompt_tokens
+        stage.latency_s += item.latency_s
+        stage.cost_usd += item.cost_usd
+        latencies.setdefault(name, []).append(item.latency_s)
+    for name, values in latencies.items():
+        usage[name].latency_p50_s = percentile(values, 50)
+        usage[name].latency_p95_s = percentile(values, 95)
+    return usage
+
+
+def summarize_usage(results: list[EvaluationResult]) -> dict[str, StageUsage]:
+    """Aggregate the per-stage usage of evaluation results.
+
+    Latency percentiles are computed over the per-item latency of each stage.
+    """
+    return _aggregate(
+        (name, usage) for result in results for name, usage in result.usage.items()
+    )
@@ -1,82 +1,531 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
+from typing import Iterator
+import hashlib
 import json
+import os
+import re
+import tempfile
+import threading
 from cai.models import CritiqueRewriteExample
+from cai.principles import DEFAULT_PRINCIPLE
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows, locking stays in-process
+    fcntl = None
 
-def list_examples_versions():
-    """Get all versions of the examples."""
-    version_path = Path(__file__).parent / "examples"
-    return [f.stem.split("_")[1] for f in sorted(version_path.glob("*.jsonl"))]
+EXAMPLES_PATH = Path(__file__).parent / "examples"
 
+# Content-addressed store of an examples library, in a sub-directory of it:
+# - objects.jsonl: every example stored once, as {"hash", "example"} lines
+# - manifests/<version>.txt: the hashes of the examples of a version, one per line
+# - index.json: the versions of the store, with the signature and content hash of
+#   the legacy `ex_<version>.jsonl` file each one was imported from, if any
+# - legacy/<version>.txt: the hashes of the examples last imported from that file
+# - .lock: lock file serializing the writers of all processes
+# Manifests and the index are replaced atomically, and objects are appended before
+# any manifest references them, so readers never take the writers' locks.
+STORE_DIR = "store"
 
-def init_dev_version() -> None:
-    """Initialize the development version file if it doesn't exist."""
-    version_path = Path(__file__).parent / "examples"
-    version_path.mkdir(exist_ok=True)
+_VERSION_NUMBER = re.compile(r"v(\d+)")
 
-    dev_file = version_path / "ex_dev.jsonl"
-    if not dev_file.exists():
-        dev_file.touch()
+# Process-wide store of parsed examples, keyed by version file. Entries are
+# invalidated when the file signature (mtime, size, inode) changes, and explicitly
+# by the functions of this module that write example files.
+_examples_store: dict[Path, tuple[tuple[int, ...], list[CritiqueRewriteExample]]] = {}
+# Parsed objects files, indexes and legacy version listings, stored with the
+# signature of the file or directory they were read from.
+_objects: dict[Path, tuple[tuple[int, ...] | None, dict[str, dict]]] = {}
+_indexes: dict[Path, tuple[tuple[int, ...] | None, dict]] = {}
+_legacy_versions: dict[Path, tuple[tuple[int, int] | None, list[str]]] = {}
+# Guards the lookups and updates of the caches above, never held while reading
+# or writing files, so that readers don't wait for the writers.
+_store_lock = threading.Lock()
+# Serializes the transactions of the threads of this process, see `_transaction`
+_writer_lock = threading.RLock()
+# Depth of the transaction held by this process on each lock file. Only accessed
+# while holding `_writer_lock`.
+_transaction_depth: dict[Path, int] = {}
+_write_generation = 0
 
+# Per-user dev workspace of the current context, see `use_workspace`
+_workspace: ContextVar[str | None] = ContextVar("cai_workspace", default=None)
 
-def save_dev_version() -> str:
-    """Save current development version as a new version.
+
+@contextmanager
+def use_workspace(name: str | None) -> Iterator[None]:
+    """Use a private dev version, e.g. one per user of a shared deployment.
+
+    Inside the context, "dev" designates the dev version of the workspace,
+    initialized from the shared dev version on first use. Saved versions are
+    shared by all workspaces.
+
+    Args:
+        name: Name of the workspace, None for the shared dev version.
+    """
+    if name is not None and not re.fullmatch(r"[\w-]+", name):
+        raise ValueError(f"Invalid workspace name {name!r}")
+    token = _workspace.set(name)
+    try:
+        yield
+    finally:
+        _workspace.reset(token)
+
+
+def resolve_version(version: str | None) -> str:
+    """Get the stored name of a version: "dev" designates the dev version of the
+    current workspace, named `dev@<workspace>`.
+    """
+    if version in (None, "dev"):
+        workspace = _workspace.get()
+        return "dev" if workspace is None else f"dev@{workspace}"
+    return version
+
+
+@contextmanager
+def _transaction(principle: str | None) -> Iterator[None]:
+    """Serialize the writers of an examples store, across threads and processes.
+
+    Transactions are reentrant: nested transactions of the same thread share the
+    lock taken by the outermost one. Readers don't take these locks.
+    """
+    lock_path = _store_dir(principle) / ".lock"
+    with _writer_lock:
+        depth = _transaction_depth.get(lock_path, 0)
+        if depth or fcntl is None:
+            _transaction_depth[lock_path] = depth + 1
+            try:
+                yield
+            finally:
+                _transaction_depth[lock_path] = depth
+            return
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _transaction_depth[lock_path] = 1
+            try:
+                yield
+            finally:
+                _transaction_depth[lock_path] = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    """Replace a file at once, so that readers see either the old or new content."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _examples_dir(principle: str | None) -> Path:
+    """Get the examples library of a principle. The default principle's library is
+    `EXAMPLES_PATH` itself, the others are in sub-directories named after them.
+    """
+    if principle in (None, DEFAULT_PRINCIPLE):
+        return EXAMPLES_PATH
+    return EXAMPLES_PATH / principle
+
+
+def _store_dir(principle: str | None) -> Path:
+    return _examples_dir(principle) / STORE_DIR
+
+
+def _legacy_path(version: str | None, principle: str | None = None) -> Path:
+    file_name = "ex_dev.jsonl" if version in (None, "dev") else f"ex_{version}.jsonl"
+    return _examples_dir(principle) / file_name
+
+
+def _manifest_path(version: str, principle: str | None = None) -> Path:
+    return _store_dir(principle) / "manifests" / f"{version}.txt"
+
+
+def _file_signature(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cache_signature(path: Path) -> tuple[int, int, int] | None:
+    """Signature of a file, with its inode: files written by `_atomic_write` are
+    new files, so a rewrite by another process is detected even when it keeps the
+    size and lands within the mtime resolution.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _invalidate(path: Path) -> None:
+    global _write_generation
+    with _store_lock:
+        _examples_store.pop(path, None)
+        _write_generation += 1
+
+
+def example_hash(example: dict) -> str:
+    """Content address of an example: SHA-256 of its canonical JSON encoding."""
+    payload = json.dumps(example, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_objects(principle: str | None) -> dict[str, dict]:
+    path = _store_dir(principle) / "objects.jsonl"
+    signature = _cache_signature(path)
+    with _store_lock:
+        cached = _objects.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    objects = {}
+    if signature is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Blank, or being appended by another process
+                    continue
+                objects[record["hash"]] = record["example"]
+    with _store_lock:
+        _objects[path] = (signature, objects)
+    return objects
+
+
+def _put_objects(examples: list[dict], principle: str | None) -> list[str]:
+    """Store examples by content, appending only the new ones to the objects file.
 
     Returns:
-        Name of the new version
+        The hashes of the examples, in order.
     """
-    examples_path = Path(__file__).parent / "examples"
-    dev_path = examples_path / "ex_dev.jsonl"
+    path = _store_dir(principle) / "objects.jsonl"
+    with _transaction(principle):
+        objects = _load_objects(principle)
+        hashes = [example_hash(example) for example in examples]
+        new_lines = []
+        for h, example in zip(hashes, examples):
+            if h not in objects:
+                objects[h] = example
+                new_lines.append(json.dumps({"hash": h, "example": example}) + "\n")
+        if new_lines:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(new_lines)
+                f.flush()
+                os.fsync(f.fileno())
+            with _store_lock:
+                _objects[path] = (_cache_signature(path), objects)
+        return hashes
+
+
+def _load_index(principle: str | None) -> dict:
+    path = _store_dir(principle) / "index.json"
+    signature = _cache_signature(path)
+    with _store_lock:
+        cached = _indexes.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    index = {"versions": {}}
+    if signature is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    with _store_lock:
+        _indexes[path] = (signature, index)
+    return index
+
+
+def _set_index_version(
+    version: str, source: dict | None, principle: str | None
+) -> None:
+    """Add or update a version of the index, with the record of its legacy file."""
+    path = _store_dir(principle) / "index.json"
+    with _transaction(principle):
+        index = _load_index(principle)
+        index = {**index, "versions": {**index["versions"], version: source}}
+        _atomic_write(path, json.dumps(index, indent=2))
+        with _store_lock:
+            _indexes[path] = (_cache_signature(path), index)
+
+
+def _read_manifest(path: Path) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _write_manifest(path: Path, hashes: list[str]) -> None:
+    _atomic_write(path, "".join(h + "\n" for h in hashes))
+    _invalidate(path)
+
+
+def _imported_path(version: str, principle: str | None = None) -> Path:
+    return _store_dir(principle) / "legacy" / f"{version}.txt"
+
+
+def _source_signature(source: dict | list | None) -> tuple[int, int] | None:
+    # Stores written before content hashes were recorded hold the bare signature
+    if isinstance(source, dict):
+        return tuple(source["signature"])
+    return tuple(source) if source is not None else None
 
-    # Find next version number
-    existing_version_numbers = [
-        int(f.stem.split("_v")[1]) for f in examples_path.glob("ex_v*.jsonl")
+
+def _read_legacy(version: str, principle: str | None) -> tuple[dict, list[dict]]:
+    """Read a legacy version file.
+
+    Returns:
+        Tuple of (index record of the file, examples of the file).
+    """
+    path = _legacy_path(version, principle)
+    signature = _file_signature(path)
+    data = path.read_bytes()
+    examples = [
+        CritiqueRewriteExample(**json.loads(line)).model_dump()
+        for line in data.decode("utf-8").splitlines()
+        if line.strip()
     ]
-    next_version = max(existing_version_numbers, default=0) + 1
-    version_name = f"v{next_version}"
+    record = {"signature": signature, "sha256": hashlib.sha256(data).hexdigest()}
+    return record, examples
+
+
+def _sync_legacy(version: str, principle: str | None = None) -> None:
+    """Merge the changes of the legacy file of a stored version into its manifest.
+
+    Only the examples that were not in the file when it was last imported are
+    added, so that the adds, deletions and reloads made through the store are
+    kept. A file that was only touched or copied, with the same content, merely
+    has its signature updated.
+    """
+    with _transaction(principle):
+        source = _load_index(principle)["versions"].get(version)
+        signature = _file_signature(_legacy_path(version, principle))
+        if signature is None or signature == _source_signature(source):
+            return
+        record, examples = _read_legacy(version, principle)
+        if not isinstance(source, dict) or source["sha256"] != record["sha256"]:
+            hashes = _put_objects(examples, principle)
+            imported_path = _imported_path(version, principle)
+            seen = (
+                set(_read_manifest(imported_path)) if imported_path.exists() else set()
+            )
+            manifest = _manifest_path(version, principle)
+            current = _read_manifest(manifest)
+            seen.update(current)
+            new_hashes = []
+            for h in hashes:
+                if h not in seen:
+                    seen.add(h)
+                    new_hashes.append(h)
+            if new_hashes:
+                _write_manifest(manifest, [*current, *new_hashes])
+            _atomic_write(imported_path, "".join(h + "\n" for h in hashes))
+        _set_index_version(version, record, principle)
+
+
+def _version_source(version: str, principle: str | None = None) -> Path | None:
+    """Get the file holding a version: its manifest once it is in the store, or its
+    legacy `ex_<version>.jsonl` file until it is imported. Changes of the legacy
+    file of a stored version are merged into its manifest, see `_sync_legacy`.
+
+    Returns:
+        Path of the manifest or of the legacy file, None if the version does not
+        exist.
+    """
+    versions = _load_index(principle)["versions"]
+    if version in versions:
+        signature = _file_signature(_legacy_path(version, principle))
+        if signature is not None and signature != _source_signature(versions[version]):
+            _sync_legacy(version, principle)
+        return _manifest_path(version, principle)
+    legacy_path = _legacy_path(version, principle)
+    if legacy_path.exists():
+        return legacy_path
+    if version.startswith("dev@"):
+        # Workspaces see the shared dev version until their first write
+        return _version_source("dev", principle)
+    return None
+
+
+def _materialize(version: str, principle: str | None = None) -> Path:
+    """Make sure a version is in the store, importing its legacy file if needed. A
+    workspace dev version starts as a copy of the shared dev version.
+
+    Returns:
+        Path of the manifest of the version.
+    """
+    manifest = _manifest_path(version, principle)
+    with _transaction(principle):
+        source = _version_source(version, principle)
+        if source == manifest:
+            return manifest
+        record = None
+        if source == _legacy_path(version, principle):
+            record, examples = _read_legacy(version, principle)
+            hashes = _put_objects(examples, principle)
+            _atomic_write(
+                _imported_path(version, principle), "".join(h + "\n" for h in hashes)
+            )
+        elif version.startswith("dev@"):
+            hashes = _read_manifest(_materialize("dev", principle))
+        else:
+            hashes = []
+        _write_manifest(manifest, hashes)
+        _set_index_version(version, record, principle)
+        return manifest
+
+
+def get_examples_signature(
+    version: str | None = None, principle: str | None = None
+) -> tuple[int, ...] | None:
+    """Get the signature of a version, changing whenever the version changes.
+
+    Args:
+        version: Version to inspect. If None, inspects the development version.
+        principle: Principle whose examples library to use, None for the default.
+
+    Returns:
+        Tuple of (write generation, mtime in ns, size in bytes, inode), or None
+        if the version does not exist.
+    """
+    source = _version_source(resolve_version(version), principle)
+    signature = _cache_signature(source) if source is not None else None
+    if signature is None:
+        return None
+    return (_write_generation, *signature)
+
 
-    # Copy current dev version to new version
-    version_path = examples_path / f"ex_{version_name}.jsonl"
-    if dev_path.exists():
-        version_path.write_bytes(dev_path.read_bytes())
+def _version_sort_key(version: str) -> tuple:
+    match = _VERSION_NUMBER.fullmatch(version)
+    return (version != "dev", int(match[1]) if match else float("inf"), version)
+
+
+def list_examples_versions(principle: str | None = None):
+    """Get all versions of the examples of a principle, by default the default one.
+
+    Versions come from the index of the store, plus the legacy version files,
+    whose listing is only refreshed when the library directory changes. The dev
+    versions of the workspaces are not listed, "dev" stands for the current one.
+    """
+    examples_dir = _examples_dir(principle)
+    signature = _file_signature(examples_dir)
+    with _store_lock:
+        cached = _legacy_versions.get(examples_dir)
+    if cached is None or cached[0] != signature:
+        legacy = [f.stem.split("_", 1)[1] for f in examples_dir.glob("ex_*.jsonl")]
+        cached = (signature, legacy)
+        with _store_lock:
+            _legacy_versions[examples_dir] = cached
+    versions = set(_load_index(principle)["versions"]) | set(cached[1])
+    return sorted((v for v in versions if "@" not in v), key=_version_sort_key)
+
+
+def init_dev_version(principle: str | None = None) -> None:
+    """Initialize the development version if it doesn't exist."""
+    _materialize(resolve_version("dev"), principle)
+
+
+def save_dev_version(principle: str | None = None) -> str:
+    """Save current development version as a new version.
+
+    Only the manifest of the development version is copied, the examples are
+    shared. Version numbers are allocated inside a transaction, so concurrent
+    saves get distinct versions.
+
+    Args:
+        principle: Principle whose examples library to use, None for the default.
+
+    Returns:
+        Name of the new version
+    """
+    with _transaction(principle):
+        # Find next version number
+        existing_version_numbers = [
+            int(match[1])
+            for v in list_examples_versions(principle)
+            if (match := _VERSION_NUMBER.fullmatch(v))
+        ]
+        next_version = max(existing_version_numbers, default=0) + 1
+        version_name = f"v{next_version}"
+
+        # Copy the current dev manifest to the new version
+        hashes = _read_manifest(_materialize(resolve_version("dev"), principle))
+        _write_manifest(_manifest_path(version_name, principle), hashes)
+        _set_index_version(version_name, None, principle)
 
     return version_name
 
 
-def load_examples(version: str | None = None) -> list[CritiqueRewriteExample]:
+def load_examples(
+    version: str | None = None, principle: str | None = None
+) -> list[CritiqueRewriteExample]:
     """Load examples from one version.
 
+    Examples are parsed once per version and served from memory until the version
+    changes.
+
     Args:
         version: Optional version to load (without .jsonl extension).
                 If None, loads the development version.
+        principle: Principle whose examples library to use, None for the default.
 
     Returns:
         List of CritiqueRewriteExample objects
     """
-    examples_path = Path(__file__).parent / "examples"
-    file_name = "ex_dev.jsonl" if version is None else f"ex_{version}.jsonl"
-    version_path = examples_path / file_name
+    return _load_examples(resolve_version(version), principle)
+
 
-    if not version_path.exists():
+def _load_examples(
+    version: str, principle: str | None = None
+) -> list[CritiqueRewriteExample]:
+    version_path = _version_source(version, principle)
+    signature = _cache_signature(version_path) if version_path else None
+    if signature is None:
         return []
 
-    with open(version_path, "r", encoding="utf-8") as f:
-        examples = [CritiqueRewriteExample(**json.loads(line)) for line in f]
-    return examples
+    with _store_lock:
+        cached = _examples_store.get(version_path)
+    if cached is not None and cached[0] == signature:
+        return list(cached[1])
 
+    if version_path.suffix == ".txt":
+        objects = _load_objects(principle)
+        examples = [
+            CritiqueRewriteExample(**objects[h]) for h in _read_manifest(version_path)
+        ]
+    else:
+        with open(version_path, "r", encoding="utf-8") as f:
+            examples = [
+                CritiqueRewriteExample(**json.loads(line)) for line in f if line.strip()
+            ]
+    with _store_lock:
+        _examples_store[version_path] = (signature, examples)
+    return list(examples)
 
-def reload_dev_from_version(version: str) -> None:
+
+def reload_dev_from_version(version: str, principle: str | None = None) -> None:
     """Reloads the development version from a specific version.
 
     Args:
         version: Version to load from (e.g. 'v1')
+        principle: Principle whose examples library to use, None for the default.
     """
-    examples_path = Path(__file__).parent / "examples"
-    version_path = examples_path / f"ex_{version}.jsonl"
-    dev_path = examples_path / "ex_dev.jsonl"
-
-    if version_path.exists():
-        dev_path.write_bytes(version_path.read_bytes())
+    version = resolve_version(version)
+    with _transaction(principle):
+        if _version_source(version, principle) is None:
+            return
+        examples = [e.model_dump() for e in _load_examples(version, principle)]
+        hashes = _put_objects(examples, principle)
+        _write_manifest(_materialize(resolve_version("dev"), principle), hashes)
 
 
 def add_to_dev_examples(
@@ -84,14 +533,19 @@ def add_to_dev_examples(
     assistant_answer: str,
     critique: str,
     rewrite: str,
+    principle: str | None = None,
 ) -> None:
-    """Add a new example to the dev version file.
+    """Add a new example to the dev version.
+
+    The example is stored once in the objects file and its hash added to the dev
+    manifest, in one transaction.
 
     Args:
         human_prompt: The human prompt text
         assistant_answer: The model's answer
         critique: The critique of the answer
         rewrite: The rewritten answer
+        principle: Principle whose examples library to use, None for the default.
     """
     example = {
         "human_prompt": human_prompt,
@@ -100,30 +554,30 @@ def add_to_dev_examples(
         "rewrite": rewrite,
     }
 
-    dev_path = Path(__file__).parent / "examples" / "ex_dev.jsonl"
-    with open(dev_path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(example) + "\n")
+    with _transaction(principle):
+        manifest = _materialize(resolve_version("dev"), principle)
+        (h,) = _put_objects([example], principle)
+        _write_manifest(manifest, [*_read_manifest(manifest), h])
 
 
-def delete_example(index: int, version: str) -> None:
-    """Delete an example from the development version.
+def delete_example(index: int, version: str, principle: str | None = None) -> None:
+    """Delete an example from a version.
+
+    Only the manifest of the version is rewritten; the example stays in the store,
+    where other versions may still use it.
 
     Args:
         index: Zero-based index of the example to delete
+        principle: Principle whose examples library to use, None for the default.
     """
-    version_path = Path(__file__).parent / "examples" / f"ex_{version}.jsonl"
-    if not version_path.exists():
-        return
-
-    # Read all examples
-    with open(version_path, "r", encoding="utf-8") as f:
-        examples = [json.loads(line) for line in f if line.strip()]
-
-    # Remove the specified example
-    if 0 <= index < len(examples):
-        examples.pop(index)
+    version = resolve_version(version)
+    with _transaction(principle):
+        if _version_source(version, principle) is None:
+            return
+        manifest = _materialize(version, principle)
+        hashes = _read_manifest(manifest)
 
-        # Write back the remaining examples
-        with open(version_path, "w", encoding="utf-8") as f:
-            for example in examples:
-                f.write(json.dumps(example) + "\n")
+        # Remove the specified example
+        if 0 <= index < len(hashes):
+            hashes.pop(index)
+            _write_manifest(manifest, hashes)
@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+
+import pytest
+
+# Tests never reach the network: use the deterministic in-process backend.
+os.environ.setdefault("CAI_LLM_BACKEND", "fake")
+# Keep the on-disk LLM cache out of the working tree during tests.
+os.environ.setdefault("CAI_CACHE_MODE", "off")
+
+import cai.versioning  # noqa: E402
+from cai.backends import FakeBackend, get_backend, set_backend  # noqa: E402
+from cai.models import ConversationInput  # noqa: E402
+
+
+@pytest.fixture
+def examples_path(tmp_path: Path, monkeypatch) -> Path:
+    """Point the examples library, and its store, to an empty temporary one."""
+    monkeypatch.setattr(cai.versioning, "EXAMPLES_PATH", tmp_path)
+    (tmp_path / "ex_dev.jsonl").touch()
+    return tmp_path
+
+
+@pytest.fixture
+def make_backend():
+    """Build the backend of the `backend` fixture, overridden by the test modules
+    that need scripted or delayed responses.
+    """
+    return FakeBackend
+
+
+@pytest.fixture
+def backend(make_backend):
+    previous = get_backend()
+    backend = make_backend()
+    set_backend(backend)
+    yield backend
+    set_backend(previous)
+
+
+@pytest.fixture
+def make_eval_data():
+    """Build `n` distinct conversations to evaluate."""
+
+    def make(n: int) -> list[ConversationInput]:
+        return [
+            ConversationInput(
+                human_prompt=f"prompt {i}", assistant_answer=f"answer {i}"
+            )
+            for i in range(n)
+        ]
+
+    return make
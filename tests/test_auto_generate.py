@@ -0,0 +1,179 @@
+import json
+import re
+
+import cai.auto_generate
+from cai.auto_generate import (
+    analyze_failures,
+    chunk_failures,
+    generate_improvement_examples,
+    get_auto_generate_system_prompt,
+)
+from cai.datasets import open_dataset
+from cai.models import EvaluationResult
+
+
+def respond(model, messages):
+    prompt = messages[-1]["content"]
+    match = re.search(r"Generate (\d+) different prompts(?: \(set (\d+))?", prompt)
+    if match:
+        n_prompts, batch = int(match[1]), match[2] or "1"
+        prompts = [
+            {"explanation": "", "human_prompt": f"prompt {batch}.{i}"}
+            for i in range(n_prompts)
+        ]
+        return json.dumps({"prompts": prompts})
+    if prompt.startswith("You are analyzing failures"):
+        return "Analysis."
+    if prompt.rstrip().endswith("Rewrite:"):
+        return "Rewrite."
+    if prompt.rstrip().endswith("Critique:"):
+        return "Critique."
+    return f"Answer to {prompt}."
+
+
+FAILURE = EvaluationResult(
+    human_prompt="failed prompt",
+    assistant_answer="answer",
+    critique="critique",
+    rewrite="Nope.",
+    follows_principle=False,
+    first_letters="N",
+)
+
+
+def test_generate_improvement_examples(backend, monkeypatch):
+    backend.responder = respond
+    system_prompts = []
+    get_system_prompt = cai.auto_generate.get_auto_generate_system_prompt
+    monkeypatch.setattr(
+        cai.auto_generate,
+        "get_auto_generate_system_prompt",
+        lambda *args: system_prompts.append(args) or get_system_prompt(*args),
+    )
+    selections = []
+    select = cai.auto_generate.select_representative_failures
+    monkeypatch.setattr(
+        cai.auto_generate,
+        "select_representative_failures",
+        lambda *args: selections.append(args) or select(*args),
+    )
+
+    examples = generate_improvement_examples(
+        [FAILURE], n_prompts=25, concurrency=8, dedup_threshold=None
+    )
+
+    assert [e.human_prompt for e in examples] == [
+        f"prompt {batch}.{i}"
+        for batch, n in [(1, 10), (2, 10), (3, 5)]
+        for i in range(n)
+    ]
+    assert examples[0].assistant_answer == "Answer to prompt 1.0."
+    assert examples[0].rewrite == "Rewrite."
+    # The analysis and the system prompt are shared by all branches
+    assert system_prompts == [([FAILURE], "Analysis.", [FAILURE])]
+    # The failures shown to the generation calls are selected once
+    assert len(selections) == 1
+    stages = [r["messages"][-1]["content"][:30] for r in backend.requests]
+    assert sum(s.startswith("You are analyzing") for s in stages) == 1
+    assert sum(s.startswith("You are helping generate") for s in stages) == 3
+    assert len(backend.requests) == 1 + 3 + 3 * 25
+
+
+def test_generate_improvement_examples_tolerates_fewer_prompts(backend):
+    def respond_two(model, messages):
+        if "different prompts" in messages[-1]["content"]:
+            prompts = [{"explanation": "", "human_prompt": f"p{i}"} for i in range(2)]
+            return json.dumps({"prompts": prompts})
+        return "Text."
+
+    backend.responder = respond_two
+
+    examples = generate_improvement_examples(
+        [FAILURE], "Analysis.", n_prompts=5, dedup_threshold=None
+    )
+
+    assert [e.human_prompt for e in examples] == ["p0", "p1"]
+
+
+def test_generate_improvement_examples_drops_near_duplicates(backend):
+    test_prompt = open_dataset("test")[0].human_prompt
+    prompts = [
+        "Describe the water cycle for a ten year old.",
+        test_prompt.upper(),
+        "Describe the water cycle for a ten-year-old!",
+        "Which board games are fun for a family evening?",
+    ]
+
+    def respond_prompts(model, messages):
+        if "different prompts" in messages[-1]["content"]:
+            rows = [{"explanation": "", "human_prompt": p} for p in prompts]
+            return json.dumps({"prompts": rows})
+        return "Text."
+
+    backend.responder = respond_prompts
+
+    examples = generate_improvement_examples([FAILURE], "Analysis.", n_prompts=4)
+
+    assert [e.human_prompt for e in examples] == [prompts[0], prompts[3]]
+    # No call was spent on the dropped prompts
+    assert len(backend.requests) == 1 + 3 * 2
+
+
+TOPICS = ["poem about the sea", "recipe for pancakes", "history of Rome"]
+
+
+def make_failures(n: int) -> list[EvaluationResult]:
+    return [
+        FAILURE.model_copy(
+            update={
+                "human_prompt": f"Write a {TOPICS[i % 3]} number {i}",
+                "assistant_answer": "A long answer. " * 20,
+            }
+        )
+        for i in range(n)
+    ]
+
+
+def test_analyze_failures_map_reduce(backend):
+    def respond_analysis(model, messages):
+        prompt = messages[-1]["content"]
+        if "Here are the" in prompt and "analyses" in prompt:
+            return f"Merged {prompt.count('Analysis ')}."
+        return f"Analysis of {prompt.count('Failure ')}."
+
+    backend.responder = respond_analysis
+    failures = make_failures(30)
+    passing = FAILURE.model_copy(update={"follows_principle": True})
+
+    chunks = chunk_failures(failures, token_budget=1000)
+    analysis = analyze_failures([passing, *failures], token_budget=1000)
+
+    assert len(chunks) > 2
+    assert sorted(f.human_prompt for c in chunks for f in c) == sorted(
+        f.human_prompt for f in failures
+    )
+    map_prompts = [
+        r["messages"][-1]["content"] for r in backend.requests[: len(chunks)]
+    ]
+    assert sum(p.count("Failure ") for p in map_prompts) == 30
+    assert analysis.startswith("Merged")
+
+
+def test_analyze_failures_single_call_when_small(backend):
+    backend.responder = lambda model, messages: "Analysis."
+
+    assert analyze_failures(make_failures(3)) == "Analysis."
+    assert len(backend.requests) == 1
+
+
+def test_generation_system_prompt_has_bounded_failures():
+    failures = make_failures(60)
+
+    system_prompt = get_auto_generate_system_prompt(failures, "Analysis.")
+
+    shown = [f for f in failures if f"Human: {f.human_prompt}\n" in system_prompt]
+    assert 0 < len(shown) <= cai.auto_generate.MAX_PROMPT_FAILURES
+    # The representatives cover the different kinds of failures
+    assert {f.human_prompt.split(" number")[0] for f in shown} == {
+        f"Write a {topic}" for topic in TOPICS
+    }
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from cai.backends import FakeBackend
+from cai.batch import BatchError, LocalBatchClient, parse_batch_output, run_batch
+from cai.runner import run_batch_evaluation
+
+ADAPTIVE_REWRITE = "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent."
+
+
+def respond(model: str, messages: list[dict]) -> str:
+    prompt = messages[-1]["content"]
+    if prompt.rstrip().endswith("Rewrite:"):
+        return ADAPTIVE_REWRITE if "answer 1" in prompt else "Nope."
+    return "Critique of " + prompt.split("Assistant: ")[1].split("\n")[0]
+
+
+@pytest.fixture
+def make_backend():
+    return lambda: FakeBackend(respond)
+
+
+def test_parse_batch_output_skips_failed_requests():
+    lines = [
+        json.dumps(
+            {
+                "custom_id": "ok",
+                "response": {
+                    "status_code": 200,
+                    "body": {"choices": [{"message": {"content": "Hello"}}]},
+                },
+                "error": None,
+            }
+        ),
+        json.dumps(
+            {
+                "custom_id": "failed",
+                "response": {"status_code": 500, "body": {}},
+                "error": None,
+            }
+        ),
+        "",
+    ]
+    completions = parse_batch_output(lines)
+    assert list(completions) == ["ok"]
+    assert completions["ok"].text == "Hello"
+
+
+def test_run_batch_raises_on_failed_batch():
+    class FailingBatchClient(LocalBatchClient):
+        def status(self, batch_id):
+            return "expired"
+
+    with pytest.raises(BatchError):
+        run_batch(FailingBatchClient(FakeBackend()), [{"custom_id": "a"}])
+
+
+def test_run_batch_evaluation(backend: FakeBackend, make_eval_data):
+    client = LocalBatchClient()
+    statuses = []
+
+    report = run_batch_evaluation(
+        make_eval_data(3),
+        version="v0",
+        batch_client=client,
+        on_status=lambda batch_id, status: statuses.append(status),
+    )
+
+    assert len(client.batches) == 2
+    assert all(len(requests) == 3 for requests in client.batches.values())
+    assert statuses == ["completed", "completed"]
+    assert report.version == "v0"
+    assert report.accuracy == pytest.approx(1 / 3)
+    assert [r.critique for r in report.results] == [
+        f"Critique of answer {i}" for i in range(3)
+    ]
+    assert [r.follows_principle for r in report.results] == [False, True, False]
+
+
+def test_run_batch_evaluation_retries_failed_requests(
+    backend: FakeBackend, make_eval_data
+):
+    class LossyBatchClient(LocalBatchClient):
+        def results(self, batch_id):
+            results = super().results(batch_id)
+            results.pop("critique-0", None)
+            return results
+
+    report = run_batch_evaluation(
+        make_eval_data(2), version="v0", batch_client=LossyBatchClient()
+    )
+    assert report.results[0].critique == "Critique of answer 0"
+
+
+def test_run_batch_evaluation_skips_compliant_answers(
+    backend: FakeBackend, make_eval_data
+):
+    client = LocalBatchClient()
+    eval_data = make_eval_data(3)
+    eval_data[0].assistant_answer = ADAPTIVE_REWRITE
+
+    report = run_batch_evaluation(
+        eval_data, version="v0", batch_client=client, skip_compliant=True
+    )
+
+    assert all(len(requests) == 2 for requests in client.batches.values())
+    assert [r.llm_skipped for r in report.results] == [True, False, False]
+    assert [r.follows_principle for r in report.results] == [True, True, False]
+    assert report.results[2].critique == "Critique of answer 2"
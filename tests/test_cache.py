@@ -0,0 +1,75 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from cai.cache import CacheMissError, ResponseCache, make_cache_key
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_cache_key_depends_on_request():
+    key = make_cache_key("gpt-4o", MESSAGES, temperature=0.0, seed=1)
+    assert key == make_cache_key("gpt-4o", MESSAGES, seed=1, temperature=0.0)
+    assert key != make_cache_key("gpt-4o-mini", MESSAGES, temperature=0.0, seed=1)
+    assert key != make_cache_key("gpt-4o", MESSAGES, temperature=1.0, seed=1)
+    assert key != make_cache_key(
+        "gpt-4o", [{"role": "user", "content": "Hi"}], temperature=0.0, seed=1
+    )
+
+
+def test_cache_hits_and_misses(tmp_path: Path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    assert cache.get("key") is None
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.writes) == (1, 1, 1)
+
+    # The cache persists across instances
+    assert ResponseCache(tmp_path / "cache.sqlite").get("key") == "value"
+
+
+def test_cache_replay_mode(tmp_path: Path):
+    ResponseCache(tmp_path / "cache.sqlite").put("key", "value")
+    cache = ResponseCache(tmp_path / "cache.sqlite", mode="replay")
+    assert cache.get("key") == "value"
+    with pytest.raises(CacheMissError):
+        cache.get("other")
+    # Replay mode never writes
+    cache.put("other", "value")
+    assert len(cache) == 1
+
+
+def test_cache_off_mode(tmp_path: Path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", mode="off")
+    cache.put("key", "value")
+    assert cache.get("key") is None
+    assert not (tmp_path / "cache.sqlite").exists()
+
+
+def test_cache_evicts_least_recently_used(tmp_path: Path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    time.sleep(0.01)
+    cache.get("a")
+    cache.put("c", "3")
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+
+
+def test_cache_evicts_by_size(tmp_path: Path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=10)
+    cache.put("a", "x" * 6)
+    cache.put("b", "y" * 6)
+    assert len(cache) == 1
+    assert cache.get("b") == "y" * 6
+
+
+def test_cache_evicts_by_age(tmp_path: Path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_age_seconds=0.01)
+    cache.put("a", "1")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats.evictions == 1
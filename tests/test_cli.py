@@ -0,0 +1,37 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from cai.cli import main
+
+
+@pytest.fixture
+def workdir(tmp_path: Path, monkeypatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_eval_writes_report(workdir: Path, capsys):
+    assert main(["eval", "--version", "v0", "--concurrency", "4"]) == 0
+
+    (report_path,) = (workdir / "evals").glob("eval_report_v0_*.json")
+    report = json.loads(report_path.read_text())
+    assert len(report["results"]) == 20
+    captured = capsys.readouterr()
+    assert "[20/20]" in captured.err
+    assert str(report_path.relative_to(workdir)) in captured.out
+
+
+def test_eval_fails_below_threshold(workdir: Path):
+    assert main(["eval", "--version", "v0", "--threshold", "1.0", "--quiet"]) == 1
+
+
+def test_eval_reads_dataset_path(workdir: Path):
+    dataset = workdir / "dump.jsonl"
+    dataset.write_text(json.dumps({"user": "hi", "bot": "hello"}) + "\n")
+
+    assert main(["eval", "--version", "v0", "--set", str(dataset), "--quiet"]) == 0
+
+    (report_path,) = (workdir / "evals").glob("eval_report_v0_*.json")
+    assert len(json.loads(report_path.read_text())["results"]) == 1
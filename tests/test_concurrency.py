@@ -0,0 +1,76 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from cai.concurrency import aiter_window, iter_sync
+
+
+def test_aiter_window_limits_jobs_in_flight():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def job(index: int) -> int:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.001 * (index % 3))
+        in_flight -= 1
+        return index * 2
+
+    async def run() -> dict[int, int]:
+        jobs = (lambda index=index: job(index) for index in range(10))
+        return {index: result async for index, result in aiter_window(jobs, 3)}
+
+    assert asyncio.run(run()) == {index: index * 2 for index in range(10)}
+    assert max_in_flight == 3
+
+
+def test_aiter_window_invalid_concurrency():
+    async def run():
+        async for _ in aiter_window([], 0):
+            pass
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_closing_the_window_cancels_jobs_in_flight():
+    started, cancelled = [], []
+
+    async def job(index: int) -> int:
+        started.append(index)
+        try:
+            await asyncio.sleep(0 if index == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        return index
+
+    async def first() -> int:
+        jobs = (lambda index=index: job(index) for index in range(10))
+        async with aclosing(aiter_window(jobs, 4)) as window:
+            async for index, _ in window:
+                return index
+
+    assert asyncio.run(first()) == 0
+    # The job queued when the first one completed is cancelled before it starts
+    assert sorted(cancelled) == started[1:] == [1, 2, 3]
+
+
+def test_iter_sync_closes_the_async_iterator():
+    closed = []
+
+    async def numbers():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(True)
+
+    results = iter_sync(numbers())
+    assert next(results) == 0
+    results.close()
+
+    assert closed == [True]
+    assert list(iter_sync(numbers())) == list(range(10))
@@ -0,0 +1,213 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from cai.backends import AsyncCompletionStream, FakeBackend
+from cai.critique_rewrite import (
+    ALREADY_COMPLIANT_CRITIQUE,
+    arun_best_of_n_rewrite,
+    arun_monitored_rewrite,
+    filter_needs_rewrite,
+    pretty_print_example,
+    run_critique_rewrite_pipeline,
+    select_examples,
+)
+from cai.models import ConversationInput
+from cai.runner import run_evaluation
+from cai.usage import track_usage
+from cai.versioning import add_to_dev_examples
+
+ADAPTIVE_REWRITE = "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent."
+
+
+class SlowFakeBackend(FakeBackend):
+    """Fake backend where the candidate with seed i arrives after i ticks, and the
+    chunks of a stream after `chunk_delay` seconds each.
+    """
+
+    chunk_delay = 0.0
+
+    async def acomplete(self, model, messages, **params):
+        await asyncio.sleep(0.02 * params.get("seed", 0))
+        return self.complete(model, messages, **params)
+
+    async def astream(self, model, messages, **params):
+        await asyncio.sleep(0.02 * params.get("seed", 0))
+        chunks = self._deltas(model, messages, params)
+
+        async def deltas():
+            for chunk in chunks:
+                await asyncio.sleep(self.chunk_delay)
+                yield chunk
+
+        return AsyncCompletionStream(deltas())
+
+
+@pytest.fixture
+def make_backend():
+    return SlowFakeBackend
+
+
+def passing_seeds(backend, seeds, failing="Apples. Dogs. Nope."):
+    def respond(model, messages):
+        if not messages[-1]["content"].rstrip().endswith("Rewrite:"):
+            return "Critique."
+        return (
+            ADAPTIVE_REWRITE
+            if backend.requests[-1].get("seed", 0) in seeds
+            else failing
+        )
+
+    backend.responder = respond
+
+
+def test_best_of_n_returns_first_passing_candidate(backend):
+    passing_seeds(backend, {2, 4})
+
+    with track_usage() as tracker:
+        rewrite = asyncio.run(
+            arun_best_of_n_rewrite("prompt", "answer", "critique", "v0", n=6)
+        )
+
+    assert rewrite == ADAPTIVE_REWRITE
+    # Slower candidates were cancelled before reaching the backend
+    assert [r.get("seed", 0) for r in backend.requests] == [0, 1, 2]
+    assert tracker.by_stage()["rewrite"].calls == 3
+
+
+def test_best_of_n_stops_at_token_budget(backend):
+    passing_seeds(backend, {3})
+
+    with track_usage() as tracker:
+        rewrite = asyncio.run(
+            arun_best_of_n_rewrite(
+                "prompt", "answer", "critique", "v0", n=4, token_budget=5
+            )
+        )
+
+    # Each failing candidate uses 3 completion tokens, so the second one spends the
+    # budget before the passing one starts
+    assert rewrite == "Apples. Dogs. Nope."
+    assert tracker.by_stage()["rewrite"].calls == 2
+
+
+def test_best_of_n_records_cancelled_candidates(backend):
+    long_failing = "Apples. Zebras are " + "very " * 50 + "nice."
+    passing_seeds(backend, {2}, failing=long_failing)
+    backend.chunk_delay = 0.005
+
+    with track_usage() as tracker:
+        rewrite = asyncio.run(
+            arun_best_of_n_rewrite("prompt", "answer", "critique", "v0", n=3)
+        )
+
+    assert rewrite == ADAPTIVE_REWRITE
+    usage = tracker.by_stage()["rewrite"]
+    # The streams cancelled once the passing candidate completed are billed too
+    assert usage.calls == 3
+    assert 8 < usage.completion_tokens < 8 + 2 * len(long_failing.split())
+
+
+def test_best_of_n_falls_back_to_closest_candidate(backend):
+    def respond(model, messages):
+        seed = backend.requests[-1].get("seed", 0)
+        return ["Nope.", "Apples. Dogs. Awesome.", "Apples."][seed]
+
+    backend.responder = respond
+
+    rewrite = asyncio.run(
+        arun_best_of_n_rewrite("prompt", "answer", "critique", "v0", n=3)
+    )
+
+    assert rewrite == "Apples. Dogs. Awesome."
+
+
+def test_run_evaluation_records_rewrite_candidates(backend):
+    passing_seeds(backend, {1})
+    eval_data = [ConversationInput(human_prompt="prompt", assistant_answer="answer")]
+
+    (result,) = run_evaluation(eval_data, version="v0", best_of_n=4)
+
+    assert result.follows_principle
+    assert result.rewrite_candidates == 2
+    assert result.usage["rewrite"].calls == 2
+
+
+def test_filter_needs_rewrite():
+    conversations = [
+        ConversationInput(human_prompt="a", assistant_answer=ADAPTIVE_REWRITE),
+        ConversationInput(human_prompt="b", assistant_answer="Not yet."),
+    ]
+
+    assert [c.human_prompt for c in filter_needs_rewrite(conversations)] == ["b"]
+
+
+def test_pipeline_skips_compliant_answer(backend):
+    critique, rewrite = run_critique_rewrite_pipeline(
+        "prompt", ADAPTIVE_REWRITE, "v0", skip_compliant=True
+    )
+
+    assert (critique, rewrite) == (ALREADY_COMPLIANT_CRITIQUE, ADAPTIVE_REWRITE)
+    assert backend.requests == []
+
+    run_critique_rewrite_pipeline("prompt", ADAPTIVE_REWRITE, "v0")
+
+    assert len(backend.requests) == 2
+
+
+def test_monitored_rewrite_restarts_diverging_streams(backend):
+    passing_seeds(backend, {2}, failing="Apples. Zebras are " + "very " * 50 + "nice.")
+
+    with track_usage() as tracker:
+        rewrite = asyncio.run(
+            arun_monitored_rewrite("prompt", "answer", "critique", "v0")
+        )
+
+    assert rewrite == ADAPTIVE_REWRITE
+    assert [r.get("seed", 0) for r in backend.requests] == [0, 1, 2]
+    usage = tracker.by_stage()["rewrite"]
+    assert usage.calls == 3
+    # Cancelled attempts only count the few tokens streamed before diverging
+    assert usage.completion_tokens < 20
+
+
+def test_monitored_rewrite_completes_last_attempt(backend):
+    passing_seeds(backend, set(), failing="Apples. Zebras. Nope.")
+
+    rewrite = asyncio.run(
+        arun_monitored_rewrite("prompt", "answer", "critique", "v0", max_attempts=2)
+    )
+
+    assert rewrite == "Apples. Zebras. Nope."
+
+
+@pytest.fixture
+def library(examples_path: Path) -> None:
+    topics = ["nuclear fusion", "the water cycle", "chess openings", "sourdough"]
+    for i in range(200):
+        topic = topics[i % len(topics)]
+        add_to_dev_examples(
+            f"Explain {topic}, take {i}", f"Answer about {topic}", "Critique", "Rewrite"
+        )
+
+
+def test_select_examples_picks_relevant_ones(library):
+    examples = select_examples("Explain the water cycle to me", "It rains.", "dev", k=3)
+
+    assert len(examples) == 3
+    assert all("water cycle" in e.human_prompt for e in examples)
+    # The token budget caps the examples, at about 4 characters per token
+    selected = select_examples("Explain chess openings", "", "dev", 50, 1000)
+    assert 0 < len(selected) < 50
+    assert sum(len(pretty_print_example(e)) for e in selected) // 4 <= 1000
+
+
+def test_pipeline_prompt_size_is_bounded(library, backend):
+    run_critique_rewrite_pipeline(
+        "Explain sourdough", "Bread.", "dev", few_shot_k=4, few_shot_tokens=1000
+    )
+
+    system_prompt = backend.requests[-1]["messages"][0]["content"]
+    assert system_prompt.count("Human: ") == 4
+    assert "sourdough" in system_prompt and "chess" not in system_prompt
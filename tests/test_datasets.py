@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import cai.datasets
+from cai.datasets import open_dataset
+
+
+@pytest.fixture
+def dataset_path(tmp_path: Path) -> Path:
+    path = tmp_path / "dump.jsonl"
+    rows = [
+        json.dumps({"user": f"prompt {i}", "bot": f"answer {i}"}) for i in range(10)
+    ]
+    # Blank lines are skipped and the last row has no trailing newline
+    path.write_text("\n".join(rows[:5]) + "\n\n" + "\n".join(rows[5:]))
+    return path
+
+
+def prompts(dataset) -> list[str]:
+    return [c.human_prompt for c in dataset]
+
+
+def test_random_access_and_iteration(dataset_path: Path):
+    dataset = open_dataset(dataset_path)
+
+    assert len(dataset) == 10
+    assert dataset[7].human_prompt == "prompt 7"
+    assert dataset[-1].assistant_answer == "answer 9"
+    assert prompts(dataset) == [f"prompt {i}" for i in range(10)]
+
+
+def test_slice_shard_and_sample(dataset_path: Path):
+    dataset = open_dataset(dataset_path)
+
+    assert prompts(dataset[2:5]) == ["prompt 2", "prompt 3", "prompt 4"]
+    assert prompts(dataset.shard(1, 3)) == ["prompt 1", "prompt 4", "prompt 7"]
+    sample = dataset.sample(4, seed=0)
+    assert len(set(prompts(sample))) == 4
+    assert prompts(sample) == prompts(dataset.sample(4, seed=0))
+    with pytest.raises(ValueError):
+        dataset.shard(3, 3)
+
+
+def test_index_is_reused_until_the_file_changes(dataset_path: Path, monkeypatch):
+    assert len(open_dataset(dataset_path)) == 10
+
+    def fail(path):
+        raise AssertionError("the index should not be rebuilt")
+
+    with monkeypatch.context() as m:
+        m.setattr(cai.datasets, "_build_index", fail)
+        assert len(open_dataset(dataset_path)) == 10
+
+    with dataset_path.open("a") as f:
+        f.write('\n{"human_prompt": "prompt 10", "assistant_answer": "answer 10"}\n')
+    dataset = open_dataset(dataset_path)
+    assert len(dataset) == 11
+    assert dataset[10].human_prompt == "prompt 10"
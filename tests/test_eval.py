@@ -1,4 +1,10 @@
-from cai.eval import load_eval_data, normalize_text, assert_principle
+from cai.eval import (
+    AcrosticMonitor,
+    assert_principle,
+    assert_principle_batch,
+    load_eval_data,
+    normalize_text,
+)
 import pytest
 from pathlib import Path
 from cai.models import ConversationInput
@@ -93,3 +99,71 @@ def test_load_eval_data_invalid_json(tmp_path: Path):
 
     with pytest.raises(Exception):
         load_eval_data(test_data)
+
+
+def test_normalize_text_applies_patterns_in_order():
+    """Markup uncovered by a pattern is stripped by the following ones."""
+    text = "**1. Apples** and *dogs*\n- • Awesome\n[#](u) Pets"
+    assert normalize_text(text) == "Apples and dogs. • Awesome. Pets."
+    assert assert_principle(text) == (False, "A•P")
+
+    text = "Don't 'quote\nacross' lines. \"Time\""
+    assert normalize_text(text) == "Dont quote. across' lines. Time."
+    assert assert_principle(text) == (False, "DAT")
+
+    text = "Apples\r\nDogs!\n\n\n   \nAwesome"
+    assert normalize_text(text) == "Apples. Dogs! Awesome."
+    assert assert_principle(text) == (False, "ADA")
+
+
+def test_assert_principle_skips_blank_blocks():
+    assert assert_principle("Apples. . Dogs.\n.\nAwesome") == (False, "ADA")
+    assert assert_principle("") == (False, "")
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_assert_principle_batch(processes):
+    texts = [
+        "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent.",
+        "The answer is ADAPTIVE.",
+    ] * 5
+
+    results = assert_principle_batch(
+        (text for text in texts), processes=processes, chunksize=3
+    )
+
+    assert list(results) == [assert_principle(text) for text in texts]
+
+
+def test_acrostic_monitor_reports_divergence_early():
+    monitor = AcrosticMonitor()
+    deltas = ["Apples are", " good. Dogs", " bark. **Awesome**", " day. Zebra", " now."]
+
+    assert [monitor.feed(delta) for delta in deltas] == [True, True, True, False, False]
+    assert monitor.letters == "ADAZ"
+    assert monitor.result() == (False, "ADAZ")
+
+
+def test_acrostic_monitor_waits_for_undecided_blocks():
+    monitor = AcrosticMonitor()
+    # List markers and links may still hide part of the text
+    for delta in ["1", ". Apples.\n2", ". Dogs. [Zebra. ", "Zoo](a.b) Awesome."]:
+        assert monitor.feed(delta)
+    assert monitor.letters == "AD"
+    assert monitor.result() == (False, "ADZZ")
+
+
+def test_acrostic_monitor_never_rejects_compliant_text():
+    text = "**Apples**. 'Dogs'. Awesome.\n\n- Pets\n# Time\nIce. *Very*. `Excellent`."
+    monitor = AcrosticMonitor()
+    for i in range(0, len(text), 3):
+        assert monitor.feed(text[i : i + 3])
+    assert monitor.letters == "ADAPTIVE"
+    assert monitor.result() == (True, "ADAPTIVE")
+
+
+def test_acrostic_monitor_checks_its_seed():
+    monitor = AcrosticMonitor(seed="CAT")
+    for delta in ["Cats purr. ", "Apples fall. ", "Time flies."]:
+        assert monitor.feed(delta)
+    assert monitor.result() == (True, "CAT")
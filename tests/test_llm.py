@@ -0,0 +1,128 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+from pydantic import BaseModel
+
+from cai.backends import FakeBackend
+from cai.cache import ResponseCache, get_cache, set_cache
+from cai.critique_rewrite import run_critique_rewrite_pipeline
+from cai.usage import track_usage
+from cai.llm import (
+    TEACHER_MODEL,
+    arun_model,
+    astream_model,
+    get_model,
+    run_model,
+    run_structured,
+    set_stage_model,
+    stream_model,
+)
+
+
+class Prompts(BaseModel):
+    prompts: list[str]
+
+
+def test_importing_cai_does_not_import_openai():
+    code = "import sys, cai.critique_rewrite, cai.auto_generate; print('openai' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "False"
+
+
+def test_fake_backend_is_deterministic(backend: FakeBackend):
+    response = run_model("Hello", system_prompt="Be nice")
+    assert response == run_model("Hello", system_prompt="Be nice")
+    assert response != run_model("Hello")
+    assert asyncio.run(arun_model("Hello", system_prompt="Be nice")) == response
+    assert backend.requests[0]["messages"][0] == {
+        "role": "system",
+        "content": "Be nice",
+    }
+
+
+def test_fake_backend_structured(backend: FakeBackend):
+    response = run_structured("Generate prompts", Prompts)
+    assert isinstance(response, Prompts)
+    assert len(response.prompts) == 3
+
+    backend.responder = lambda model, messages: '{"prompts": ["a"]}'
+    assert run_structured("Generate prompts", Prompts).prompts == ["a"]
+
+
+def test_stage_models(backend: FakeBackend, monkeypatch):
+    monkeypatch.delenv("CAI_MODEL", raising=False)
+    assert get_model("critique") == TEACHER_MODEL
+
+    monkeypatch.setenv("CAI_MODEL_CRITIQUE", "small-model")
+    assert get_model("critique") == "small-model"
+    assert get_model("rewrite") == TEACHER_MODEL
+
+    set_stage_model("rewrite", "other-model")
+    try:
+        run_critique_rewrite_pipeline("Hello", "Hi there!", version="v0")
+        assert [r["model"] for r in backend.requests] == ["small-model", "other-model"]
+    finally:
+        set_stage_model("rewrite", None)
+
+    with pytest.raises(ValueError):
+        get_model("unknown")
+
+
+def test_stream_model(backend: FakeBackend):
+    backend.responder = lambda model, messages: "Hello there, how are you?"
+    chunks = list(stream_model("Hello"))
+    assert len(chunks) > 1
+    assert "".join(chunks) == "Hello there, how are you?"
+
+
+def test_stream_model_caches_complete_responses(backend: FakeBackend, tmp_path):
+    previous = get_cache()
+    set_cache(ResponseCache(tmp_path / "cache.sqlite"))
+    try:
+        backend.responder = lambda model, messages: "Hello there."
+        stream = stream_model("Hello")
+        next(stream)
+        stream.close()
+        assert run_model("Hello") == "Hello there."
+        assert len(backend.requests) == 2
+
+        backend.responder = lambda model, messages: "Something else."
+        assert list(stream_model("Hello")) == ["Hello there."]
+    finally:
+        set_cache(previous)
+
+
+def test_astream_model_records_cancelled_streams(backend: FakeBackend, tmp_path):
+    previous = get_cache()
+    set_cache(ResponseCache(tmp_path / "cache.sqlite"))
+    backend.responder = lambda model, messages: "Hello there, how are you doing?"
+
+    async def first_chunk():
+        stream = astream_model("Hello", stage="rewrite")
+        chunk = await anext(stream)
+        await stream.aclose()
+        return chunk
+
+    async def all_chunks():
+        return [chunk async for chunk in astream_model("Hello", stage="rewrite")]
+
+    try:
+        with track_usage() as tracker:
+            assert asyncio.run(first_chunk()) == "Hello"
+        (record,) = tracker.records
+        assert not record.cache_hit
+        assert record.completion_tokens == len("Hello") // 4
+        # The partial response isn't cached
+        assert len(get_cache()) == 0
+
+        chunks = asyncio.run(all_chunks())
+        assert len(chunks) > 1
+        assert "".join(chunks) == "Hello there, how are you doing?"
+        assert asyncio.run(all_chunks()) == ["Hello there, how are you doing?"]
+        assert len(backend.requests) == 2
+    finally:
+        set_cache(previous)
@@ -0,0 +1,77 @@
+import pytest
+
+import cai.principles
+from cai.critique_rewrite import get_critique_prompt, get_examples_system_prompt
+from cai.models import ConversationInput
+from cai.principles import acrostic_principle, get_principle, register_principle
+from cai.runner import run_matrix_evaluation
+from cai.versioning import add_to_dev_examples, list_examples_versions, load_examples
+
+ADAPTIVE_REWRITE = "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent."
+CAT_REWRITE = "Cats. Are. Tiny."
+
+
+@pytest.fixture
+def cat_principle(monkeypatch):
+    monkeypatch.setattr(cai.principles, "_principles", dict(cai.principles._principles))
+    register_principle(acrostic_principle("cat", "CAT"))
+    return "cat"
+
+
+def test_get_principle():
+    assert get_principle().name == "adaptive"
+    with pytest.raises(ValueError):
+        get_principle("unknown")
+
+
+def test_acrostic_principle(cat_principle):
+    principle = get_principle(cat_principle)
+
+    assert principle.verifier(CAT_REWRITE) == (True, "CAT")
+    assert "'CAT'" in get_critique_prompt("prompt", "answer", cat_principle)
+
+
+def test_principle_has_its_own_examples(examples_path, cat_principle):
+    add_to_dev_examples("prompt", "answer", "critique", CAT_REWRITE, cat_principle)
+
+    assert load_examples("dev") == []
+    assert [e.rewrite for e in load_examples("dev", cat_principle)] == [CAT_REWRITE]
+    assert (examples_path / "cat" / "store" / "manifests" / "dev.txt").exists()
+    assert list_examples_versions(cat_principle) == ["dev"]
+    assert CAT_REWRITE in get_examples_system_prompt("dev", cat_principle)
+    assert CAT_REWRITE not in get_examples_system_prompt("dev")
+
+
+def test_matrix_evaluation(examples_path, cat_principle, backend):
+    def respond(model, messages):
+        prompt = messages[-1]["content"]
+        if not prompt.rstrip().endswith("Rewrite:"):
+            return "Critique."
+        return CAT_REWRITE if "'CAT'" in prompt else ADAPTIVE_REWRITE
+
+    backend.responder = respond
+    conversation = ConversationInput(human_prompt="prompt", assistant_answer="Nope.")
+    eval_data = [
+        conversation,
+        ConversationInput(human_prompt="other", assistant_answer=CAT_REWRITE),
+        conversation,
+    ]
+
+    report = run_matrix_evaluation(eval_data, "dev", concurrency=4, skip_compliant=True)
+
+    assert report.principles == ["adaptive", "cat"]
+    assert report.versions == {"adaptive": "dev", "cat": "dev"}
+    assert report.reports["cat"].principle == "cat"
+    assert [r.follows_principle for r in report.reports["adaptive"].results] == [
+        True,
+        True,
+        True,
+    ]
+    cat_results = report.reports["cat"].results
+    assert [r.human_prompt for r in cat_results] == ["prompt", "other", "prompt"]
+    assert cat_results[1].llm_skipped
+    assert report.accuracy == 1.0
+    # The duplicated conversation is evaluated once per principle, and the
+    # compliant answer is only rewritten for the principle it doesn't follow
+    assert len(backend.requests) == 2 * 3
+    assert report.usage["rewrite"].calls == 3
@@ -0,0 +1,57 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from cai.eval import build_eval_report, load_eval_report
+from cai.models import EvaluationResult
+from cai.rescore import find_reports, format_rescore_diff, rescore_reports
+
+ADAPTIVE_REWRITE = "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent."
+
+
+def write_stale_report(eval_dir: Path, version: str) -> Path:
+    results = [
+        EvaluationResult(
+            human_prompt=f"prompt {i}",
+            assistant_answer="answer",
+            critique="critique",
+            rewrite=rewrite,
+            follows_principle=False,
+            first_letters="STALE",
+        )
+        for i, rewrite in enumerate([ADAPTIVE_REWRITE, "Nope."])
+    ]
+    report = build_eval_report(results, version)
+    path = eval_dir / f"eval_report_{version}_{report.timestamp}.json"
+    path.write_text(json.dumps(report.model_dump()))
+    return path
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_rescore_writes_sidecars(tmp_path: Path, processes: int):
+    paths = [write_stale_report(tmp_path, v) for v in ("v1", "v2")]
+
+    results = rescore_reports(find_reports(tmp_path), processes=processes)
+
+    assert [r.path for r in results] == paths
+    assert [c.index for c in results[0].changes] == [0]
+    assert results[0].letters_changed == 1
+    rescored = load_eval_report(results[0].output_path)
+    assert rescored.accuracy == 0.5
+    assert [r.first_letters for r in rescored.results] == ["ADAPTIVE", "N"]
+    assert load_eval_report(paths[0]).accuracy == 0.0
+    # Sidecars are not rescored again
+    assert find_reports(tmp_path) == paths
+    diff = format_rescore_diff(results)
+    assert "accuracy 0.0% -> 50.0%" in diff
+    assert "#1 FAIL -> pass (STALE -> ADAPTIVE)" in diff
+
+
+def test_rescore_in_place(tmp_path: Path):
+    path = write_stale_report(tmp_path, "v1")
+
+    (result,) = rescore_reports([path], in_place=True)
+
+    assert result.output_path == path
+    assert load_eval_report(path).accuracy == 0.5
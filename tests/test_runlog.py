@@ -0,0 +1,57 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+import cai.runner
+from cai.runlog import RunLog, get_item_id, list_runs
+from cai.runner import run_evaluation
+
+
+@pytest.fixture
+def evaluated(monkeypatch) -> list[str]:
+    evaluated = []
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        evaluated.append(human_prompt)
+        if human_prompt == "prompt 3" and len(evaluated) < 5:
+            raise RuntimeError("API error")
+        await asyncio.sleep(0)
+        return "critique", "Nope."
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+    return evaluated
+
+
+def test_interrupted_run_resumes_from_log(tmp_path: Path, evaluated, make_eval_data):
+    eval_data = make_eval_data(5)
+    run_log = RunLog("v1_run", runs_path=tmp_path)
+
+    with pytest.raises(RuntimeError):
+        run_evaluation(eval_data, "v1", concurrency=1, run_log=run_log)
+    assert len(run_log.completed("v1")) == 3
+
+    results = run_evaluation(eval_data, "v1", concurrency=1, run_log=run_log)
+
+    assert [r.human_prompt for r in results] == [f"prompt {i}" for i in range(5)]
+    # Only the failed item and the ones after it were evaluated again
+    assert evaluated[3:] == ["prompt 3", "prompt 3", "prompt 4"]
+    assert run_log.version == "v1"
+    assert list_runs(tmp_path) == ["v1_run"]
+    report = run_log.build_report(eval_data, "v1")
+    assert [r.human_prompt for r in report.results] == [f"prompt {i}" for i in range(5)]
+
+
+def test_run_log_ignores_truncated_line(tmp_path: Path, evaluated, make_eval_data):
+    eval_data = make_eval_data(2)
+    run_log = RunLog("v1_run", runs_path=tmp_path)
+    run_evaluation(eval_data[:1], "v1", run_log=run_log)
+    # A crash in the middle of a write
+    with run_log.path.open("a", encoding="utf-8") as f:
+        f.write('{"run_id": "v1_run", "vers')
+
+    assert list(run_log.completed("v1")) == [get_item_id(eval_data[0])]
+    assert run_log.completed("v2") == {}
+
+    run_evaluation(eval_data, "v1", run_log=run_log)
+    assert len(run_log.completed("v1")) == 2
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+import cai.runner
+from cai.runner import iter_evaluation, run_evaluation, run_version_comparison
+
+ADAPTIVE_REWRITE = "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent."
+
+
+def test_run_evaluation_keeps_input_order(monkeypatch, make_eval_data):
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        # Later items finish first
+        index = int(human_prompt.split()[-1])
+        await asyncio.sleep(0.01 * (10 - index))
+        return f"critique {index}", ADAPTIVE_REWRITE if index % 2 else "Nope."
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+
+    results = run_evaluation(make_eval_data(10), version="v0", concurrency=10)
+
+    assert [r.human_prompt for r in results] == [f"prompt {i}" for i in range(10)]
+    assert [r.follows_principle for r in results] == [i % 2 == 1 for i in range(10)]
+    assert results[1].first_letters == "ADAPTIVE"
+
+
+def test_run_evaluation_respects_concurrency(monkeypatch, make_eval_data):
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return "critique", ADAPTIVE_REWRITE
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+
+    results = run_evaluation(make_eval_data(20), version="v0", concurrency=4)
+
+    assert len(results) == 20
+    assert max_in_flight == 4
+
+
+def test_iter_evaluation_cancels_in_flight_work_when_closed(
+    monkeypatch, make_eval_data
+):
+    started, finished, cancelled = [], [], []
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        started.append(human_prompt)
+        try:
+            await asyncio.sleep(0 if human_prompt == "prompt 0" else 10)
+        except asyncio.CancelledError:
+            cancelled.append(human_prompt)
+            raise
+        finished.append(human_prompt)
+        return "critique", "Nope."
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+
+    results = iter_evaluation(make_eval_data(10), version="v0", concurrency=5)
+    for _ in results:
+        break
+    results.close()
+
+    assert finished == ["prompt 0"]
+    assert sorted(cancelled) == sorted(set(started) - set(finished))
+    assert len(cancelled) >= 4
+
+
+def test_run_evaluation_invalid_concurrency(make_eval_data):
+    with pytest.raises(ValueError):
+        run_evaluation(make_eval_data(1), version="v0", concurrency=0)
+
+
+def test_run_evaluation_skips_compliant_answers(monkeypatch, make_eval_data):
+    calls = []
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        assert not options["skip_compliant"]
+        calls.append(human_prompt)
+        return "critique", "Nope."
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+    eval_data = make_eval_data(2)
+    eval_data[1].assistant_answer = ADAPTIVE_REWRITE
+
+    results = run_evaluation(eval_data, version="v0", skip_compliant=True)
+
+    assert calls == ["prompt 0"]
+    assert [r.llm_skipped for r in results] == [False, True]
+    assert results[1].rewrite == ADAPTIVE_REWRITE
+    assert results[1].follows_principle
+    assert results[1].usage == {}
+
+    results = run_evaluation(eval_data, version="v0")
+
+    assert not any(r.llm_skipped for r in results)
+    assert not results[1].follows_principle
+
+
+def test_run_version_comparison(monkeypatch, make_eval_data):
+    calls = []
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        calls.append((human_prompt, version))
+        await asyncio.sleep(0)
+        index = int(human_prompt.split()[-1])
+        # v1 passes even items, v2 passes the first two
+        passing = index % 2 == 0 if version == "v1" else index < 2
+        return "critique", ADAPTIVE_REWRITE if passing else "Nope."
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+
+    report = run_version_comparison(make_eval_data(4), ["v1", "v2"], concurrency=2)
+
+    assert report.baseline == "v1"
+    assert report.fixes == {"v2": [1]}
+    assert report.breaks == {"v2": [2]}
+    assert report.summaries["v1"].accuracy == report.summaries["v2"].accuracy == 0.5
+    assert report.items[1].follows_principle == {"v1": False, "v2": True}
+    # Versions progress side by side rather than one after the other
+    assert calls[:2] == [("prompt 0", "v1"), ("prompt 0", "v2")]
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from cai import scheduler as scheduler_module
+from cai.scheduler import (
+    AdaptiveConcurrency,
+    RetryPolicy,
+    Scheduler,
+    TokenBucket,
+    get_scheduler,
+    is_retryable,
+    retry_after,
+)
+
+
+class FakeResponse:
+    def __init__(self, headers: dict):
+        self.headers = headers
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code: int, headers: dict | None = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = FakeResponse(headers or {})
+
+
+def test_error_classification():
+    assert is_retryable(FakeAPIError(429))
+    assert is_retryable(FakeAPIError(503))
+    assert is_retryable(ConnectionError())
+    assert not is_retryable(FakeAPIError(400))
+    assert not is_retryable(ValueError())
+    assert retry_after(FakeAPIError(429, {"retry-after": "2"})) == 2.0
+    assert retry_after(FakeAPIError(429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after(FakeAPIError(429)) is None
+    assert retry_after(FakeAPIError(429, {"retry-after": "soon"})) is None
+
+
+def test_token_bucket_paces_requests():
+    now = 0.0
+    bucket = TokenBucket(rate_per_minute=60, capacity=2, clock=lambda: now)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.reserve() == pytest.approx(2.0)
+    now = 10.0
+    assert bucket.reserve() == 0.0
+
+
+def test_scheduler_retries_transient_errors():
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeAPIError(429, {"retry-after-ms": "1"})
+        return "ok"
+
+    scheduler = Scheduler(retry=RetryPolicy(base_delay=0.001))
+    assert scheduler.run(request) == "ok"
+    assert len(attempts) == 3
+    assert scheduler.concurrency.limit < 16
+
+
+def test_scheduler_raises_non_retryable_errors():
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        raise FakeAPIError(400)
+
+    scheduler = Scheduler(retry=RetryPolicy(base_delay=0.001))
+    with pytest.raises(FakeAPIError):
+        asyncio.run(scheduler.arun(request))
+    assert len(attempts) == 1
+    assert scheduler.concurrency.in_flight == 0
+
+
+def test_scheduler_gives_up_after_max_attempts():
+    scheduler = Scheduler(retry=RetryPolicy(max_attempts=3, base_delay=0.001))
+
+    async def request():
+        raise FakeAPIError(500)
+
+    with pytest.raises(FakeAPIError):
+        asyncio.run(scheduler.arun(request))
+
+
+def test_adaptive_concurrency_limits_in_flight_requests():
+    concurrency = AdaptiveConcurrency(initial=3, maximum=3)
+    scheduler = Scheduler(concurrency=concurrency)
+    in_flight = 0
+    max_in_flight = 0
+
+    async def request():
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    async def main():
+        await asyncio.gather(*[scheduler.arun(request) for _ in range(12)])
+
+    asyncio.run(main())
+    assert max_in_flight == 3
+    assert concurrency.in_flight == 0
+
+
+def test_adaptive_concurrency_aimd():
+    concurrency = AdaptiveConcurrency(initial=8, maximum=10, cooldown=0)
+    concurrency.on_throttle()
+    assert concurrency.limit == 4
+    for _ in range(4):
+        concurrency.on_success(latency=0.1)
+    assert 4.9 < concurrency.limit < 5.1
+
+    concurrency.target_latency = 1.0
+    concurrency.on_success(latency=2.0)
+    assert 4.9 < concurrency.limit < 5.1
+
+
+def test_get_scheduler_reads_environment(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "_scheduler", None)
+    monkeypatch.setenv("CAI_MAX_CONCURRENCY", "4")
+    monkeypatch.setenv("CAI_TARGET_LATENCY", "2.5")
+    concurrency = get_scheduler().concurrency
+    assert concurrency.limit == 4
+    assert concurrency.maximum == 4
+    assert concurrency.target_latency == 2.5
@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from cai.datasets import open_dataset
+from cai.similarity import (
+    SimilarityIndex,
+    cluster,
+    filter_near_duplicates,
+    get_reference_index,
+    vectorize,
+)
+from cai.versioning import add_to_dev_examples
+
+
+def test_vectorize():
+    vectors = vectorize(["Write a poem.", "write a POEM", "Explain fusion", ""])
+
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1)
+    assert vectors[0] @ vectors[1] == pytest.approx(1)
+    assert vectors[0] @ vectors[2] < 0.5
+    assert not vectors[3].any()
+
+
+def test_filter_near_duplicates():
+    index = SimilarityIndex(["Explain how nuclear fusion works."])
+    candidates = [
+        "Write a poem about the sea.",
+        "Explain how nuclear fusion works!",
+        "Write a poem about the sea, please",
+        "Give me a recipe for pancakes.",
+    ]
+
+    assert filter_near_duplicates(candidates, 0.9, [index]) == [0, 3]
+    assert filter_near_duplicates(candidates, 1.01) == [0, 1, 2, 3]
+
+
+def test_cluster():
+    texts = [
+        "Write a poem about the sun",
+        "Explain nuclear fusion simply",
+        "Write a poem about the moon",
+        "Explain nuclear fission simply",
+        "Write a poem about the stars",
+    ]
+
+    assert [sorted(c) for c in cluster(texts, 2)] == [[0, 2, 4], [1, 3]]
+    assert sorted(i for c in cluster(texts, 10) for i in c) == [0, 1, 2, 3, 4]
+    assert cluster([], 3) == []
+
+
+def test_search_large_index():
+    rng = np.random.default_rng(0)
+    texts = [
+        " ".join(f"word{i}" for i in row)
+        for row in rng.integers(1000, size=(20_000, 12))
+    ]
+    index = SimilarityIndex(texts[:15_000])
+    index.add(texts[15_000:])
+
+    assert len(index) == 20_000
+    (text, score), *others = index.search(texts[17_345], k=3)
+    assert text == texts[17_345]
+    assert score == pytest.approx(1)
+    assert all(other_score < score for _, other_score in others)
+    assert index.max_similarity([texts[42], "unrelated"]).tolist()[0] == pytest.approx(
+        1
+    )
+
+
+def test_reference_index_follows_examples(examples_path: Path):
+    test_prompts = [c.human_prompt for c in open_dataset("test")]
+    assert get_reference_index().texts == test_prompts
+
+    add_to_dev_examples("New prompt", "answer", "critique", "rewrite")
+
+    assert get_reference_index().texts == ["New prompt", *test_prompts]
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import cai.runner
+from cai.eval import build_eval_report
+from cai.models import EvaluationResult
+from cai.runner import run_sequential_evaluation
+from cai.stopping import StoppingRule, wilson_interval
+
+ADAPTIVE_REWRITE = "Apples. Dogs. Awesome. Pets. Time. Ice. Very. Excellent."
+
+
+def make_report(passing: int, failing: int):
+    results = [
+        EvaluationResult(
+            human_prompt="p",
+            assistant_answer="a",
+            critique="c",
+            rewrite="r",
+            follows_principle=i < passing,
+            first_letters="",
+        )
+        for i in range(passing + failing)
+    ]
+    return build_eval_report(results, "v0")
+
+
+@pytest.fixture
+def evaluated(monkeypatch) -> list[str]:
+    evaluated = []
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        evaluated.append(human_prompt)
+        await asyncio.sleep(0)
+        return "critique", ADAPTIVE_REWRITE
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+    return evaluated
+
+
+def test_wilson_interval():
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+    low, high = wilson_interval(50, 100)
+    assert low == pytest.approx(0.4038, abs=1e-4)
+    assert high == pytest.approx(0.5962, abs=1e-4)
+    assert wilson_interval(10, 10)[1] == 1.0
+
+
+def test_rule_waits_for_min_items():
+    rule = StoppingRule(max_width=1.0, min_items=5)
+
+    assert rule.check(4, 4)[0] is None
+    assert rule.check(5, 5)[0] == "interval_width"
+
+
+def test_sequential_evaluation_stops_against_baseline(evaluated, make_eval_data):
+    rule = StoppingRule(max_width=0.01, min_items=5, baseline=make_report(2, 18))
+
+    report = run_sequential_evaluation(
+        make_eval_data(200), "v1", rule, concurrency=1, seed=0
+    )
+
+    assert report.stopping.reason == "better_than_baseline"
+    assert report.stopping.items_evaluated == len(report.results) == 5
+    # The item scheduled in the meantime is cancelled before it starts
+    assert len(evaluated) == 5
+    assert report.stopping.baseline_accuracy == 0.1
+    # Items are evaluated in random order
+    assert evaluated != [f"prompt {i}" for i in range(len(evaluated))]
+
+
+def test_sequential_evaluation_runs_out_of_items(evaluated, make_eval_data):
+    rule = StoppingRule(max_width=0.01)
+
+    report = run_sequential_evaluation(make_eval_data(10), "v1", rule, seed=0)
+
+    assert report.stopping.reason == "exhausted"
+    assert sorted(evaluated) == sorted(f"prompt {i}" for i in range(10))
+    assert report.accuracy == 1.0
+
+
+def test_sequential_evaluation_cancels_items_in_flight(monkeypatch, make_eval_data):
+    started, finished, cancelled = [], [], []
+
+    async def fake_pipeline(human_prompt, assistant_answer, version, **options):
+        started.append(human_prompt)
+        try:
+            await asyncio.sleep(0 if len(started) == 1 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(human_prompt)
+            raise
+        finished.append(human_prompt)
+        return "critique", ADAPTIVE_REWRITE
+
+    monkeypatch.setattr(cai.runner, "arun_critique_rewrite_pipeline", fake_pipeline)
+    rule = StoppingRule(max_width=1.0, min_items=1)
+
+    report = run_sequential_evaluation(make_eval_data(20), "v1", rule, concurrency=5)
+
+    assert report.stopping.items_evaluated == 1
+    assert len(started) == 5
+    assert sorted(cancelled) == sorted(set(started) - set(finished))
+    assert len(finished) == 1
@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from cai.backends import FakeBackend
+from cai.eval import build_eval_report
+from cai.llm import run_model
+from cai.models import ConversationInput, EvaluationReport
+from cai.runner import run_evaluation
+from cai.usage import estimate_cost, percentile, track_usage
+
+
+def test_estimate_cost():
+    assert estimate_cost("gpt-4o", 1_000_000, 0) == pytest.approx(2.50)
+    assert estimate_cost("gpt-4o-2024-08-06", 0, 1_000_000) == pytest.approx(10.00)
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 0) == pytest.approx(0.15)
+    # Cached prompt tokens are billed at a discount
+    assert estimate_cost("gpt-4o", 1_000_000, 0, 1_000_000) == pytest.approx(1.25)
+    assert estimate_cost("gpt-4o", 1_000_000, 0, batch=True) == pytest.approx(1.25)
+    assert estimate_cost("unknown-model", 1_000_000, 1_000_000) == 0.0
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50) == 3.0
+
+
+def test_track_usage_nests(backend: FakeBackend):
+    with track_usage() as outer:
+        run_model("one two three", stage="critique")
+        with track_usage() as inner:
+            run_model("four five", stage="rewrite")
+
+    assert list(inner.by_stage()) == ["rewrite"]
+    usage = outer.by_stage()
+    assert usage["critique"].calls == 1
+    assert usage["critique"].prompt_tokens == 3
+    assert usage["critique"].completion_tokens > 0
+    assert usage["critique"].cost_usd > 0
+    assert usage["rewrite"].prompt_tokens == 2
+
+
+def test_evaluation_report_usage(backend: FakeBackend):
+    eval_data = [
+        ConversationInput(human_prompt=f"prompt {i}", assistant_answer=f"answer {i}")
+        for i in range(4)
+    ]
+    results = run_evaluation(eval_data, version="v0", concurrency=2)
+    assert all(set(r.usage) == {"critique", "rewrite"} for r in results)
+    assert all(r.usage["critique"].calls == 1 for r in results)
+
+    report = build_eval_report(results, "v0")
+    assert report.usage["rewrite"].calls == 4
+    assert report.usage["rewrite"].latency_p95_s is not None
+    assert report.total_cost_usd == pytest.approx(
+        sum(stage.cost_usd for r in results for stage in r.usage.values())
+    )
+
+
+def test_reports_without_usage_still_load():
+    report_path = next((Path(__file__).parents[1] / "evals").glob("*.json"))
+    report = EvaluationReport(**json.loads(report_path.read_text()))
+    assert report.usage == {}
+    assert report.results[0].usage == {}
@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import cai.versioning
+from cai.critique_rewrite import get_examples_system_prompt
+from cai.versioning import (
+    add_to_dev_examples,
+    delete_example,
+    example_hash,
+    list_examples_versions,
+    load_examples,
+    reload_dev_from_version,
+    save_dev_version,
+    use_workspace,
+)
+
+
+def add_example(name: str) -> None:
+    add_to_dev_examples(f"prompt {name}", f"answer {name}", "critique", "rewrite")
+
+
+def test_load_examples_is_served_from_memory(examples_path: Path, monkeypatch):
+    add_example("a")
+    assert len(load_examples("dev")) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("examples should not be re-read from disk")
+
+    monkeypatch.setattr(cai.versioning, "open", fail, raising=False)
+    assert [e.human_prompt for e in load_examples("dev")] == ["prompt a"]
+
+
+def test_load_examples_reflects_writes(examples_path: Path):
+    add_example("a")
+    assert len(load_examples("dev")) == 1
+    add_example("b")
+    assert len(load_examples("dev")) == 2
+
+    version = save_dev_version()
+    delete_example(0, "dev")
+    assert [e.human_prompt for e in load_examples("dev")] == ["prompt b"]
+
+    reload_dev_from_version(version)
+    assert len(load_examples("dev")) == 2
+
+
+def test_load_examples_reflects_external_edits(examples_path: Path):
+    add_example("a")
+    assert len(load_examples("dev")) == 1
+    example = {
+        "human_prompt": "external",
+        "assistant_answer": "answer",
+        "critique": "critique",
+        "rewrite": "rewrite",
+    }
+    with open(examples_path / "ex_dev.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(example) + "\n")
+    assert [e.human_prompt for e in load_examples("dev")] == ["prompt a", "external"]
+
+
+def test_touched_legacy_files_keep_store_changes(examples_path: Path):
+    add_example("a")
+    legacy = {
+        "human_prompt": "legacy",
+        "assistant_answer": "answer",
+        "critique": "critique",
+        "rewrite": "rewrite",
+    }
+    (examples_path / "ex_v1.jsonl").write_text(json.dumps(legacy) + "\n")
+    reload_dev_from_version("v1")
+    add_example("b")
+    delete_example(0, "v1")
+
+    # Touching or copying a legacy file back doesn't revert the store
+    for path in examples_path.glob("ex_*.jsonl"):
+        os.utime(path, ns=(1, 1))
+    assert [e.human_prompt for e in load_examples("dev")] == ["legacy", "prompt b"]
+    assert load_examples("v1") == []
+
+    # New examples of the file are merged, deleted ones don't come back
+    other = {**legacy, "human_prompt": "new legacy"}
+    with open(examples_path / "ex_v1.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(other) + "\n")
+    assert [e.human_prompt for e in load_examples("v1")] == ["new legacy"]
+
+
+def test_system_prompt_follows_examples(examples_path: Path):
+    add_example("a")
+    system_prompt = get_examples_system_prompt("dev")
+    assert "prompt a" in system_prompt
+    assert get_examples_system_prompt("dev") is system_prompt
+
+    add_example("b")
+    assert "prompt b" in get_examples_system_prompt("dev")
+
+
+def test_versions_share_stored_examples(examples_path: Path):
+    add_example("a")
+    add_example("b")
+    v1 = save_dev_version()
+    v2 = save_dev_version()
+
+    objects = (examples_path / "store" / "objects.jsonl").read_text().splitlines()
+    assert len(objects) == 2
+    assert list_examples_versions() == ["dev", v1, v2]
+    assert (examples_path / "store" / "manifests" / f"{v2}.txt").read_text() == (
+        f"{example_hash(load_examples(v2)[0].model_dump())}\n"
+        f"{example_hash(load_examples(v2)[1].model_dump())}\n"
+    )
+
+    delete_example(0, v1)
+    assert [e.human_prompt for e in load_examples(v1)] == ["prompt b"]
+    assert len(load_examples(v2)) == 2
+
+
+def test_legacy_version_files_are_imported(examples_path: Path):
+    example = {
+        "human_prompt": "legacy",
+        "assistant_answer": "answer",
+        "critique": "critique",
+        "rewrite": "rewrite",
+    }
+    (examples_path / "ex_v3.jsonl").write_text(json.dumps(example) + "\n")
+
+    assert list_examples_versions() == ["dev", "v3"]
+    assert [e.human_prompt for e in load_examples("v3")] == ["legacy"]
+    reload_dev_from_version("v3")
+    assert [e.human_prompt for e in load_examples("dev")] == ["legacy"]
+    assert save_dev_version() == "v4"
+
+
+def test_workspaces_have_their_own_dev_version(examples_path: Path):
+    add_example("shared")
+    with use_workspace("alice"):
+        assert [e.human_prompt for e in load_examples()] == ["prompt shared"]
+        add_example("alice")
+        assert len(load_examples("dev")) == 2
+        assert "prompt alice" in get_examples_system_prompt("dev")
+        version = save_dev_version()
+
+    assert [e.human_prompt for e in load_examples()] == ["prompt shared"]
+    assert "prompt alice" not in get_examples_system_prompt("dev")
+    assert len(load_examples(version)) == 2
+    assert list_examples_versions() == ["dev", version]
+
+
+def _stress_worker(examples_path: Path, worker: int, n_adds: int) -> list[str]:
+    """Add examples to the shared dev version and save it, from another process."""
+    cai.versioning.EXAMPLES_PATH = examples_path
+    versions = []
+    for i in range(n_adds):
+        add_example(f"process {worker}-{i}")
+        versions.append(save_dev_version())
+    return versions
+
+
+def test_concurrent_writers_lose_nothing(examples_path: Path):
+    n_threads, n_processes, n_adds = 8, 3, 5
+
+    def write(worker: int) -> list[str]:
+        versions = []
+        for i in range(n_adds):
+            add_example(f"thread {worker}-{i}")
+            versions.append(save_dev_version())
+            if i == 0:
+                with use_workspace(f"user{worker}"):
+                    add_example(f"private {worker}")
+                    add_example(f"deleted {worker}")
+                    delete_example(len(load_examples()) - 1, "dev")
+        return versions
+
+    with ProcessPoolExecutor(n_processes) as processes:
+        process_futures = [
+            processes.submit(_stress_worker, examples_path, worker, n_adds)
+            for worker in range(n_processes)
+        ]
+        with ThreadPoolExecutor(n_threads) as threads:
+            versions = [v for vs in threads.map(write, range(n_threads)) for v in vs]
+        versions += [v for future in process_futures for v in future.result()]
+
+    # Every save got its own version, and every add reached the dev version
+    assert len(set(versions)) == (n_threads + n_processes) * n_adds
+    assert set(list_examples_versions()) == {"dev", *versions}
+    prompts = [e.human_prompt for e in load_examples("dev")]
+    assert len(prompts) == len(set(prompts)) == (n_threads + n_processes) * n_adds
+    assert not any(" private " in p or "deleted" in p for p in prompts)
+    # The shared dev version only grew, so each version is a prefix of the next
+    for version in versions:
+        saved = [e.human_prompt for e in load_examples(version)]
+        assert saved == prompts[: len(saved)]
+    for worker in range(n_threads):
+        with use_workspace(f"user{worker}"):
+            private = [e.human_prompt for e in load_examples()]
+            assert private[-1] == f"prompt private {worker}"
+            assert f"prompt deleted {worker}" not in private
+
+
+def test_readers_do_not_wait_for_writers(examples_path: Path):
+    add_example("a")
+    save_dev_version()
+    in_transaction, release = threading.Event(), threading.Event()
+
+    def write():
+        with cai.versioning._transaction(None):
+            in_transaction.set()
+            release.wait(10)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        assert in_transaction.wait(10)
+        # Drop the cached files, so that the reader has to read them
+        for cache in (cai.versioning._objects, cai.versioning._indexes):
+            cache.clear()
+        versions = []
+        reader = threading.Thread(
+            target=lambda: versions.append(
+                (list_examples_versions(), len(load_examples("v1")))
+            )
+        )
+        reader.start()
+        reader.join(5)
+        assert not reader.is_alive()
+        assert versions == [(["dev", "v1"], 1)]
+    finally:
+        release.set()
+        writer.join()